@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import threading
+from contextlib import redirect_stdout
+from os import path, urandom
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from lora import LoraConnection, AdrController
+from lora.exceptions import LoraRxTimeoutException, LoraTxTimeoutException, SerialConnectionException
+from lora.simulator import ChannelModel, SimulatedAir, SimulatedClock, SimulatedRN2483
+
+PROFILES = (("strong", 10.0, 1.0, 0.0), ("weak", -8.0, 1.5, 0.0), ("fading", 0.0, 4.0, 0.0),
+            ("lossy", 5.0, 1.0, 0.15))  # (name, SNR mean at 14 dBm over 125 kHz, SNR std, loss besides noise)
+START = ("sf9", 125, "4/5", 14)  # Settings both ends start with
+MESSAGE_BYTES = 1024
+ROUNDS = 12
+SPEEDUP = 20  # Simulated seconds per wall clock second
+
+
+def connect_pair(air: SimulatedAir) -> (LoraConnection, LoraConnection):
+    """A sender and a receiver with adaptive data rate, talking over simulated RN2483s on the same air"""
+    sf, bandwidth, coding_rate, power = START
+    with redirect_stdout(io.StringIO()):  # Silence the init command echo
+        return tuple(LoraConnection(SimulatedRN2483(air), sf=sf, bandwidth=bandwidth, coding_rate=coding_rate,
+                                    power=power, clock=air.clock, auto_timeouts=True, adr=AdrController())
+                     for _ in range(2))
+
+
+def simulate(snr_mean: float, snr_std: float, loss: float):
+    """Send ROUNDS messages and print the settings and throughput of each"""
+    air = SimulatedAir(ChannelModel(loss=loss, snr_mean=snr_mean, snr_std=snr_std, seed=1), SimulatedClock(SPEEDUP))
+    sender, receiver = connect_pair(air)
+    sent = threading.Event()
+
+    def receive():
+        while not sent.is_set():
+            try:
+                receiver.recv_message(2000)
+            except (LoraRxTimeoutException, SerialConnectionException):
+                pass  # The simulated watchdog can fire late on a busy host
+
+    receiver_thread = threading.Thread(target=receive, daemon=True)
+    receiver_thread.start()
+
+    print("{:8}{:24}{:8}{:8}{:10}{}".format("Round", "Settings", "SNR", "Loss", "Bits/s", "uJ/bit (model)"))
+    for i in range(ROUNDS):
+        settings = sender.radio_settings()
+        t_start = air.clock.time()
+        try:
+            stats = sender.send_message(urandom(MESSAGE_BYTES), max_tries=10)
+        except LoraTxTimeoutException:
+            print("{:<8}{:24}{}".format(i, "/".join(map(str, settings)), "failed"))
+            continue
+        bits_per_s = 8 * MESSAGE_BYTES / (air.clock.time() - t_start)
+        print("{:<8}{:24}{:<8.1f}{:<8.0%}{:<10}{:.2f}".format(i, "/".join(map(str, settings)), stats.snr,
+                                                             stats.loss_count() / stats.tx_count, int(bits_per_s),
+                                                             sender.adr.energy_per_bit(settings)))
+    sent.set()
+    receiver_thread.join(3)
+
+
+def main():
+    print(f"Adaptive data rate, {MESSAGE_BYTES} byte messages stop-and-wait, starting at {'/'.join(map(str, START))}")
+    for name, snr_mean, snr_std, loss in PROFILES:
+        print(f"\n{name}: SNR {snr_mean} +- {snr_std} dB, {loss:.0%} loss besides noise")
+        simulate(snr_mean, snr_std, loss)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import tarfile
+from contextlib import redirect_stdout
+from os import path
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from lora import LinkPlanner
+from payload_codec import encode_payload, decode_payload, stage_ends, RawCodec, DeflateCodec, JpegCodec, WebpCodec, ThumbnailCodec, \
+    ProgressiveCodec
+
+REPO = path.join(path.dirname(path.abspath(__file__)), '..')
+IMAGES = (path.join(REPO, 'pi', 'christian.jpg'), path.join(REPO, 'image_transfer', 'received_image.png'))
+CODECS = (("raw", RawCodec()), ("deflate", DeflateCodec()), ("jpeg", JpegCodec()), ("webp", WebpCodec()),
+          ("thumb+raw", ThumbnailCodec()), ("thumb+webp", ThumbnailCodec(WebpCodec())),
+          ("progressive", ProgressiveCodec()))
+SF = "sf7"
+BANDWIDTH = 250
+
+
+def tar_gz(file_name: str) -> bytes:
+    """The .tar.gz SendImage used to send"""
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode="w:gz") as tar:
+        tar.add(file_name, path.basename(file_name))
+    return tar_buffer.getvalue()
+
+
+def main():
+    planner = LinkPlanner(SF, BANDWIDTH)
+    print(f"Bytes on air for each encoding, {SF}/{BANDWIDTH} kHz, stop-and-wait segments\n")
+    for file_name in IMAGES:
+        with open(file_name, "rb") as f:
+            image = f.read()
+        print(f"{path.relpath(file_name, REPO)} ({len(image)} bytes)")
+        print("{:24}{:10}{:10}{:14}{:8}{}".format("Encoding", "Payload", "On air", "Airtime (ms)", "Stages",
+                                                  "First stage (ms)"))
+
+        payloads = [("tar.gz", tar_gz(file_name))]
+        for name, codec in CODECS:
+            with redirect_stdout(io.StringIO()) as out:
+                payload = encode_payload(image, codec)
+            fallback = " (fallback)" if out.getvalue() else ""
+            payloads.append((name + fallback, payload))
+
+        for name, payload in payloads:
+            on_air = len(payload) + planner.segment_count(len(payload)) * planner.header_bytes()
+            if name == "tar.gz":
+                stages, first_stage = "-", "-"
+            else:
+                stages = len(decode_payload(payload))
+                first_stage = int(planner.airtime(stage_ends(payload)[0]))
+            print("{:24}{:<10}{:<10}{:<14}{:<8}{}".format(name, len(payload), on_air,
+                                                          int(planner.airtime(len(payload))), stages, first_stage))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import threading
+from contextlib import redirect_stdout
+from os import path, urandom
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from lora import LoraConnection
+from lora.exceptions import LoraRxTimeoutException, SerialConnectionException
+from lora.fec import FrameCodec
+from lora.simulator import ChannelModel, SimulatedAir, SimulatedClock, SimulatedRN2483
+
+CHANNELS = ((0.05, 0.0), (0.05, 2e-4), (0.05, 1e-3))  # (frame loss, bit error rate)
+SETUPS = (("plain", 0, 0), ("rs16", 16, 0), ("rs16+xor4", 16, 4))  # (name, parity bytes per frame, parity group)
+PAYLOAD_BYTES = 16 * 1024
+WINDOW = 8
+SPEEDUP = 10  # Simulated seconds per wall clock second
+SF = "sf7"
+BANDWIDTH = 250
+
+
+def connect_pair(air: SimulatedAir, parity_bytes: int, parity_group: int) -> (LoraConnection, LoraConnection):
+    """Two LoraConnections talking over simulated RN2483s on the same air"""
+    with redirect_stdout(io.StringIO()):  # Silence the init command echo
+        return tuple(LoraConnection(SimulatedRN2483(air), sf=SF, bandwidth=BANDWIDTH, clock=air.clock,
+                                    auto_timeouts=True, fec=FrameCodec(parity_bytes) if parity_bytes else None,
+                                    parity_group=parity_group)
+                     for _ in range(2))
+
+
+def measure(loss: float, bit_error_rate: float, parity_bytes: int, parity_group: int,
+            payload: bytes) -> (float, int, int, int):
+    """Send payload over a channel with the given loss and bit errors
+    Returns:
+        (effective bits/s, retransmissions, segments rebuilt from parity, bytes delivered corrupted)
+    """
+    air = SimulatedAir(ChannelModel(loss=loss, bit_error_rate=bit_error_rate, seed=1), SimulatedClock(SPEEDUP))
+    sender, receiver = connect_pair(air, parity_bytes, parity_group)
+    received = bytearray()
+    sent = threading.Event()
+
+    def receive():
+        # Keep answering after the last segment, in case its ACK is lost
+        while not sent.is_set():
+            try:
+                received.extend(receiver.recv_message(1000, window=WINDOW).message)
+            except (LoraRxTimeoutException, SerialConnectionException):
+                pass  # The simulated watchdog can fire late on a busy host
+
+    receiver_thread = threading.Thread(target=receive, daemon=True)
+    receiver_thread.start()
+
+    t_start = air.clock.time()
+    stats = sender.send_message(payload, max_tries=20, window=WINDOW)
+    t_send = air.clock.time() - t_start
+    sent.set()
+    receiver_thread.join(2)
+
+    corrupted = sum(a != b for a, b in zip(received, payload)) + abs(len(received) - len(payload))
+    return 8 * len(payload) / t_send, stats.loss_count(), receiver.recovered_count, corrupted
+
+
+def main():
+    payload = urandom(PAYLOAD_BYTES)
+    print(f"{PAYLOAD_BYTES} bytes, window {WINDOW}, {SF}/{BANDWIDTH} kHz\n")
+    print("{:8}{:10}{:12}{:10}{:10}{:10}{}".format("Loss", "BER", "FEC", "Bits/s", "Resent", "Rebuilt",
+                                                   "Corrupt bytes"))
+    for loss, bit_error_rate in CHANNELS:
+        for name, parity_bytes, parity_group in SETUPS:
+            bits_per_s, resent, rebuilt, corrupted = measure(loss, bit_error_rate, parity_bytes, parity_group, payload)
+            print("{:<8}{:<10}{:12}{:<10}{:<10}{:<10}{}".format(f"{loss:.0%}", bit_error_rate, name, int(bits_per_s),
+                                                               resent, rebuilt, corrupted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import tarfile
+import threading
+from contextlib import redirect_stdout
+from os import path
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from lora import LoraConnection, ThreeWayHandshake, Telemetry, RingBufferSink
+from lora.simulator import ChannelModel, SimulatedAir, SimulatedClock, SimulatedRN2483
+from lora_base import LoraBase
+
+IMAGE = path.join(path.dirname(path.abspath(__file__)), '..', 'pi', 'christian.jpg')
+SPEEDUP = 20  # Simulated seconds per wall clock second
+CHANNEL = ChannelModel(loss=0.05, bit_error_rate=1e-5, snr_mean=5, snr_std=3, seed=1)
+
+
+def tar_image(file_name: str) -> bytes:
+    """The image packed the way SendImage packs it"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        tar.add(file_name, arcname=path.basename(file_name))
+    return buffer.getvalue()
+
+
+def receive_image(basestation: LoraConnection, received: bytearray):
+    """Accept a connection and receive an image like BasestationReceiver does"""
+    if not ThreeWayHandshake(basestation).accept_conn():
+        return
+    basestation.recv_message(LoraBase._RX_TIMEOUT)
+    basestation.recv_stream(received.extend, LoraBase._FINISH_IMG_TRANS, LoraBase._RX_TIMEOUT)
+
+
+def main():
+    air = SimulatedAir(CHANNEL, SimulatedClock(SPEEDUP))
+    events = RingBufferSink(100000)
+    with redirect_stdout(io.StringIO()):  # Silence the init command echo
+        node = LoraConnection(SimulatedRN2483(air), clock=air.clock, telemetry=Telemetry([events], air.clock))
+        basestation = LoraConnection(SimulatedRN2483(air), clock=air.clock)
+
+    tar_bytes = tar_image(IMAGE)
+    received = bytearray()
+    receiver = threading.Thread(target=receive_image, args=(basestation, received), daemon=True)
+    receiver.start()
+
+    t_start = air.clock.time()
+    if not ThreeWayHandshake(node).request_conn():
+        print("3-way handshake failed.")
+        return
+    t_handshake = air.clock.time() - t_start
+    node.send_message(LoraBase._START_IMG_TRANS, LoraBase._MAX_TX_TRIES)
+    stats = node.send_stream(io.BytesIO(tar_bytes), LoraBase._MAX_TX_TRIES)
+    node.send_message(LoraBase._FINISH_IMG_TRANS, LoraBase._MAX_TX_TRIES)
+    t_total = air.clock.time() - t_start
+    receiver.join(1)
+
+    print(f"Sent {len(tar_bytes)} bytes in {t_total:.1f} simulated s ({t_handshake:.1f} s handshake), "
+          f"{t_total / SPEEDUP:.1f} s wall clock")
+    print(f"{stats.packet_count} packets, {stats.loss_count()} retransmissions, average ACK SNR {stats.snr:.1f} dB")
+    print(f"Per packet {stats.summary()}")
+    print("Node time by event: " + ", ".join(f"{kind} {seconds:.1f} s"
+                                              for kind, seconds in sorted(events.time_breakdown().items())))
+    print("Received image intact" if bytes(received) == tar_bytes else "ERROR: Received image differs")
+
+
+if __name__ == '__main__':
+    main()
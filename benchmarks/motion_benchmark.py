@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Relevance scores and CPU time per frame of the motion pre-filter on canned YUV420 frames of a synthetic scene, and
+CPU time to pick the frame take_burst keeps of a burst.
+Runs on x86. The node's Pi Zero runs the same numpy roughly an order of magnitude slower, which must still be a small
+part of its wake window. The frames are scored like take_pic scores them, each against a background of empty frames.
+"""
+
+import sys
+from os import path
+from time import process_time
+import numpy as np
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from motion_score import BackgroundModel, yuv420_luma, best_frame, BLOCK
+
+RESOLUTIONS = ((160, 120), (640, 480))  # The resolution take_pic scores at, and its full image resolution
+NOISE = 3  # Standard deviation of the sensor noise, in luma levels
+BACKGROUND_FRAMES = 5  # Empty frames the background is learned from
+REPEATS = 50  # Scoring is timed as the best of this many runs
+BURST_FRAMES = 8  # Frames in a burst, like take_picture.BURST_FRAMES
+SEED = 1
+
+
+def scene(resolution: tuple, rng) -> np.ndarray:
+    """Luma plane of an empty scene: a gradient of sky and ground with texture, the same at every resolution"""
+    width, height = resolution
+    cell = width // 80  # Pixels per side of the texture
+    rows = np.linspace(200, 60, height)[:, None]
+    texture = rng.normal(0, 20, (80, 60)).T.repeat(cell, 0).repeat(cell, 1)
+    return np.clip(rows + texture, 0, 255)
+
+
+def yuv420_frame(luma: np.ndarray, rng) -> bytes:
+    """Raw YUV420 frame with sensor noise, padded like the camera pads it"""
+    height, width = luma.shape
+    padded = np.zeros(((height + 15) // 16 * 16, (width + 31) // 32 * 32), dtype=np.uint8)
+    padded[:height, :width] = np.clip(luma + rng.normal(0, NOISE, luma.shape), 0, 255)
+    chroma = np.full(padded.size // 2, 128, dtype=np.uint8)
+    return padded.tobytes() + chroma.tobytes()
+
+
+def canned_frames(resolution: tuple, rng) -> (list, dict):
+    """Empty frames to learn the background from, and frames to score by name"""
+    width, height = resolution
+    empty = scene(resolution, rng)
+
+    sun = np.clip(empty * 1.3, 0, 255)
+    wind = empty.copy()  # Foliage at the bottom swaying by a few pixels
+    wind[height * 3 // 4:] = np.roll(empty[height * 3 // 4:], width // 160, axis=1)
+    animal = empty.copy()  # A dark animal covering a twentieth of the frame
+    animal[height // 2:height // 2 + height // 4, width // 3:width // 3 + width // 5] = 30
+
+    background = [yuv420_frame(empty, rng) for _ in range(BACKGROUND_FRAMES)]
+    frames = {"Empty": empty, "Sun": sun, "Wind": wind, "Animal": animal}
+    return background, {name: yuv420_frame(luma, rng) for name, luma in frames.items()}
+
+
+def canned_burst(resolution: tuple, rng) -> (list, list, int):
+    """Empty frames to learn the background from, and a burst of an animal walking into view, blurred by its motion
+    in every frame but the one it stops in, which is returned by index
+    """
+    width, height = resolution
+    empty = scene(resolution, rng)
+    animal = rng.normal(40, 25, (height // 4, width // 5))  # Dark with a texture of fur
+    sharp = BURST_FRAMES * 2 // 3
+    burst = []
+    for n in range(BURST_FRAMES):
+        luma = empty.copy()
+        left = width * n // (BURST_FRAMES + 2)
+        luma[height // 2:height // 2 + animal.shape[0], left:left + animal.shape[1]] = animal
+        if n != sharp:
+            blur = width // 40
+            luma = sum(np.roll(luma, shift, axis=1) for shift in range(blur)) / blur
+        burst.append(yuv420_frame(luma, rng))
+    return [yuv420_frame(empty, rng) for _ in range(BACKGROUND_FRAMES)], burst, sharp
+
+
+def trained_model(background: list, resolution: tuple) -> BackgroundModel:
+    """Model of the background with blocks covering the same part of the scene at every resolution"""
+    model = BackgroundModel(block=BLOCK * resolution[0] // RESOLUTIONS[0][0])
+    for frame in background:
+        model.score(yuv420_luma(frame, resolution))
+    return model
+
+
+def measure_scoring(background: list, frame: bytes, resolution: tuple) -> float:
+    """CPU seconds to score a raw frame, from its bytes"""
+    best = None
+    for _ in range(REPEATS):
+        model = trained_model(background, resolution)
+        t_start = process_time()
+        model.score(yuv420_luma(frame, resolution))
+        t = process_time() - t_start
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    for resolution in RESOLUTIONS:
+        background, frames = canned_frames(resolution, np.random.default_rng(SEED))
+        print("{}x{}, background of {} empty frames".format(*resolution, BACKGROUND_FRAMES))
+        print("{:10}{:12}{}".format("Frame", "Relevance", "CPU ms"))
+        for name, frame in frames.items():
+            relevance = trained_model(background, resolution).score(yuv420_luma(frame, resolution))
+            print("{:10}{:<12.3f}{:.2f}".format(name, relevance, 1000 * measure_scoring(background, frame, resolution)))
+        print()
+
+    resolution = RESOLUTIONS[-1]
+    background, burst, sharp = canned_burst(resolution, np.random.default_rng(SEED))
+    model = trained_model(background, resolution)
+    t_start = process_time()
+    best = best_frame([yuv420_luma(frame, resolution) for frame in burst], model)
+    t = process_time() - t_start
+    print("Burst of {} frames at {}x{}: kept frame {} ({}), {:.1f} CPU ms".format(
+        BURST_FRAMES, *resolution, best + 1, "sharp" if best == sharp else "blurred", 1000 * t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import threading
+from contextlib import redirect_stdout
+from os import path, urandom
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from lora import MultiNodeReceiver, PolledNode
+from lora.exceptions import LoraRxTimeoutException
+from lora.simulator import ChannelModel, SimulatedAir, SimulatedClock, SimulatedRN2483
+
+NODE_COUNTS = (2, 5, 20)
+NODE_BYTES = 4 * 1024  # Message each node uploads
+WINDOW = 8
+FRAME_LOSS = 0.05
+POLL_TIMEOUT = 300000  # ms, a polling round of 20 nodes takes about a minute
+SPEEDUP = 10  # Simulated seconds per wall clock second
+SF = "sf7"
+BANDWIDTH = 250
+
+
+def measure(n_nodes: int) -> (float, int, int):
+    """Let n_nodes nodes upload a message each to one basestation
+    Returns:
+        (aggregate bits/s, polls, missed polls)
+    """
+    air = SimulatedAir(ChannelModel(loss=FRAME_LOSS), SimulatedClock(SPEEDUP))
+    node_ids = list(range(1, n_nodes + 1))
+    payloads = {node_id: urandom(NODE_BYTES) for node_id in node_ids}
+    with redirect_stdout(io.StringIO()):  # Silence the init command echo
+        basestation = MultiNodeReceiver(SimulatedRN2483(air), sf=SF, bandwidth=BANDWIDTH, clock=air.clock,
+                                        node_ids=node_ids, window=WINDOW)
+        nodes = [PolledNode(SimulatedRN2483(air), sf=SF, bandwidth=BANDWIDTH, clock=air.clock, node_id=node_id,
+                            poll_timeout=POLL_TIMEOUT)
+                 for node_id in node_ids]
+
+    def upload(node: PolledNode):
+        node.send_message(payloads[node.node_id], max_tries=20)
+        node.finish()
+
+    threads = [threading.Thread(target=upload, args=(node,), daemon=True) for node in nodes]
+    for thread in threads:
+        thread.start()
+
+    t_start = air.clock.time()
+    t_done = None
+    received = {}
+    try:
+        while True:
+            node_message = basestation.recv_message(10000)
+            if node_message is None:
+                break
+            node_id, message = node_message
+            received[node_id] = message
+            if len(received) == n_nodes:
+                t_done = air.clock.time()
+    except LoraRxTimeoutException:
+        # Nodes whose DONE was lost stay absent rather than done, so the basestation stops when all are idle
+        if len(received) < n_nodes:
+            print("WARNING: Basestation timed out")
+    if t_done is None:
+        t_done = air.clock.time()
+
+    if received != payloads:
+        broken = sum(received.get(node_id) != payloads[node_id] for node_id in node_ids)
+        print(f"WARNING: {broken} of {n_nodes} messages not received intact")
+    sessions = basestation.sessions.values()
+    return (8 * NODE_BYTES * len(received) / (t_done - t_start), sum(s.polls for s in sessions),
+            sum(s.missed_polls for s in sessions))
+
+
+def main():
+    print(f"{NODE_BYTES} bytes per node, window {WINDOW}, {SF}/{BANDWIDTH} kHz, {FRAME_LOSS:.0%} frame loss\n")
+    print("{:10}{:10}{:10}{}".format("Nodes", "Bits/s", "Polls", "Missed"))
+    for n_nodes in NODE_COUNTS:
+        bits_per_s, polls, missed = measure(n_nodes)
+        print("{:<10}{:<10}{:<10}{}".format(n_nodes, int(bits_per_s), polls, missed))
+
+
+if __name__ == '__main__':
+    main()
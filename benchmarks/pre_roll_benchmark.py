@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Memory held by the pre-roll ring buffer and latency of extracting stills from it when the PIR triggers.
+Runs on a node, with its camera. For each memory bound, the buffer is left to fill and then triggered TRIGGERS times:
+once for just the still from before the trigger, and once more for it and the POST_FRAMES after.
+"""
+
+import sys
+from os import path
+from time import monotonic, sleep
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from picamera import PiCamera
+from pre_roll import PreRollBuffer, PRE_ROLL
+from take_picture import IMAGE_RES
+
+MAX_BYTES = (256 * 1024, 1024 * 1024, 4 * 1024 * 1024)  # Memory bounds of the ring buffer
+FRAMERATE = 5
+POST_FRAMES = 2
+TRIGGERS = 5
+FILL_TIME = 2 * PRE_ROLL  # Seconds of recording before the first trigger
+
+
+def held(buffer: PreRollBuffer) -> (int, int, float):
+    """Bytes, frames and seconds of video in the buffer"""
+    frames = buffer.frames()
+    timestamps = [frame.timestamp for frame in frames if frame.timestamp is not None]
+    seconds = (timestamps[-1] - timestamps[0]) / 1000000 if timestamps else 0
+    return buffer.stream.tell(), len(frames), seconds
+
+
+def measure_extraction(buffer: PreRollBuffer, after: int) -> (float, int):
+    """Milliseconds to extract the stills of a trigger, and their total bytes"""
+    t_start = monotonic()
+    stills = buffer.extract(after)
+    return 1000 * (monotonic() - t_start), sum(len(still) for still in stills)
+
+
+def main():
+    with PiCamera(resolution=IMAGE_RES, framerate=FRAMERATE) as camera:
+        print(f"{FRAMERATE} fps, {PRE_ROLL} s pre-roll, {POST_FRAMES} frames after each trigger\n")
+        print("{:10}{:10}{:8}{:10}{:14}{:14}{}".format(
+            "Bound KB", "Held KB", "Frames", "Seconds", "Before ms", "With after ms", "Stills KB"))
+        for max_bytes in MAX_BYTES:
+            with PreRollBuffer(camera, max_bytes=max_bytes) as buffer:
+                camera.wait_recording(FILL_TIME, splitter_port=buffer.splitter_port)
+                held_bytes, frame_count, seconds = held(buffer)
+                before = after = still_bytes = 0
+                for _ in range(TRIGGERS):
+                    before += measure_extraction(buffer, 0)[0] / TRIGGERS
+                    ms, size = measure_extraction(buffer, POST_FRAMES)
+                    after += ms / TRIGGERS
+                    still_bytes += size / TRIGGERS
+                    sleep(1 / FRAMERATE)
+                print("{:<10}{:<10.0f}{:<8}{:<10.1f}{:<14.1f}{:<14.1f}{:.1f}".format(
+                    max_bytes // 1024, held_bytes / 1024, frame_count, seconds, before, after, still_bytes / 1024))
+
+
+if __name__ == '__main__':
+    main()
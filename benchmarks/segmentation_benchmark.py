@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""CPU time per MB spent by a sender segmenting a message and formatting its 'radio tx' commands.
+Runs on x86 against the simulated RN2483. The node's Pi Zero runs the same Python roughly an order of magnitude
+slower, so its share of the link time is what matters: at the profile below, the fastest radio setting a node uses,
+the host must keep well below the time the frames spend on air.
+"""
+
+import io
+import sys
+import threading
+from binascii import hexlify
+from contextlib import redirect_stdout
+from os import path, urandom
+from time import process_time, thread_time
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from lora import LoraConnection, LinkPlanner
+from lora.exceptions import LoraRxTimeoutException, SerialConnectionException
+from lora.simulator import ChannelModel, SimulatedAir, SimulatedClock, SimulatedRN2483
+
+MESSAGE_BYTES = 512 * 1024
+RETRY_RATE = 0.1  # Fraction of segments sent twice in the formatting comparison
+SF = "sf7"  # Pi Zero node profile: the fastest radio setting, where the host CPU matters most
+BANDWIDTH = 500
+SPEEDUP = 20  # Simulated seconds per wall clock second
+TRANSFER_BYTES = 64 * 1024  # Sent end-to-end through the simulator
+REPEATS = 5  # Formatting is timed as the best of this many runs
+MB = 1024 * 1024
+
+
+def format_copying(message: bytes, data_bytes: int):
+    """The previous sending path: every segment sliced out of the message, joined to its sequence number and
+    hex encoded into a new command, and all of it again for a retry"""
+    for n, seg_start in enumerate(range(0, len(message), data_bytes)):
+        for _ in range(2 if n % round(1 / RETRY_RATE) == 0 else 1):
+            segment = message[seg_start:seg_start + data_bytes]
+            frame = bytes([n & 0xFF]) + segment
+            command = b"radio tx " + hexlify(frame)
+            command + b"\r\n"
+
+
+def format_zero_copy(lora: LoraConnection, message: bytes, data_bytes: int):
+    """The LoraSerial sending path: segments viewed in the message and hex encoded into the reused command buffer,
+    which a retry sends as it is"""
+    view = memoryview(message)
+    for n, seg_start in enumerate(range(0, len(message), data_bytes)):
+        lora._format_tx(bytes([n & 0xFF]), view[seg_start:seg_start + data_bytes])
+
+
+def measure_formatting(format_message, *args) -> float:
+    """CPU seconds per MB to format every command of a message"""
+    best = None
+    for _ in range(REPEATS):
+        t_start = process_time()
+        format_message(*args)
+        t = process_time() - t_start
+        best = t if best is None else min(best, t)
+    return best * MB / MESSAGE_BYTES
+
+
+def measure_transfer(window: int) -> (float, float):
+    """CPU seconds per MB of the sending thread, and simulated seconds per MB, to send through the simulator"""
+    air = SimulatedAir(ChannelModel(), SimulatedClock(SPEEDUP))
+    with redirect_stdout(io.StringIO()):  # Silence the init command echo
+        sender, receiver = (LoraConnection(SimulatedRN2483(air), sf=SF, bandwidth=BANDWIDTH, clock=air.clock,
+                                           auto_timeouts=True) for _ in range(2))
+    payload = urandom(TRANSFER_BYTES)
+    sent = threading.Event()
+
+    def receive():
+        while not sent.is_set():
+            try:
+                receiver.recv_message(1000, window=window)
+            except (LoraRxTimeoutException, SerialConnectionException):
+                pass
+
+    receiver_thread = threading.Thread(target=receive, daemon=True)
+    receiver_thread.start()
+
+    t_start, t_sim_start = thread_time(), air.clock.time()
+    sender.send_message(payload, max_tries=20, window=window)
+    t_cpu, t_sim = thread_time() - t_start, air.clock.time() - t_sim_start
+    sent.set()
+    receiver_thread.join(2)
+    return t_cpu * MB / TRANSFER_BYTES, t_sim * MB / TRANSFER_BYTES
+
+
+def main():
+    message = urandom(MESSAGE_BYTES)
+    planner = LinkPlanner(SF, BANDWIDTH)
+    data_bytes = planner.FRAME_BYTES - planner.header_bytes()
+    airtime = planner.airtime(MB) / 1000
+    with redirect_stdout(io.StringIO()):
+        lora = LoraConnection(SimulatedRN2483(SimulatedAir(ChannelModel(), SimulatedClock(SPEEDUP))))
+
+    print(f"{SF}/{BANDWIDTH} kHz, {airtime:.0f} s on air per MB\n")
+    print(f"Formatting the commands of {MESSAGE_BYTES // 1024} KB, {RETRY_RATE:.0%} of segments sent twice")
+    print("{:12}{}".format("Path", "CPU ms/MB"))
+    print("{:12}{:.1f}".format("Copying", 1000 * measure_formatting(format_copying, message, data_bytes)))
+    print("{:12}{:.1f}".format("Zero-copy", 1000 * measure_formatting(format_zero_copy, lora, message, data_bytes)))
+
+    # The sending thread also runs the simulated module's parsing of each command
+    print(f"\nSending {TRANSFER_BYTES // 1024} KB through the simulated RN2483, lossless")
+    print("{:10}{:12}{}".format("Window", "CPU ms/MB", "Share of link time"))
+    for window in (1, 8):
+        cpu, link = measure_transfer(window)
+        print("{:<10}{:<12.1f}{:.2%}".format(window, 1000 * cpu, cpu / link))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from os import path, urandom
+from time import process_time
+import serial
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from lora.lora_serial import LineReader, decode_radio_rx
+
+LINES = 2000
+PAYLOAD_BYTES = 255
+READ_TIMEOUT = 3000  # ms
+TTY_BUFFER_BYTES = 4096  # Capacity of the terminal's input queue, writes beyond it block
+
+
+def canned_lines() -> list:
+    """'radio_rx' lines as the RN2483 reports full frames"""
+    return [b"radio_rx  " + urandom(PAYLOAD_BYTES).hex().upper().encode('ascii') + b"\r\n" for _ in range(LINES)]
+
+
+def read_per_byte(ser: serial.Serial) -> bytes:
+    """The previous LoraSerial reception path: one read and one str concatenation per byte"""
+    ser.timeout = READ_TIMEOUT / 1000
+    message = ""
+    while message[-2:] != "\r\n":
+        message += ser.read().decode('ascii')
+    return bytes.fromhex(message.rstrip("\r\n").lstrip("radio_rx "))
+
+
+def read_buffered(reader: LineReader) -> bytes:
+    """The LineReader reception path"""
+    return decode_radio_rx(reader.read_line(READ_TIMEOUT))
+
+
+def measure(read, source, lines: list) -> float:
+    """CPU seconds per line to read and decode lines fed through a pseudo terminal, the way the RN2483's
+    USB serial port delivers them"""
+    master, slave = os.openpty()
+    ser = serial.Serial(os.ttyname(slave), 57600)
+    reader = source(ser)
+    batch = TTY_BUFFER_BYTES // len(lines[0])
+    t_read = 0.0
+    for start in range(0, len(lines), batch):
+        os.write(master, b"".join(lines[start:start + batch]))
+        t_start = process_time()
+        for _ in lines[start:start + batch]:
+            read(reader)
+        t_read += process_time() - t_start
+
+    ser.close()
+    os.close(slave)
+    os.close(master)
+    return t_read / len(lines)
+
+
+def main():
+    lines = canned_lines()
+    print(f"{LINES} 'radio_rx' lines of {PAYLOAD_BYTES} byte frames through a pseudo terminal\n")
+    print("{:12}{}".format("Reader", "us/line"))
+    per_byte = measure(read_per_byte, lambda ser: ser, lines)
+    buffered = measure(read_buffered, LineReader, lines)
+    print("{:<12}{:.1f}".format("per byte", per_byte * 1e6))
+    print("{:<12}{:.1f}".format("buffered", buffered * 1e6))
+    print(f"\n{per_byte / buffered:.0f}x faster")
+
+
+if __name__ == '__main__':
+    main()
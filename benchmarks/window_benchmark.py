@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import threading
+from contextlib import redirect_stdout
+from os import path, urandom
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from lora import LoraConnection
+from lora.exceptions import LoraRxTimeoutException, SerialConnectionException
+from lora.simulator import ChannelModel, SimulatedAir, SimulatedClock, SimulatedRN2483
+
+WINDOW_SIZES = (1, 4, 8, 16)
+PAYLOAD_BYTES = 30 * 1024
+FRAME_LOSS = 0.05
+SPEEDUP = 10  # Simulated seconds per wall clock second
+SF = "sf7"
+BANDWIDTH = 250
+CONTINUOUS_GAP = 5  # ms between burst frames when the receiver keeps listening, see LoraSerial continuous_rx
+
+
+def connect_pair(air: SimulatedAir, continuous: bool) -> (LoraConnection, LoraConnection):
+    """A sender and a receiver talking over simulated RN2483s on the same air"""
+    with redirect_stdout(io.StringIO()):  # Silence the init command echo
+        sender = LoraConnection(SimulatedRN2483(air), sf=SF, bandwidth=BANDWIDTH, clock=air.clock, auto_timeouts=True,
+                                burst_gap=CONTINUOUS_GAP if continuous else None)
+        receiver = LoraConnection(SimulatedRN2483(air), sf=SF, bandwidth=BANDWIDTH, clock=air.clock,
+                                  auto_timeouts=True, continuous_rx=continuous)
+    return sender, receiver
+
+
+def measure(window: int, payload: bytes, continuous: bool = False) -> float:
+    """Send payload with the given window and return the effective bits/s"""
+    air = SimulatedAir(ChannelModel(loss=FRAME_LOSS), SimulatedClock(SPEEDUP))
+    sender, receiver = connect_pair(air, continuous)
+    received = bytearray()
+    sent = threading.Event()
+
+    def receive():
+        # Keep answering after the last segment, in case its ACK is lost
+        while not sent.is_set():
+            try:
+                received.extend(receiver.recv_message(1000, window=window).message)
+            except (LoraRxTimeoutException, SerialConnectionException):
+                pass  # The simulated watchdog can fire late on a busy host
+
+    receiver_thread = threading.Thread(target=receive, daemon=True)
+    receiver_thread.start()
+
+    t_start = air.clock.time()
+    sender.send_message(payload, max_tries=20, window=window)
+    t_send = air.clock.time() - t_start
+    sent.set()
+    receiver_thread.join(2)
+
+    if bytes(received) != payload:
+        print(f"WARNING: window {window} delivered {len(received)} of {len(payload)} bytes intact")
+    return 8 * len(payload) / t_send
+
+
+def main():
+    payload = urandom(PAYLOAD_BYTES)
+    print(f"{PAYLOAD_BYTES} bytes, {SF}/{BANDWIDTH} kHz, {FRAME_LOSS:.0%} frame loss\n")
+    print("{:10}{:10}{}".format("Window", "Bits/s", "Continuous rx"))
+    for window in WINDOW_SIZES:
+        print("{:<10}{:<10}{}".format(window, int(measure(window, payload)),
+                                      int(measure(window, payload, continuous=True))))
+
+
+if __name__ == '__main__':
+    main()
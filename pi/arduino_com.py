@@ -1,4 +1,5 @@
 import serial
+import threading
 import time
 
 
@@ -19,6 +20,8 @@ class ArduinoCom:
 
     def __init__(self):
         """Initialize serial communciation with the Arduino"""
+        # Keeps a command and its response together when several threads share the Arduino, e.g. on an armed node
+        self._lock = threading.RLock()
         try:
             print(f"Connecting to Arduino on '{self._SERIAL_PORT}'...", end='')
             self.ser = serial.Serial(self._SERIAL_PORT, self._BAUD, timeout=self._TIMEOUT)
@@ -53,7 +56,8 @@ class ArduinoCom:
 
     def set_time(self, minutes: int) -> str:
         # Need to get response two times, since arudino responds with two lines
-        return self.send_command(str(minutes)) + self.recv_response()
+        with self._lock:
+            return self.send_command(str(minutes)) + self.recv_response()
 
     def serial_ok(self) -> bool:
         """True if serial is connected ready to go, else false"""
@@ -74,8 +78,9 @@ class ArduinoCom:
         """Send command and wait for response"""
         if self.serial_ok():
             print(f"Sending command '{ command }' (ascii-code: { int.from_bytes(command.encode(), 'little') })")
-            self.ser.write(command.encode())
-            return self.recv_response()
+            with self._lock:
+                self.ser.write(command.encode())
+                return self.recv_response()
         else:
             print("Error: Can't send Arduino command. Serial not initialized.")
 
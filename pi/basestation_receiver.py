@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
-import tarfile
+import io
 import os
+import queue
+import struct
 import subprocess
+import threading
+import time
 from float_encode_decode import decode_float
 from lora_base import LoraBase
+from transfer_journal import TransferJournal, encode_ranges, FILE_FORMAT, OFFSET_FORMAT, OFFSET_BYTES
+from payload_codec import decode_payload, image_extension
 from gdrive import GdriveUploader
-from lora import ThreeWayHandshake
+from lora import ThreeWayHandshake, MultiNodeReceiver
+from lora.exceptions import LoraRxTimeoutException
 
 
 class BasestationReceiver(LoraBase):
@@ -14,8 +21,8 @@ class BasestationReceiver(LoraBase):
     Receive image/battery voltage class
     """
 
-    __RCVD_IMG = 'received_image.jpeg'
-    __RCVD_TAR = 'received_image.tar.gz'
+    __RCVD_IMG = 'received_image'  # Extension is added according to the received image format
+    __PART_EXT = '.part'  # Extension of the payload of an image while it is being received
     __BAT_FILE = 'battery_voltages.txt'
     __LINUX_SYS = 'linux'
     __WINDOWS_SYS = 'win32'
@@ -24,14 +31,62 @@ class BasestationReceiver(LoraBase):
     __WINDOWS_IMG_VWR = 'explorer'
     __APPLE_IMG_VWR = 'open'
 
+    _STOP_AFTER_STAGE = None  # Last stage of an image sent in stages to receive, None for the full image
+
     def __init__(self):
         """
         Class initializer
         """
         super().__init__()
         self.gdrive = GdriveUploader()
+        # Files to upload as (file, whether to overwrite it), by the upload worker, the only thread using gdrive
+        self._uploads = queue.Queue()
+        self._upload_worker = None
+
+    def upload(self, file_name: str, overwrite: bool = False):
+        """
+        Queue a file to be uploaded to GDrive in the background, in the order queued
+        Args:
+            overwrite: Whether to replace the file in GDrive, like the battery voltages, or upload it as a new one
+        """
+        if self._upload_worker is None:
+            self._upload_worker = threading.Thread(target=self._upload_queued, daemon=True)
+            self._upload_worker.start()
+        self._uploads.put((file_name, overwrite))
+
+    def wait_uploads(self):
+        """
+        Wait until every file queued so far has been uploaded
+        """
+        self._uploads.join()
+
+    def close_serial_conn(self):
+        """
+        Finish the uploads queued, and close the serial connection
+        """
+        if self._upload_worker is not None:
+            self._uploads.put((None, False))
+            self._upload_worker.join()
+            self._upload_worker = None
+        super().close_serial_conn()
 
-    def open_image(self):
+    def _upload_queued(self):
+        while True:
+            file_name, overwrite = self._uploads.get()
+            try:
+                if file_name is None:
+                    return
+                if overwrite:
+                    self.gdrive.overwrite_from_disk(file_name)
+                else:
+                    self.gdrive.upload_from_disk(file_name)
+                print(f"Uploaded {file_name}")
+            except Exception as e:  # The worker has to keep going for the files queued after this one
+                print(f"ERROR: Uploading {file_name} failed:", e)
+            finally:
+                self._uploads.task_done()
+
+    def open_image(self, image_file: str):
         """
         Open an image in system's default viewer
         """
@@ -39,7 +94,7 @@ class BasestationReceiver(LoraBase):
                         self.__WINDOWS_SYS: self.__WINDOWS_IMG_VWR,
                         self.__APPLE_SYS: self.__APPLE_IMG_VWR}[self._SYS_PLTFRM]
         try:
-            subprocess.run([image_viewer, self.__RCVD_IMG])
+            subprocess.run([image_viewer, image_file])
         except FileNotFoundError:
             pass
 
@@ -50,48 +105,196 @@ class BasestationReceiver(LoraBase):
             LoraRxTimeoutException: If receiving times out. Timeout length is defined in base class
             SerialConnectionException: If serial connection to the RN2483 LoRa module times out
         """
-        received_bytes = b''
-        message = self.lora.recv_message(self._RX_TIMEOUT).message
-
-        while message != end:
-            received_bytes += message
-            message = self.lora.recv_message(self._RX_TIMEOUT).message
+        received_bytes = bytearray()
+        self.lora.recv_stream(received_bytes.extend, end, self._RX_TIMEOUT, self._WINDOW)
+        return bytes(received_bytes)
 
-        return received_bytes
-
-    def receive_image(self):
+    def receive_image(self) -> str:
         """
-        Receive and store an image into file
+        Receive and store an image into file. The payload is written to a part file as it arrives, which is kept
+        if receiving fails.
+        Returns:
+            The image file, or None if the received image could not be stored
         Raises:
             LoraRxTimeoutException: If receiving times out. Timeout length is defined in base class
             SerialConnectionException: If serial connection to the RN2483 LoRa module times out
         """
         print("Receiving image...")
-        received_bytes = self.receive_until(self._FINISH_IMG_TRANS)
+        part_file = self.__RCVD_IMG + self.__PART_EXT
+        with open(part_file, "wb") as part:
+            self.lora.recv_stream(part, self._FINISH_IMG_TRANS, self._RX_TIMEOUT, self._WINDOW)
+        return self.store_part(part_file)
 
-        print("Writing tar...")
-        with open(self.__RCVD_TAR, "wb") as tar:
-            tar.write(received_bytes)
-            print("Done!")
+    def receive_resumable_image(self, resume_message: bytes) -> str:
+        """
+        Receive the missing byte ranges of an image, continuing any earlier attempt, and store it once complete.
+        Each stage of an image sent in stages is stored and uploaded as soon as it has arrived, and the transfer is
+        cut short after the stage last_stage() asks for.
+        Args:
+            resume_message: The message that started the transfer, with the file ID and size of the image payload
+        Returns:
+            The image file, or None if the image is not complete or could not be stored
+        Raises:
+            LoraRxTimeoutException: If receiving times out. Timeout length is defined in base class
+            LoraTxTimeoutException: If the answer of which ranges have been received is not ACKed
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        file_id, size = struct.unpack(FILE_FORMAT, resume_message[len(self._RESUME_IMG_TRANS):])
+        # Named after the transfer, so a stage still queued for upload is not overwritten by the next image
+        image_name = f"{self.__RCVD_IMG}_{file_id:08x}"
+        os.makedirs(self._JOURNAL_DIR, exist_ok=True)
+        part_file = os.path.join(self._JOURNAL_DIR, f"{file_id:08x}.part")
+        self.remove_stale_journals(keep=part_file)
+        journal = TransferJournal(part_file + ".json", size)
+        if not os.path.exists(part_file):
+            journal.replace([])
+            open(part_file, "wb").close()
+        print(f"Receiving image, {size - sum(end - start for start, end in journal.missing())} of {size} bytes "
+              "received before...")
 
-        print("Extracting image...")
-        if tarfile.is_tarfile(self.__RCVD_TAR):
-            try:
-                with tarfile.open(self.__RCVD_TAR, 'r:gz') as tar:
-                    members = tar.getmembers()
-                    if len(members) > 0:
-                        if len(members) > 1:
-                            print("WARNING: Expected 1 file in received .tar,"
-                                  "got {len(members)}")
-                        tar.extract(members[0])
-                        os.rename(members[0].name, self.__RCVD_IMG)
-                        print("Done!")
-                    else:
-                        print("ERROR: No files in received tar")
-            except Exception as e:
-                print("ERROR: Can't extract received .tar file:", e)
+        # Tell the sender which ranges to skip, once it has started listening
+        self.lora.clock.sleep(self.lora.ACK_NACK_DELAY / 1000)
+        max_bytes = self.lora.planner.FRAME_BYTES - self.lora.planner.header_bytes(self._WINDOW)
+        self.lora.send_message(encode_ranges(journal.ranges, max_bytes), self._MAX_TX_TRIES, window=self._WINDOW)
+
+        stopped = False  # Whether the transfer is cut short after a stage
+        with open(part_file, "r+b") as part:
+            message = self.lora.recv_message(self._RX_TIMEOUT, self._WINDOW).message
+            while message != self._FINISH_IMG_TRANS:
+                if message.startswith(self._STAGE_DONE) and len(message) == len(self._STAGE_DONE) + 1:
+                    stage = message[-1]
+                    part.seek(0)
+                    stage_file = self.store_stage(part.read(journal.confirmed_offset()), stage, image_name)
+                    last_stage = self.last_stage(stage_file, stage)
+
+                    self.lora.clock.sleep(self.lora.ACK_NACK_DELAY / 1000)
+                    self.lora.send_message(self._LAST_STAGE + bytes([last_stage]), self._MAX_TX_TRIES,
+                                           window=self._WINDOW)
+                    if stage >= last_stage:
+                        stopped = True
+                        break
+                    if stage_file:
+                        # Upload in the background, the sender goes on with the next stage right away
+                        print(f"Now uploading stage {stage} of the picture to GDrive")
+                        self.upload(stage_file)
+
+                else:
+                    offset, = struct.unpack_from(OFFSET_FORMAT, message)
+                    part.seek(offset)
+                    part.write(message[OFFSET_BYTES:])
+                    # The data must be on disk before the journal says it is
+                    part.flush()
+                    os.fsync(part.fileno())
+                    journal.add(offset, offset + len(message) - OFFSET_BYTES)
+                message = self.lora.recv_message(self._RX_TIMEOUT, self._WINDOW).message
+
+        if stopped:
+            print(f"Stopped receiving after stage {stage}")
+            self.lora.recv_message(self._RX_TIMEOUT, self._WINDOW)  # The sender finishes the transfer
+            image_file = stage_file
+        elif not journal.complete():
+            # The sender may send only the first stages, and the rest when it wakes up again
+            print(f"Transfer finished with {len(journal.missing())} byte ranges missing, kept to resume later")
+            return None
         else:
-            print("ERROR: Received file is not a valid .tar file.")
+            with open(part_file, "rb") as part:
+                image_file = self.store_image(part.read(), image_name)
+        journal.remove()
+        os.remove(part_file)
+        return image_file
+
+    def remove_stale_journals(self, keep: str = None):
+        """
+        Delete the part files and journals of transfers that have made no progress for _JOURNAL_MAX_AGE. The node
+        never resumes an image it has marked as sent after only its first stages, nor one it has lost.
+        Args:
+            keep: Part file of the transfer about to resume, kept whatever its age
+        """
+        now = time.time()
+        for name in os.listdir(self._JOURNAL_DIR):
+            part_file = os.path.join(self._JOURNAL_DIR, name)
+            if not name.endswith(".part") or part_file == keep:
+                continue
+            journal_file = part_file + ".json"
+            try:
+                last_progress = max(os.path.getmtime(f) for f in (part_file, journal_file) if os.path.exists(f))
+            except (OSError, ValueError):  # Removed meanwhile
+                continue
+            if now - last_progress > self._JOURNAL_MAX_AGE:
+                print(f"Dropping transfer {name}, no progress for {(now - last_progress) / 3600:.0f} h")
+                for f in (part_file, journal_file):
+                    try:
+                        os.remove(f)
+                    except FileNotFoundError:
+                        pass
+
+    def store_image(self, payload: bytes, image_name: str = __RCVD_IMG) -> str:
+        """
+        Write the image(s) in a received payload to file, named image_name and the extension of the image format.
+        Earlier stages of the image, like a thumbnail sent first, get the stage number appended to the name.
+        Returns:
+            The file of the full image, or None if the payload could not be decoded
+        """
+        print("Decoding image...")
+        try:
+            images = decode_payload(payload)
+        except ValueError as e:
+            print("ERROR: Can't decode received image:", e)
+            return None
+
+        for stage, image in enumerate(images):
+            image_file = image_name + (f"_{stage}" if stage < len(images) - 1 else "") + image_extension(image)
+            print(f"Writing {image_file}...")
+            with open(image_file, "wb") as f:
+                f.write(image)
+        print("Done!")
+        return image_file
+
+    def store_part(self, part_file: str, image_name: str = __RCVD_IMG) -> str:
+        """
+        Store the image(s) in a received payload written to part_file, like store_image(), and remove part_file once
+        they are stored
+        Returns:
+            The file of the full image, or None if the payload could not be decoded
+        """
+        with open(part_file, "rb") as part:
+            image_file = self.store_image(part.read(), image_name)
+        if image_file:
+            os.remove(part_file)
+        return image_file
+
+    def store_stage(self, payload: bytes, stage: int, image_name: str = __RCVD_IMG) -> str:
+        """
+        Write a stage of an image to file, named like store_image() names earlier stages
+        Args:
+            payload: The start of a payload sent in stages, at least up to the end of stage
+        Returns:
+            The file of the stage, or None if the stage could not be decoded
+        """
+        try:
+            images = decode_payload(payload)
+        except ValueError as e:
+            images = []
+            print("ERROR: Can't decode received image:", e)
+        if len(images) <= stage:
+            print(f"ERROR: Stage {stage} of the image is missing")
+            return None
+
+        image_file = f"{image_name}_{stage}" + image_extension(images[stage])
+        print(f"Writing {image_file}...")
+        with open(image_file, "wb") as f:
+            f.write(images[stage])
+        return image_file
+
+    def last_stage(self, stage_file: str, stage: int) -> int:
+        """
+        The last stage of an image to receive, asked after every stage but the last one. Override to decide from the
+        image received so far, e.g. to stop after the thumbnail when there is nothing of interest in it.
+        Args:
+            stage_file: File of the stage just received, or None if it could not be decoded
+            stage: Number of the stage just received
+        """
+        return self._ALL_STAGES if self._STOP_AFTER_STAGE is None else min(self._STOP_AFTER_STAGE, self._ALL_STAGES)
 
     def receive_battery(self) -> float:
         """
@@ -101,10 +304,14 @@ class BasestationReceiver(LoraBase):
             SerialConnectionException: If serial connection to the RN2483 LoRa module times out
         """
         print("Receiving battery...")
-        received_bytes = self.receive_until(self._FINISH_BAT_TRANS)
+        self.store_battery(self.receive_until(self._FINISH_BAT_TRANS))
 
+    def store_battery(self, received_bytes: bytes, battery_file: str = __BAT_FILE):
+        """
+        Append a received battery voltage to battery_file
+        """
         print("Writing file...", end='')
-        with open(self.__BAT_FILE, "a") as f:
+        with open(battery_file, "a") as f:
             f.write(str(decode_float(received_bytes)))
             f.write('\n')
         print("Done!")
@@ -118,26 +325,120 @@ class BasestationReceiver(LoraBase):
         """
         lora = self.init_lora()
 
-        if lora:
-            while ThreeWayHandshake(lora).accept_conn():
-                message = self.lora.recv_message(self._RX_TIMEOUT).message
-
-                if message == self._START_IMG_TRANS:
-                    self.receive_image()
-                    print("Now uploading the picture to GDrive")
-                    self.gdrive.upload_from_disk(self.__RCVD_IMG)
-                    print("Done.")
-                    self.open_image()
+        if lora and self._NODE_IDS:
+            try:
+                while True:
+                    try:
+                        self.receive_nodes()
+                    except LoraRxTimeoutException:
+                        print("No node sent anything. Polling again")
+                    self.lora.next_round()
+            finally:
+                self.close_serial_conn()
 
-                elif message == self._START_BAT_TRANS:
-                    self.receive_battery()
-                    print("Now uploading battery to GDrive")
-                    self.gdrive.overwrite_from_disk(self.__BAT_FILE)
-                    print("Done")
+        elif lora:
+            while ThreeWayHandshake(lora).accept_conn(self._WINDOW):
+                try:
+                    self.receive_session()
+                except LoraRxTimeoutException:
+                    # Nodes sending a single transmission per handshake never end their session
+                    print("Node stopped sending without ending its session")
 
             print("3-way handshake failed. Terminating listening")
             self.close_serial_conn()
 
+    def receive_session(self):
+        """
+        Receive the images and battery voltages a node sends after its handshake, until it ends the session
+        Raises:
+            LoraRxTimeoutException: If receiving times out. Timeout length is defined in base class
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        message = self.lora.recv_message(self._RX_TIMEOUT, self._WINDOW).message
+
+        while message != self._END_SESSION:
+            image_file = None
+            if message == self._START_IMG_TRANS:
+                image_file = self.receive_image()
+
+            elif (message.startswith(self._RESUME_IMG_TRANS)
+                  and len(message) == len(self._RESUME_IMG_TRANS) + struct.calcsize(FILE_FORMAT)):
+                image_file = self.receive_resumable_image(message)
+
+            elif message == self._START_BAT_TRANS:
+                self.receive_battery()
+                print("Now uploading battery to GDrive")
+                self.upload(self.__BAT_FILE, overwrite=True)
+                self.wait_uploads()
+                print("Done")
+
+            if image_file:
+                print("Now uploading the picture to GDrive")
+                self.upload(image_file)
+                self.wait_uploads()
+                print("Done.")
+                self.open_image(image_file)
+
+            message = self.lora.recv_message(self._RX_TIMEOUT, self._WINDOW).message
+
+    def receive_nodes(self):
+        """
+        Receive transmissions from all nodes in _NODE_IDS at once, until every node is done
+        Raises:
+            LoraRxTimeoutException: If no node sends anything for longer than the timeout defined in base class
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        started = {}  # Start marker of the transfer each node is in the middle of
+        # Part file of the image each node is sending, written as it arrives and kept if receiving fails, or buffer of
+        # its battery voltage
+        payloads = {}
+        try:
+            node_message = self.lora.recv_message(self._RX_TIMEOUT)
+
+            while node_message:
+                node_id, message = node_message
+                image_name = f"node{node_id}_{self.__RCVD_IMG}"
+
+                if node_id not in started:
+                    if message == self._START_IMG_TRANS:
+                        started[node_id] = message
+                        payloads[node_id] = open(image_name + self.__PART_EXT, "wb")
+                    elif message == self._START_BAT_TRANS:
+                        started[node_id] = message
+                        payloads[node_id] = io.BytesIO()
+
+                elif message in (self._FINISH_IMG_TRANS, self._FINISH_BAT_TRANS):
+                    payload = payloads.pop(node_id)
+                    if started.pop(node_id) == self._START_IMG_TRANS:
+                        payload.close()
+                        image_file = self.store_part(payload.name, image_name)
+                        if image_file:
+                            print(f"Now uploading the picture from node {node_id} to GDrive")
+                            self.upload(image_file)
+                            self.wait_uploads()
+                    else:
+                        battery_file = f"node{node_id}_{self.__BAT_FILE}"
+                        self.store_battery(payload.getvalue(), battery_file)
+                        print(f"Now uploading battery of node {node_id} to GDrive")
+                        self.upload(battery_file, overwrite=True)
+                        self.wait_uploads()
+                    print("Done.")
+
+                else:
+                    payloads[node_id].write(message)
+                    payloads[node_id].flush()
+
+                node_message = self.lora.recv_message(self._RX_TIMEOUT)
+        finally:
+            for payload in payloads.values():
+                payload.close()
+
+    def _node_connection(self, ser, **kwargs):
+        """
+        Connection used when the basestation serves several nodes
+        """
+        return MultiNodeReceiver(ser, node_ids=self._NODE_IDS, **kwargs)
+
 
 def main():
     BasestationReceiver().start_receiving()
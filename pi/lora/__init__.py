@@ -3,3 +3,11 @@ from .lora_connection import LoraConnection
 from .tcp_handshake import ThreeWayHandshake
 from .packet import Packet
 from .tx_stats import TxStats
+from .airtime import LinkPlanner
+from .fec import FrameCodec
+from .adr import AdrController, RadioSettings
+from .async_lora_serial import AsyncLoraSerial
+from .async_lora_connection import AsyncLoraConnection
+from .multi_node import MultiNodeReceiver, PolledNode
+from .telemetry import Telemetry, RingBufferSink, JsonLinesSink, PrometheusSink, Histogram
+from .duty_cycle import DutyCycleScheduler, EU868_CHANNELS, shared_scheduler
@@ -0,0 +1,112 @@
+from collections import deque, namedtuple
+from math import erfc, log10, sqrt
+from .airtime import DEMOD_FLOOR, LinkPlanner, spreading_factor
+
+RadioSettings = namedtuple("RadioSettings", ["sf", "bandwidth", "coding_rate", "power"])
+RadioSettings.__doc__ = """Radio settings the adaptive data rate controller steps through, in RN2483 form ('sf7', 250, '4/5', 14)"""
+
+SPREADING_FACTORS = ("sf7", "sf8", "sf9", "sf10", "sf11", "sf12")
+BANDWIDTHS = (125, 250, 500)
+CODING_RATES = ("4/5", "4/6", "4/7", "4/8")
+POWERS = (-3, 0, 3, 6, 9, 12, 14)  # dBm, the RN2483 range in steps of about 3 dB
+
+SUPPLY_VOLTAGE = 3.3
+RX_CURRENT = 14.0  # mA, RN2483 listening
+TX_BASE_CURRENT = 13.0  # mA, RN2483 transmitting, besides its power amplifier
+PA_EFFICIENCY = 0.3  # Of the power amplifier, which puts the RN2483 at about 39 mA for 14 dBm
+CODING_GAIN = {"4/5": 0.0, "4/6": 0.5, "4/7": 1.0, "4/8": 1.5}  # dB, rough margin extra redundancy buys on a fading link
+
+
+def tx_current(power: int) -> float:
+    """mA the RN2483 draws transmitting at power dBm"""
+    return TX_BASE_CURRENT + 10 ** (power / 10) / (PA_EFFICIENCY * SUPPLY_VOLTAGE)
+
+
+def frame_loss(snr_mean: float, snr_std: float, settings: RadioSettings) -> float:
+    """Probability of a frame being lost to noise, for a normally distributed SNR at the given settings"""
+    margin = snr_mean + CODING_GAIN[settings.coding_rate] - DEMOD_FLOOR[spreading_factor(settings.sf)]
+    return 0.5 * erfc(margin / (sqrt(2) * snr_std))
+
+
+class AdrController:
+    """Adaptive data rate: chooses the radio settings that deliver the most data per joule, from a rolling history of
+    the SNR and loss a LoraConnection measures.
+
+    SNRs are normalised to 14 dBm over 125 kHz, so samples taken at any settings predict the SNR at any other (the
+    noise floor drops 3 dB for every halving of the bandwidth, as in ChannelModel). Loss beyond what the SNR explains,
+    e.g. from collisions, is kept per settings. After every message, the settings one step away from the current ones
+    in SF, bandwidth, coding rate or power are compared by modelled energy per delivered bit, and the best is
+    recommended if it beats the current settings by more than hysteresis.
+    Args:
+        history: Number of messages to remember
+        min_samples: Messages needed at the current settings before recommending a change
+        hysteresis: Fraction of energy per bit a change must save
+        min_snr_std: dB, lower bound on the SNR spread assumed, since a few samples understate it
+
+    Attributes:
+        samples: (settings, SNR normalised to 14 dBm over 125 kHz, frames, transmissions) of the latest messages
+    """
+    def __init__(self, history: int = 16, min_samples: int = 3, hysteresis: float = 0.1, min_snr_std: float = 1.5):
+        self.samples = deque(maxlen=history)
+        self.min_samples = min_samples
+        self.hysteresis = hysteresis
+        self.min_snr_std = min_snr_std
+
+    def record(self, settings: RadioSettings, snr: float, packet_count: int, tx_count: int):
+        """Record the stats of a message sent at settings, e.g. from the TxStats of LoraConnection.send_message"""
+        self.samples.append((settings, self.normalise_snr(snr, settings), packet_count, tx_count))
+
+    def recommend(self, settings: RadioSettings) -> RadioSettings:
+        """Settings to switch to from the current ones, or None to stay"""
+        if sum(1 for sample in self.samples if sample[0] == settings) < self.min_samples:
+            return None
+        current = self.energy_per_bit(settings)
+        best = min(self.neighbours(settings), key=self.energy_per_bit)
+        if self.energy_per_bit(best) < current * (1 - self.hysteresis):
+            return best
+        return None
+
+    def energy_per_bit(self, settings: RadioSettings) -> float:
+        """Predicted µJ per delivered data bit, counting the sender's transmissions and the wait for their ACKs"""
+        planner = LinkPlanner(settings.sf, settings.bandwidth, settings.coding_rate, settings.power)
+        frame_ms = planner.time_on_air(planner.FRAME_BYTES)
+        listen_ms = planner.turnaround_time()
+        energy = SUPPLY_VOLTAGE * (tx_current(settings.power) * frame_ms + RX_CURRENT * listen_ms)  # µJ
+        # Both the frame and its ACK must get through
+        delivered = (1 - self.loss(settings)) ** 2
+        return energy / (8 * (planner.FRAME_BYTES - planner.header_bytes()) * max(delivered, 1e-6))
+
+    def loss(self, settings: RadioSettings) -> float:
+        """Predicted fraction of frames lost at settings"""
+        snrs = [sample[1] for sample in self.samples]
+        mean = sum(snrs) / len(snrs)
+        std = max(sqrt(sum((snr - mean) ** 2 for snr in snrs) / len(snrs)), self.min_snr_std)
+        noise_loss = frame_loss(self.denormalise_snr(mean, settings), std, settings)
+
+        # Loss measured at these settings that the SNR does not explain
+        frames = sum(sample[2] for sample in self.samples if sample[0] == settings)
+        transmissions = sum(sample[3] for sample in self.samples if sample[0] == settings)
+        other_loss = max(1 - frames / transmissions - noise_loss, 0) if transmissions else 0
+        return min(noise_loss + other_loss, 1)
+
+    @staticmethod
+    def neighbours(settings: RadioSettings) -> list:
+        """Settings one step away in SF, bandwidth, coding rate or power"""
+        neighbours = []
+        for field, values in (("sf", SPREADING_FACTORS), ("bandwidth", BANDWIDTHS), ("coding_rate", CODING_RATES),
+                              ("power", POWERS)):
+            value = getattr(settings, field)
+            i = values.index(value) if value in values else min(range(len(values)),
+                                                                  key=lambda j: abs(values[j] - value))
+            for j in (i - 1, i + 1):
+                if 0 <= j < len(values) and values[j] != value:
+                    neighbours.append(settings._replace(**{field: values[j]}))
+        return neighbours
+
+    @staticmethod
+    def normalise_snr(snr: float, settings: RadioSettings) -> float:
+        return snr - (settings.power - 14) - 10 * log10(125 / settings.bandwidth)
+
+    @staticmethod
+    def denormalise_snr(snr: float, settings: RadioSettings) -> float:
+        return snr + (settings.power - 14) + 10 * log10(125 / settings.bandwidth)
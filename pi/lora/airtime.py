@@ -0,0 +1,162 @@
+from math import ceil, log10
+
+DEMOD_FLOOR = {7: -7.5, 8: -10, 9: -12.5, 10: -15, 11: -17.5, 12: -20}  # Lowest SNR (dB) decodable per SF
+NOISE_FIGURE = 6  # dB, receiver noise figure of the RN2483
+THERMAL_NOISE = -174  # dBm/Hz at room temperature
+UART_BAUD = 57600  # Baud rate of the serial connection to the RN2483
+
+
+def time_on_air(payload_len: int, sf: str = "sf7", bandwidth: float = 250, coding_rate: str = "4/5",
+                preamble_len: int = 8, crc: bool = False, explicit_header: bool = True) -> float:
+    """Milliseconds a LoRa frame occupies the air, following the Semtech SX127x time on air formula.
+    Low data rate optimisation is applied when a symbol is longer than 16 ms, as the RN2483 does.
+    Args:
+        payload_len: Number of payload bytes, at most 255
+        sf: Spreading factor, 'sf7' to 'sf12'
+        bandwidth: Bandwidth in kHz
+        coding_rate: '4/5', '4/6', '4/7' or '4/8'
+        preamble_len: Number of programmed preamble symbols (RN2483 'radio set prlen')
+        crc: Whether a payload CRC is sent
+        explicit_header: Whether the frame carries an explicit header
+    """
+    sf = spreading_factor(sf)
+    symbol_time = (2 ** sf) / bandwidth
+    low_data_rate = 1 if symbol_time > 16 else 0
+    payload_symbols = 8 + max(ceil((8 * payload_len - 4 * sf + 28 + 16 * crc - 20 * (not explicit_header))
+                                   / (4 * (sf - 2 * low_data_rate))) * int(coding_rate[2:]), 0)
+    return (preamble_len + 4.25 + payload_symbols) * symbol_time
+
+
+def spreading_factor(sf) -> int:
+    """The spreading factor as a number, given either as one or in RN2483 form ('sf7')"""
+    return int(sf[2:]) if isinstance(sf, str) else int(sf)
+
+
+def uart_time(n_chars: int) -> float:
+    """Milliseconds n_chars take over the serial connection to the RN2483 (8N1)"""
+    return 10 * n_chars / UART_BAUD * 1000
+
+
+class LinkPlanner:
+    """Time on air, timeouts, transfer time and link budget for one radio configuration of a LoraConnection.
+    Serial times assume the commands LoraConnection sends, including the hex encoding of payloads.
+    Args:
+        sf: Spreading factor, 'sf7' to 'sf12'
+        bandwidth: Bandwidth in kHz
+        coding_rate: '4/5', '4/6', '4/7' or '4/8'
+        power: Transmit power in dBm
+        ack_nack_delay: Milliseconds the receiver waits before answering (LoraConnection.ACK_NACK_DELAY)
+        fec_bytes: Bytes of forward error correction added to every frame
+        parity_group: Segments covered by each parity frame in windowed mode, 0 for none
+        seq_bytes: Bytes of the sequence number in front of every frame
+
+    Attributes:
+        ack_bytes: Bytes of an ACK frame on air
+    """
+    FRAME_BYTES = 255  # Largest frame LoraConnection sends
+    BURST_HEADER_BYTES = 1  # Frames left in the burst, added to segments in windowed mode
+    ACK_MARKER_BYTES = 2  # ACK marker after the sequence number of an ACK
+    PARITY_LENGTH_BYTES = 1  # Segment length in front of the XOR of segments in a parity frame
+    COMMAND_ROUND_TRIP = uart_time(len("radio get snr\r\n") + len("-128\r\n"))  # A short command and its response
+    TIMEOUT_MARGIN = 1.25  # Factor of safety on derived timeouts
+    TIMEOUT_SLACK = 20  # ms added to derived timeouts, for host scheduling jitter
+
+    def __init__(self, sf: str = "sf7", bandwidth: float = 250, coding_rate: str = "4/5", power: int = 14,
+                 ack_nack_delay: int = 25, fec_bytes: int = 0, parity_group: int = 0, seq_bytes: int = 1):
+        self.sf = sf
+        self.bandwidth = bandwidth
+        self.coding_rate = coding_rate
+        self.power = power
+        self.ack_nack_delay = ack_nack_delay
+        self.fec_bytes = fec_bytes
+        self.parity_group = parity_group
+        self.seq_bytes = seq_bytes
+        self.ack_bytes = seq_bytes + self.ACK_MARKER_BYTES + fec_bytes
+
+    def time_on_air(self, payload_len: int) -> float:
+        """Milliseconds a frame with payload_len bytes occupies the air"""
+        return time_on_air(payload_len, self.sf, self.bandwidth, self.coding_rate)
+
+    def tx_command_time(self, payload_len: int) -> float:
+        """Milliseconds to send a 'radio tx' command for payload_len bytes to the RN2483"""
+        return uart_time(len("radio tx \r\n") + 2 * payload_len)
+
+    def rx_response_time(self, payload_len: int) -> float:
+        """Milliseconds for the RN2483 to report a received frame of payload_len bytes"""
+        return uart_time(len("radio_rx  \r\n") + 2 * payload_len)
+
+    def turnaround_time(self, frame_len: int = FRAME_BYTES, reply_len: int = None) -> float:
+        """Milliseconds from the end of a frame until a reply to it has been received, i.e. while the sender listens.
+        The reply is an ACK unless reply_len is given.
+        """
+        reply_len = self.ack_bytes if reply_len is None else reply_len
+        return (self.rx_response_time(frame_len) + 2 * self.COMMAND_ROUND_TRIP + self.ack_nack_delay
+                + self.tx_command_time(reply_len) + self.time_on_air(reply_len))
+
+    def ack_timeout(self, frame_len: int = FRAME_BYTES, reply_len: int = None) -> int:
+        """Shortest safe time (ms) to wait for the reply of reply_len bytes (an ACK by default) to a frame of frame_len bytes"""
+        return self._with_margin(self.turnaround_time(frame_len, reply_len))
+
+    def burst_timeout(self, frame_len: int = FRAME_BYTES) -> int:
+        """Shortest safe time (ms) for a receiver to wait for the next frame of a burst after reporting the last one"""
+        gap = self.ack_nack_delay + self.tx_command_time(frame_len) - self.rx_response_time(frame_len)
+        return self._with_margin(max(gap, 0) + self.COMMAND_ROUND_TRIP + self.time_on_air(frame_len))
+
+    def header_bytes(self, window: int = 1) -> int:
+        """Bytes of every segment that are not data, when sending with the given window.
+        Includes the FEC, and in windowed mode the room a parity frame needs for its bitmap of the segments it covers.
+        """
+        if window == 1:
+            return self.seq_bytes + self.fec_bytes
+        parity = self.PARITY_LENGTH_BYTES + (window + 7) // 8 if self.parity_group else 0
+        return self.seq_bytes + self.BURST_HEADER_BYTES + parity + self.fec_bytes
+
+    def segment_count(self, message_len: int, window: int = 1) -> int:
+        """Number of frames LoraConnection splits a message into"""
+        return max(ceil(message_len / (self.FRAME_BYTES - self.header_bytes(window))), 1)
+
+    def parity_frame_count(self, message_len: int, window: int = 1) -> int:
+        """Number of parity frames sent along with a message, without losses"""
+        if window == 1 or self.parity_group < 2:
+            return 0
+        segments = self.segment_count(message_len, window)
+        group = min(self.parity_group, window)
+        full_bursts, rest = divmod(segments, window)
+        # Groups of a single segment go without parity
+        return full_bursts * (window // group + (window % group > 1)) + rest // group + (rest % group > 1)
+
+    def airtime(self, message_len: int, window: int = 1) -> float:
+        """Milliseconds the sender spends transmitting a message, without losses"""
+        header = self.header_bytes(window)
+        full, rest = divmod(message_len, self.FRAME_BYTES - header)
+        full += self.parity_frame_count(message_len, window)
+        return full * self.time_on_air(self.FRAME_BYTES) + (self.time_on_air(rest + header) if rest else 0)
+
+    def transfer_time(self, message_len: int, window: int = 1, loss: float = 0.0) -> float:
+        """Predicted milliseconds for LoraConnection.send_message to deliver a message
+        Args:
+            message_len: Bytes in the message
+            window: Window passed to send_message
+            loss: Fraction of frames lost, each costing a retransmission
+        """
+        segments = self.segment_count(message_len, window) + self.parity_frame_count(message_len, window)
+        frame = self.tx_command_time(self.FRAME_BYTES) + self.time_on_air(self.FRAME_BYTES)
+        reply = self.turnaround_time() + self.rx_response_time(self.ack_bytes) + self.COMMAND_ROUND_TRIP
+        bursts = ceil(segments / window)
+        per_burst_delays = (min(window, segments) - 1) * self.ack_nack_delay
+        return (segments * frame + bursts * (reply + per_burst_delays)) / (1 - loss)
+
+    def duty_cycle(self, message_len: int, period_s: float = 3600, window: int = 1) -> float:
+        """Fraction of period_s seconds the sender spends transmitting a message (EU868 sub-bands allow 0.001-0.1)"""
+        return self.airtime(message_len, window) / (period_s * 1000)
+
+    def sensitivity(self) -> float:
+        """Weakest signal (dBm) the receiver can still demodulate"""
+        return THERMAL_NOISE + 10 * log10(self.bandwidth * 1000) + NOISE_FIGURE + DEMOD_FLOOR[spreading_factor(self.sf)]
+
+    def link_margin(self, path_loss: float, antenna_gain: float = 0.0) -> float:
+        """dB of signal to spare over a path with path_loss dB attenuation, with antenna_gain dB of total antenna gain"""
+        return self.power + antenna_gain - path_loss - self.sensitivity()
+
+    def _with_margin(self, ms: float) -> int:
+        return ceil(ms * self.TIMEOUT_MARGIN + self.TIMEOUT_SLACK)
@@ -0,0 +1,156 @@
+import asyncio
+
+from .async_lora_serial import AsyncLoraSerial
+from .sequence_nr import SequenceNr
+from .tx_stats import TxStats
+from .packet import Packet
+from .lora_connection import LoraConnection
+from .airtime import LinkPlanner
+from .exceptions import LoraRxTimeoutException, LoraTxTimeoutException, LoraRxRadioException
+
+
+class AsyncLoraConnection(AsyncLoraSerial):
+    """A stateful connection over LoRa for asyncio, speaking the stop-and-wait protocol of LoraConnection,
+    so either end of a link may use it.
+    Args:
+        debug_packets: Whether to print packets being sent/received.
+        debug_ack_nack: Whether to print NACKs and missed ACKs
+        auto_timeouts: Whether to size ACK timeouts from the time on air of the radio configuration,
+            rather than using the fixed ACK_TIMEOUT
+
+    Attributes:
+        sender_seq_nr: Sequence number of next packet to send
+        recv_seq_nr: Sequence number of expected next packet to be received
+        debug_packets: Whether to print all incoming and outgoing LoRa traffic
+        debug_ack_nack: Whether to print NACKs and missed ACKs
+        planner: Time on air and timing predictions for the radio configuration
+        ack_timeout: ms receive timeout for an ACK after sending a packet
+    """
+
+    ACK = LoraConnection.ACK
+    NACK = LoraConnection.NACK
+
+    PAYLOAD_BYTES = LoraConnection.PAYLOAD_BYTES
+    ACK_NACK_DELAY = LoraConnection.ACK_NACK_DELAY
+    ACK_TIMEOUT = LoraConnection.ACK_TIMEOUT
+
+    def __init__(self, *args, debug_packets: bool = False, debug_ack_nack: bool = False,
+                 auto_timeouts: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.sender_seq_nr = SequenceNr()
+        self.recv_seq_nr = SequenceNr()
+        self.debug_packets = debug_packets
+        self.debug_ack_nack = debug_ack_nack
+
+        self.planner = LinkPlanner(self.sf, self.bandwidth, self.coding_rate, self.power, self.ACK_NACK_DELAY)
+        self.ack_timeout = self.planner.ack_timeout() if auto_timeouts else self.ACK_TIMEOUT
+
+    async def recv_message(self, timeout_ms: int = 5000) -> Packet:
+        """ Listen for a radio message.
+        Returns:
+            A Packet instance containing message etc.
+        Raises:
+            LoraRxTimeoutException: If no packet is received within timeout_ms milliseconds
+            SerialConnectionException: If any serial response times out
+        """
+        error_count = 0
+        while True:
+            try:
+                seq_nr, message = await self._recv_single_packet(timeout_ms)
+            except LoraRxRadioException:
+                await asyncio.sleep(self.ACK_NACK_DELAY / 1000)
+                await self._send_single_packet(self.recv_seq_nr, self.NACK)
+                error_count += 1
+                continue
+
+            previous_seq_nr = self.recv_seq_nr.previous()
+            await asyncio.sleep(self.ACK_NACK_DELAY / 1000)
+            if seq_nr != previous_seq_nr:
+                packet = Packet(seq_nr, message, error_count, await self.snr())
+                await self._send_single_packet(seq_nr, self.ACK)
+
+                self.recv_seq_nr = seq_nr
+                self.recv_seq_nr.increase()
+                return packet
+
+            # If we received the same packet as before, our ACK was probably lost
+            if self.debug_ack_nack:
+                print("ACK not received by sender. Retransmitting.")
+            await self._send_single_packet(previous_seq_nr, self.ACK)
+
+    async def send_message(self, message: bytes, max_tries: int = 5, packet_delay: float = 0.0) -> TxStats:
+        """ Send a message over radio.
+        Args:
+            message: A byte sequence of any length.
+            packet_delay: Delay between each packet, in seconds
+            max_tries: Number of times to at most try to send each packet
+        Raises:
+            LoraTxTimeoutException: If any packet fails to be ACKed withing max_tries attempts.
+            SerialConnectionException: If any serial response times out
+        Returns a collection of stats for the transmitted packets
+        """
+        data_bytes = self.PAYLOAD_BYTES - self.sender_seq_nr.n_bytes
+
+        tx_total = 0
+        snr_total = 0
+        packet_count = 0
+        # Can only transmit a set amount of bytes per command
+        for seg_start in range(0, len(message), data_bytes):
+            segment = message[seg_start:seg_start + data_bytes]
+            packet_tx_tries = 0
+            while True:
+                if packet_tx_tries == max_tries:
+                    raise LoraTxTimeoutException(packet_tx_tries)
+                await self._send_single_packet(self.sender_seq_nr, segment)
+                packet_tx_tries += 1
+                if await self._wait_ack_or_nack(self.sender_seq_nr):
+                    break
+                if self.debug_ack_nack:
+                    print("ACK not received from receiver. Retransmitting.")
+
+            snr_total += await self.snr()
+            tx_total += packet_tx_tries
+            packet_count += 1
+
+            self.sender_seq_nr.increase()
+            await asyncio.sleep(packet_delay)
+
+        return TxStats(packet_count, tx_total, snr_total / max(packet_count, 1))
+
+    async def _wait_ack_or_nack(self, expected_seq_nr: SequenceNr) -> bool:
+        """Waits for an ACK or a NACK for the given sequence number
+        Returns:
+            True if an ACK was received, or False if a NACK was received or reception timed out.
+        Raises:
+            SerialConnectionException: If serial connection times out
+        """
+        try:
+            (received_seq_nr, message) = await self._recv_single_packet(self.ack_timeout)
+            return received_seq_nr == expected_seq_nr and message == self.ACK
+        except (LoraRxTimeoutException, LoraRxRadioException):
+            return False
+
+    async def _recv_single_packet(self, timeout_ms: int) -> (SequenceNr, bytes):
+        """Receive a raw message, without sending any ACK/NACK
+        Raises:
+            LoraRxTimeoutException: If nothing is received within the timeout
+            LoraRxRadioException: If radio received, but indicated an error in packet
+            SerialConnectionException: If serial connection times out
+        """
+        payload = await self.recv_raw(timeout_ms)
+        n_bytes = self.sender_seq_nr.n_bytes
+        seq_nr, message = SequenceNr.unpack_from(payload, 0, n_bytes), payload[n_bytes:]
+
+        self._print_packet("<--", seq_nr, message)
+        return (seq_nr, message)
+
+    async def _send_single_packet(self, seq_nr: SequenceNr, message: bytes):
+        """Send a raw message with the given sequence number, without waiting for any ACK/NACK
+        Raises:
+            SerialConnectionException: If serial connection times out
+        """
+        await self.send_raw(seq_nr.as_bytes() + message)
+        self._print_packet("-->", seq_nr, message)
+
+    _print_packet = LoraConnection._print_packet
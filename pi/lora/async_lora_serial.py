@@ -0,0 +1,201 @@
+import asyncio
+from binascii import hexlify
+import serial
+from serial.threaded import Packetizer, ReaderThread
+from .airtime import time_on_air
+from .lora_serial import RADIO_RX, decode_radio_rx, init_commands
+from .exceptions import SerialConnectionException, LoraRxTimeoutException, LoraRxRadioException
+
+
+class _Rn2483Protocol(Packetizer):
+    """Splits RN2483 output into lines on the reader thread and hands them to the event loop"""
+    TERMINATOR = b"\r\n"
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, lines: asyncio.Queue):
+        super().__init__()
+        self.loop = loop
+        self.lines = lines
+
+    def handle_packet(self, packet: bytearray):
+        self.loop.call_soon_threadsafe(self.lines.put_nowait, packet)
+
+
+class AsyncLoraSerial:
+    """Handles a connection to a RN2483 LoRa chip from an asyncio event loop.
+    A ReaderThread reads the serial port, so waiting for the radio never blocks the loop. The radio watchdog is
+    left disabled: receive timeouts and cancellation are handled by the event loop, which stops the radio with
+    'radio rxstop'. Call open() (or use 'async with') before anything else.
+    Args:
+        ser: The serial connection (from pyserial)
+        bandwidth: The bandwidth of the radio, in kHz. Valid values are 125, 250, 500.
+        sf Spreadfactor of radio, only valid for 'lora'. Valid values are 'sf7' to 'sf12'
+        power Power of radio, in dBm. Valid values are -3 to 15.
+        coding_rate: Ratio of data to total size (i.e. data + redundancy). Valid values are '4/5', '4/6', '4/7', '4/8'
+        debug_serial: Whether to print all messages to and from the RN2483.
+
+    Attributes:
+        ser: The serial connection (from pyserial)
+        freq: Frequency of radio, in Hz
+        sf: Spreadfactor of radio
+        bandwidth: The bandwidth of the radio, in kHz
+        coding_rate: Coding rate of radio
+        power: Power of radio, in dBm
+        debug_serial: Whether to print all messages to and from the RN2483.
+    """
+    SERIAL_READ_TIMEOUT = 3000  # ms read timeout for serial connection to RN2483
+
+    def __init__(self, ser: serial.Serial, bandwidth: float = 250, sf: str = "sf7", freq: int = 863500000,
+                 power: int = 14, coding_rate: str = "4/5", debug_serial: bool = False):
+        self.ser = ser
+        self.freq = freq
+        self.sf = sf
+        self.bandwidth = bandwidth
+        self.coding_rate = coding_rate
+        self.power = min(max(power, -3), 15)
+        self.debug_serial = debug_serial
+
+        self._reader = None
+        self._lines = None
+
+    async def open(self):
+        """Start reading the serial port and initialize the RN2483
+        Raises:
+            SerialConnectionException: If any command response times out
+        """
+        self._lines = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._reader = ReaderThread(self.ser, lambda: _Rn2483Protocol(loop, self._lines))
+        self._reader.start()
+        await loop.run_in_executor(None, self._reader.connect)
+
+        for comm in init_commands(self.freq, 0, self.sf, self.power, self.coding_rate, self.bandwidth):
+            print(comm, end=": ")
+            print(await self._send_command(comm))
+        return self
+
+    def close(self):
+        """Stop reading and close the serial connection"""
+        self._reader.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def recv_raw(self, timeout_ms: int) -> bytes:
+        """Receive a raw message over LoRa
+        Args:
+            timeout_ms: Timeout in milliseconds before the reception should time out.
+        Returns:
+            The bytes received.
+        Raises:
+            LoraRxTimeoutException: If no packet is received within timeout_ms milliseconds
+            LoraRxRadioException: If packet is detected, but could not be received
+            SerialConnectionException: If any serial response from RN2483 times out
+        """
+        # Radio might be busy, try until ready
+        while (await self._send_command("radio rx 0") != "ok"):
+            pass
+
+        try:
+            response = await asyncio.wait_for(self._lines.get(), timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            await self._stop_rx()
+            raise LoraRxTimeoutException(timeout_ms)
+        except asyncio.CancelledError:
+            await self._stop_rx()
+            raise
+        self._print_line("<", response)
+
+        if response.startswith(RADIO_RX):
+            return decode_radio_rx(response)
+        else:
+            raise LoraRxRadioException
+
+    async def send_raw(self, message: bytes):
+        """Send a raw message over LoRa, without waiting for any ACK/NACK
+        Args:
+            message: Bytes to send, must be at most 255 bytes
+        Raises:
+            SerialConnectionException: If any serial response times out
+        """
+        command = b"radio tx " + hexlify(message)
+
+        command_resp = await self._send_line(command)
+        while (command_resp != 'ok'):
+            if (command_resp == 'busy'):
+                await asyncio.sleep(0.1)
+                command_resp = await self._send_line(command)
+            else:
+                print("Received 'invalid_param'. Non-hex characters in message string?")
+                return
+
+        # Wait for a "radio_tx_ok", which takes as long as the frame is on air
+        await self._recv_command(self.SERIAL_READ_TIMEOUT
+                                 + time_on_air(len(message), self.sf, self.bandwidth, self.coding_rate))
+
+    async def snr(self) -> int:
+        """Get SNR of last received transmission (dB)
+        Raises:
+            SerialConnectionException: If response times out
+        """
+        snr = await self._send_command("radio get snr")
+        try:
+            return int(snr)
+        except ValueError:
+            print(f"Unable to convert SNR '{snr}' to an int")
+            return 0
+
+    async def _stop_rx(self):
+        """Stop a reception, discarding anything the radio reported before it stopped
+        Raises:
+            SerialConnectionException: If response times out
+        """
+        self._write_line(b"radio rxstop")
+        while await self._recv_command() not in ("ok", "invalid_param"):
+            pass
+
+    async def _recv_command(self, timeout_ms: int = SERIAL_READ_TIMEOUT) -> str:
+        """Receive a command from the RN2483 (e.g. 'radio_tx_ok')
+        Args:
+            timeout_ms: Time in milliseconds to wait at most for a response
+        Returns:
+            The command string received.
+        Raises:
+            SerialConnectionException: If response times out
+        """
+        try:
+            line = await asyncio.wait_for(self._lines.get(), timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            raise SerialConnectionException()
+        self._print_line("<", line)
+        return line.decode('ascii')
+
+    async def _send_command(self, line: str, timeout_ms: int = SERIAL_READ_TIMEOUT) -> str:
+        """Send line to RN2483 followed by a line end ('\\r\\n'), and return response.
+        Args:
+            timeout_ms: Time in milliseconds to wait at most for a response
+        Raises:
+            SerialConnectionException: If response times out
+        """
+        return await self._send_line(line.encode('ascii'), timeout_ms)
+
+    async def _send_line(self, line: bytes, timeout_ms: int = SERIAL_READ_TIMEOUT) -> str:
+        """Send an already encoded line to RN2483 followed by a line end, and return response.
+        Raises:
+            SerialConnectionException: If response times out
+        """
+        self._write_line(line)
+        return await self._recv_command(timeout_ms)
+
+    def _write_line(self, line: bytes):
+        self._print_line(">", line)
+        self._reader.write(line + b"\r\n")
+
+    def _print_line(self, prefix: str, line: bytes):
+        if (self.debug_serial):
+            if (len(line) < 50):
+                print(prefix, line.decode('ascii'))
+            else:
+                print(prefix, line[:50].decode('ascii') + "...")
@@ -0,0 +1,193 @@
+"""Duty cycle limits of the EU868 band (ETSI EN 300 220), enforced with a token bucket of airtime per sub-band.
+The limits apply to the airtime of a transmitter within each sub-band separately, so a link hopping between channels
+in different sub-bands can send more than any one of them allows.
+"""
+
+import json
+import os
+import time
+from collections import namedtuple
+
+SubBand = namedtuple("SubBand", ["low", "high", "duty_cycle"])
+SubBand.__doc__ = """A sub-band of EU868: its lowest and highest frequency in Hz, and the fraction of time a transmitter
+may be on air within it"""
+
+EU868_SUB_BANDS = (
+    SubBand(863000000, 865000000, 0.001),
+    SubBand(865000000, 868000000, 0.01),
+    SubBand(868000000, 868600000, 0.01),
+    SubBand(868700000, 869200000, 0.001),
+    SubBand(869400000, 869650000, 0.1),
+    SubBand(869700000, 870000000, 0.01),
+)
+# One channel in each sub-band, placed so that it stays within its sub-band at up to 250 kHz bandwidth
+EU868_CHANNELS = (863500000, 866500000, 868300000, 868950000, 869525000, 869850000)
+OBSERVATION_PERIOD = 3600  # s over which the duty cycle is measured
+
+
+def sub_band_of(freq: int, bandwidth: float, sub_bands: tuple = EU868_SUB_BANDS) -> SubBand:
+    """The sub-band a channel lies entirely within, or None
+    Args:
+        freq: Centre frequency in Hz
+        bandwidth: Bandwidth in kHz
+    """
+    half_width = bandwidth * 500
+    for sub_band in sub_bands:
+        if sub_band.low <= freq - half_width and freq + half_width <= sub_band.high:
+            return sub_band
+    return None
+
+
+class AirtimeBucket:
+    """Token bucket of the airtime one sub-band allows.
+    It holds at most capacity_ms, which may be sent back-to-back, and refills slightly slower than the duty cycle so
+    that even a full bucket spent at the start of an observation period keeps the period within the limit.
+    Args:
+        duty_cycle: Fraction of time a transmitter may be on air
+        capacity_ms: Most airtime held, at most half of what the duty cycle allows per observation period
+        clock: Provides time()
+
+    Attributes:
+        tokens: ms of airtime held at the time of the last update, negative while a frame is being paid off
+        updated: Clock time of the last update
+        rate: ms of airtime added per second
+    """
+    def __init__(self, duty_cycle: float, capacity_ms: float, clock=time):
+        period_budget = duty_cycle * OBSERVATION_PERIOD * 1000
+        self.capacity = min(capacity_ms, period_budget / 2)
+        self.rate = (period_budget - self.capacity) / OBSERVATION_PERIOD
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock.time()
+
+    def available(self) -> float:
+        """ms of airtime held now"""
+        now = self.clock.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def wait_time(self, airtime_ms: float) -> float:
+        """Seconds until a frame of airtime_ms may be sent. Frames longer than the capacity wait for a full bucket."""
+        missing = min(airtime_ms, self.capacity) - self.available()
+        return max(missing, 0) / self.rate
+
+    def consume(self, airtime_ms: float):
+        self.tokens = self.available() - airtime_ms
+
+
+class DutyCycleScheduler:
+    """Paces transmissions to the duty cycle of their sub-band, and picks the channel that can send soonest.
+    Every frame is reserved before it is sent, and waits only as long as its sub-band needs to refill, so that a
+    transfer runs at the highest throughput the limits allow. Both ends of a link hopping between channels must know
+    the same channels.
+    Args:
+        channels: Centre frequencies in Hz to hop between
+        sub_bands: The sub-bands and their duty cycles
+        burst_ms: ms of airtime each sub-band allows back-to-back, see AirtimeBucket. Enough for the bursts of a
+            windowed LoraConnection, and for a node waking up now and then to send right away.
+        clock: Provides time(), e.g. LoraSerial.clock. Must be the wall clock if the state is saved.
+        state_path: File the state of the buckets is saved to and loaded from, so that the budget spent is
+            remembered between runs, e.g. the wake cycles of a node. None to start with full buckets.
+
+    Attributes:
+        channels: Centre frequencies in Hz to hop between
+        buckets: AirtimeBucket of each sub-band
+    """
+    def __init__(self, channels: tuple = EU868_CHANNELS, sub_bands: tuple = EU868_SUB_BANDS, burst_ms: float = 10000,
+                 clock=time, state_path: str = None):
+        self.channels = tuple(channels)
+        self.sub_bands = tuple(sub_bands)
+        self.clock = clock
+        self.state_path = state_path
+        self.buckets = {sub_band: AirtimeBucket(sub_band.duty_cycle, burst_ms, clock) for sub_band in self.sub_bands}
+        if state_path:
+            self._load()
+
+    def bucket(self, freq: int, bandwidth: float) -> AirtimeBucket:
+        """The bucket of the sub-band a channel lies in
+        Raises:
+            ValueError: If the channel is not within any sub-band
+        """
+        sub_band = sub_band_of(freq, bandwidth, self.sub_bands)
+        if sub_band is None:
+            raise ValueError(f"{freq / 1e6} MHz at {bandwidth} kHz is not within any sub-band")
+        return self.buckets[sub_band]
+
+    def wait_time(self, freq: int, bandwidth: float, airtime_ms: float) -> float:
+        """Seconds until a frame of airtime_ms may be sent on a channel"""
+        return self.bucket(freq, bandwidth).wait_time(airtime_ms)
+
+    def reserve(self, freq: int, bandwidth: float, airtime_ms: float) -> float:
+        """Take the airtime of a frame about to be sent from its sub-band
+        Returns:
+            Seconds to wait before sending it
+        Raises:
+            ValueError: If the channel is not within any sub-band
+        """
+        bucket = self.bucket(freq, bandwidth)
+        wait = bucket.wait_time(airtime_ms)
+        bucket.consume(airtime_ms)
+        return wait
+
+    def best_channel(self, bandwidth: float, airtime_ms: float, current: int = None) -> int:
+        """The channel that can send a frame of airtime_ms soonest, current if no other is sooner, or None if no
+        channel lies within a sub-band at this bandwidth"""
+        best, best_wait = None, None
+        for freq in ((current,) if current else ()) + self.channels:
+            if sub_band_of(freq, bandwidth, self.sub_bands) is None:
+                continue
+            wait = self.wait_time(freq, bandwidth, airtime_ms)
+            if best_wait is None or wait < best_wait:
+                best, best_wait = freq, wait
+        return best
+
+    def handshake_channel(self, bandwidth: float) -> int:
+        """The channel whose sub-band allows the most airtime at this bandwidth, the first of them if several do, or
+        None if no channel lies within a sub-band. Both ends of a link know the same channels, so they meet on it
+        without agreeing on anything else first."""
+        best, best_duty_cycle = None, 0
+        for freq in self.channels:
+            sub_band = sub_band_of(freq, bandwidth, self.sub_bands)
+            if sub_band and sub_band.duty_cycle > best_duty_cycle:
+                best, best_duty_cycle = freq, sub_band.duty_cycle
+        return best
+
+    def remaining_airtime(self, bandwidth: float, horizon_s: float = 0) -> float:
+        """ms of airtime the channels can send at this bandwidth within the next horizon_s seconds"""
+        sub_bands = {sub_band_of(freq, bandwidth, self.sub_bands) for freq in self.channels} - {None}
+        return sum(max(self.buckets[sub_band].available(), 0) + self.buckets[sub_band].rate * horizon_s
+                   for sub_band in sub_bands)
+
+    def save(self):
+        """Save the state of the buckets to state_path, replacing it atomically"""
+        state = [[sub_band.low, sub_band.high, bucket.available(), bucket.updated]
+                 for sub_band, bucket in self.buckets.items()]
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _load(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        by_range = {(sub_band.low, sub_band.high): bucket for sub_band, bucket in self.buckets.items()}
+        for low, high, tokens, updated in state:
+            bucket = by_range.get((low, high))
+            if bucket:
+                bucket.tokens = min(tokens, bucket.capacity)
+                bucket.updated = min(updated, self.clock.time())
+
+
+_shared = {}  # DutyCycleScheduler by state file, see shared_scheduler
+
+
+def shared_scheduler(state_path: str) -> DutyCycleScheduler:
+    """The DutyCycleScheduler of a state file, created on first use and the same one for every caller in the process.
+    Schedulers loading and saving the same file separately would each overwrite the airtime the others spent."""
+    if state_path not in _shared:
+        _shared[state_path] = DutyCycleScheduler(state_path=state_path)
+    return _shared[state_path]
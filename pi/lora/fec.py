@@ -0,0 +1,268 @@
+"""Forward error correction for LoRa frames.
+FrameCodec protects every frame with a CRC32 and Reed-Solomon parity, so bit errors are repaired and any corruption
+left over is detected. xor_parity()/recover_xor() build and use a parity frame over a group of frames, so a lost
+frame of the group can be rebuilt without retransmitting it.
+"""
+
+import struct
+import zlib
+
+GF_PRIMITIVE = 0x11d  # Primitive polynomial of GF(2^8), as used by most Reed-Solomon codes
+CRC_FORMAT = ">I"
+CRC_BYTES = struct.calcsize(CRC_FORMAT)
+
+_GF_EXP = [0] * 512
+_GF_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    _GF_EXP[_i] = _x
+    _GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= GF_PRIMITIVE
+for _i in range(255, 512):
+    _GF_EXP[_i] = _GF_EXP[_i - 255]
+
+
+class FecError(ValueError):
+    """Raised when a frame can not be repaired, or fails its CRC after repair"""
+
+
+def _gf_mul(a: int, b: int) -> int:
+    return 0 if a == 0 or b == 0 else _GF_EXP[_GF_LOG[a] + _GF_LOG[b]]
+
+
+def _gf_div(a: int, b: int) -> int:
+    return 0 if a == 0 else _GF_EXP[(_GF_LOG[a] + 255 - _GF_LOG[b]) % 255]
+
+
+def _gf_pow(a: int, power: int) -> int:
+    return _GF_EXP[(_GF_LOG[a] * power) % 255]
+
+
+def _gf_inverse(a: int) -> int:
+    return _GF_EXP[255 - _GF_LOG[a]]
+
+
+def _poly_scale(p: list, x: int) -> list:
+    return [_gf_mul(c, x) for c in p]
+
+
+def _poly_add(p: list, q: list) -> list:
+    r = [0] * max(len(p), len(q))
+    for i, c in enumerate(p):
+        r[i + len(r) - len(p)] = c
+    for i, c in enumerate(q):
+        r[i + len(r) - len(q)] ^= c
+    return r
+
+
+def _poly_mul(p: list, q: list) -> list:
+    r = [0] * (len(p) + len(q) - 1)
+    for j, b in enumerate(q):
+        for i, a in enumerate(p):
+            r[i + j] ^= _gf_mul(a, b)
+    return r
+
+
+def _poly_eval(p: list, x: int) -> int:
+    y = p[0]
+    for c in p[1:]:
+        y = _gf_mul(y, x) ^ c
+    return y
+
+
+def _poly_div(dividend: list, divisor: list) -> (list, list):
+    """Quotient and remainder of dividing by a monic divisor"""
+    out = list(dividend)
+    for i in range(len(dividend) - len(divisor) + 1):
+        coef = out[i]
+        if coef:
+            for j in range(1, len(divisor)):
+                out[i + j] ^= _gf_mul(divisor[j], coef)
+    separator = -(len(divisor) - 1)
+    return out[:separator], out[separator:]
+
+
+class ReedSolomon:
+    """A systematic Reed-Solomon code over GF(2^8), correcting up to parity_bytes // 2 corrupted bytes per codeword.
+    Codewords are at most 255 bytes, shorter messages are sent as shortened codewords.
+    Args:
+        parity_bytes: Bytes of parity added to each message
+    """
+    def __init__(self, parity_bytes: int = 16):
+        self.parity_bytes = parity_bytes
+        self.generator = [1]
+        for i in range(parity_bytes):
+            self.generator = _poly_mul(self.generator, [1, _gf_pow(2, i)])
+        # Generator coefficients are never 0, so encoding can multiply by adding logarithms
+        self._generator_log = [_GF_LOG[c] for c in self.generator[1:]]
+
+    def encode(self, message: bytes) -> bytes:
+        """The message followed by its parity"""
+        if len(message) + self.parity_bytes > 255:
+            raise ValueError(f"Message of {len(message)} bytes does not fit a codeword")
+        remainder = [0] * self.parity_bytes
+        for b in message:
+            coef = b ^ remainder[0]
+            del remainder[0]
+            remainder.append(0)
+            if coef:
+                coef_log = _GF_LOG[coef]
+                for j, g_log in enumerate(self._generator_log):
+                    remainder[j] ^= _GF_EXP[g_log + coef_log]
+        return bytes(message) + bytes(remainder)
+
+    def decode(self, codeword: bytes) -> (bytes, int):
+        """Repair a codeword
+        Returns:
+            (message, number of bytes corrected)
+        Raises:
+            FecError: If there are more errors than the code can correct
+        """
+        if len(codeword) <= self.parity_bytes:
+            raise FecError(f"Codeword of {len(codeword)} bytes is too short")
+        received = list(codeword)
+        syndromes = self._syndromes(received)
+        if not any(syndromes):
+            return bytes(codeword[:-self.parity_bytes]), 0
+
+        error_positions = self._error_positions(self._error_locator(syndromes), len(received))
+        corrected = self._correct(received, syndromes, error_positions)
+        if any(self._syndromes(corrected)):
+            raise FecError("Could not correct codeword")
+        return bytes(corrected[:-self.parity_bytes]), len(error_positions)
+
+    def _syndromes(self, received: list) -> list:
+        # Padded with a leading 0 so that index i holds the syndrome for alpha^(i-1)
+        syndromes = [0]
+        for i in range(self.parity_bytes):
+            y = 0
+            for c in received:  # Horner's method at alpha^i, multiplying by adding logarithms
+                y = (_GF_EXP[_GF_LOG[y] + i] if y else 0) ^ c
+            syndromes.append(y)
+        return syndromes
+
+    def _error_locator(self, syndromes: list) -> list:
+        """Berlekamp-Massey"""
+        locator = [1]
+        old_locator = [1]
+        shift = len(syndromes) - self.parity_bytes
+        for i in range(self.parity_bytes):
+            k = i + shift
+            delta = syndromes[k]
+            for j in range(1, len(locator)):
+                delta ^= _gf_mul(locator[-(j + 1)], syndromes[k - j])
+            old_locator = old_locator + [0]
+            if delta:
+                if len(old_locator) > len(locator):
+                    new_locator = _poly_scale(old_locator, delta)
+                    old_locator = _poly_scale(locator, _gf_inverse(delta))
+                    locator = new_locator
+                locator = _poly_add(locator, _poly_scale(old_locator, delta))
+
+        while locator and locator[0] == 0:
+            del locator[0]
+        if (len(locator) - 1) * 2 > self.parity_bytes:
+            raise FecError("Too many errors to correct")
+        return locator
+
+    @staticmethod
+    def _error_positions(locator: list, n: int) -> list:
+        """Chien search for the roots of the error locator, as positions into a codeword of n bytes"""
+        reversed_locator = locator[::-1]
+        positions = [n - 1 - i for i in range(n) if _poly_eval(reversed_locator, _gf_pow(2, i)) == 0]
+        if len(positions) != len(locator) - 1:
+            raise FecError("Errors are outside the codeword")
+        return positions
+
+    @staticmethod
+    def _correct(received: list, syndromes: list, error_positions: list) -> list:
+        """Forney's algorithm"""
+        coef_positions = [len(received) - 1 - p for p in error_positions]
+        locator = [1]
+        for i in coef_positions:
+            locator = _poly_mul(locator, _poly_add([1], [_gf_pow(2, i), 0]))
+        _, evaluator = _poly_div(_poly_mul(syndromes[::-1], locator), [1] + [0] * len(locator))
+        evaluator = evaluator[::-1]
+
+        xs = [_gf_pow(2, p) for p in coef_positions]
+        errors = [0] * len(received)
+        for i, x in enumerate(xs):
+            x_inv = _gf_inverse(x)
+            locator_prime = 1
+            for j, other in enumerate(xs):
+                if j != i:
+                    locator_prime = _gf_mul(locator_prime, 1 ^ _gf_mul(x_inv, other))
+            if locator_prime == 0:
+                raise FecError("Could not find error magnitude")
+            y = _gf_mul(x, _poly_eval(evaluator[::-1], x_inv))
+            errors[error_positions[i]] = _gf_div(y, locator_prime)
+        return _poly_add(received, errors)
+
+
+class FrameCodec:
+    """Protects a frame with a CRC32 of its content followed by Reed-Solomon parity over both.
+    The CRC catches what Reed-Solomon can not repair, or repairs wrongly, since the RN2483 runs with its own CRC off.
+    Args:
+        parity_bytes: Reed-Solomon parity bytes per frame, repairing up to half as many corrupted bytes
+
+    Attributes:
+        overhead: Bytes added to every frame
+        corrected_bytes: Bytes repaired in all decoded frames
+        failed_frames: Frames that could not be repaired
+    """
+    def __init__(self, parity_bytes: int = 16):
+        self.rs = ReedSolomon(parity_bytes)
+        self.overhead = CRC_BYTES + parity_bytes
+        self.corrected_bytes = 0
+        self.failed_frames = 0
+
+    def encode(self, frame: bytes) -> bytes:
+        return self.rs.encode(frame + struct.pack(CRC_FORMAT, zlib.crc32(frame)))
+
+    def decode(self, received: bytes) -> bytes:
+        """The frame inside a received codeword
+        Raises:
+            FecError: If the frame can not be repaired, or fails its CRC
+        """
+        # The code is systematic, so an intact frame only needs its CRC checked
+        checked_len = len(received) - self.rs.parity_bytes
+        if checked_len >= CRC_BYTES:
+            frame, crc = received[:checked_len - CRC_BYTES], received[checked_len - CRC_BYTES:checked_len]
+            if struct.pack(CRC_FORMAT, zlib.crc32(frame)) == crc:
+                return bytes(frame)
+        try:
+            checked, corrected = self.rs.decode(received)
+            if len(checked) < CRC_BYTES:
+                raise FecError("Frame is too short for a CRC")
+            frame, crc = checked[:-CRC_BYTES], struct.unpack(CRC_FORMAT, checked[-CRC_BYTES:])[0]
+            if zlib.crc32(frame) != crc:
+                raise FecError("CRC mismatch")
+        except FecError:
+            self.failed_frames += 1
+            raise
+        self.corrected_bytes += corrected
+        return frame
+
+
+def _xor_into(target: bytearray, block: bytes):
+    target[0] ^= len(block)
+    for i, b in enumerate(block, 1):
+        target[i] ^= b
+
+
+def xor_parity(blocks: list) -> bytes:
+    """XOR of blocks, each prefixed with its length and padded to the longest. Blocks must be at most 255 bytes."""
+    parity = bytearray(1 + max(len(block) for block in blocks))
+    for block in blocks:
+        _xor_into(parity, block)
+    return bytes(parity)
+
+
+def recover_xor(parity: bytes, blocks: list) -> bytes:
+    """The one block missing from blocks, given the xor_parity() of them all"""
+    missing = bytearray(parity)
+    for block in blocks:
+        _xor_into(missing, block)
+    return bytes(missing[1:1 + missing[0]])
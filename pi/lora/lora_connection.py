@@ -1,24 +1,73 @@
-from time import sleep
+import struct
+from collections import deque
+from math import ceil
 
 from . import LoraSerial
-from .sequence_nr import SequenceNr
+from .sequence_nr import SequenceNr, split_frames
 from .tx_stats import TxStats
+from .telemetry import Histogram, TRIES_BUCKETS, SNR_BUCKETS
 from .packet import Packet
 from .tcp_handshake import ThreeWayHandshake
+from .airtime import LinkPlanner, spreading_factor
+from .adr import RadioSettings
 from .exceptions import LoraRxTimeoutException, LoraTxTimeoutException, LoraRxRadioException
+from .fec import xor_parity, recover_xor
 
 
 class LoraConnection(LoraSerial):
     """A stateful connection over LoRa, akin to TCP
+
+    Messages are sent stop-and-wait by default. With a window larger than 1, up to that many segments are sent
+    back-to-back as a burst, each carrying the number of frames still to come in the burst. The receiver answers
+    a burst with a single ACK holding its next expected sequence number and a bitmap of the segments it has
+    buffered beyond it, after which only the missing segments are resent. Both sides must use the same mode.
+
+    Frames can be protected with forward error correction by passing fec (see LoraSerial), which repairs bit errors
+    and turns any frame it can not repair into a radio error, so that it is retransmitted. In windowed mode, a parity
+    frame can also be sent after every parity_group segments of a burst, from which the receiver rebuilds any one
+    lost segment of the group without waiting for its retransmission.
+
+    With an AdrController passed as adr, the radio settings are adapted to the link after every message sent. A change
+    is announced with a control frame, ACKed like a data frame, after which both ends switch.
+
+    With a DutyCycleScheduler passed as duty_cycle (see LoraSerial), every frame is paced to the duty cycle of its
+    sub-band. When the sub-band would hold up the next segment, the sender hops to the channel of the scheduler that
+    can send it soonest, announced with a control frame like a change of settings: before every segment in stop-and-wait
+    mode, and before every burst the receiver has nothing buffered for in windowed mode. Bursts are cut short to what
+    their channel can send right away, so that the receiver never waits long for the rest of a burst.
+    Handshakes are made on the channel of the scheduler whose sub-band allows the most airtime, so that a node that
+    has spent the budget of one sub-band can still connect. ACKs and NACKs are never held up by the duty cycle, as
+    the sender only waits ack_timeout for them; their airtime is paid off by the frames sent after them.
+    Both ends must pass adr or duty_cycle to understand control frames.
+
+    Payloads larger than memory can be sent from a file object with send_stream and received into one with
+    recv_stream, a chunk or a segment at a time.
     Args:
         debug_packets: Whether to print packets being sent/received.
         debug_ack_nack: Whether to print NACKs and missed ACKs
+        auto_timeouts: Whether to size ACK timeouts from the time on air of the radio configuration,
+            rather than using the fixed ACK_TIMEOUT
+        parity_group: Segments covered by each parity frame in windowed mode, 0 for no parity frames.
+            Both sides must use the same.
+        adr: Adaptive data rate controller recommending radio settings from the stats of sent messages
+        seq_bytes: Bytes of the sequence number in front of every frame. Both sides must use the same.
+        burst_gap: ms between the frames of a burst in windowed mode, ACK_NACK_DELAY by default. A receiver in
+            continuous receive mode (see LoraSerial) is listening again in time for frames sent without any gap.
 
     Attributes:
         sender_seq_nr: Sequence number of next packet to send
         recv_seq_nr: Sequence number of expected next packet to be received
         debug_packets: Whether to print all incoming and outgoing LoRa traffic
         debug_ack_nack: Whether to print NACKs and missed ACKs
+        planner: Time on air and timing predictions for the radio configuration
+        ack_timeout: ms receive timeout for an ACK after sending a packet
+        burst_timeout: ms receive timeout for the next packet of a burst in windowed mode
+        burst_gap: ms between the frames of a burst in windowed mode
+        parity_group: Segments covered by each parity frame in windowed mode
+        recovered_count: Number of lost segments rebuilt from parity frames
+        adr: Adaptive data rate controller, or None
+        home_freq: Frequency in Hz the connection started on, to which it returns for every handshake if it has no
+            duty_cycle
     """
 
     ACK = b'\xff\xff'   # Message sent as 'ACK'
@@ -27,40 +76,242 @@ class LoraConnection(LoraSerial):
     PAYLOAD_BYTES = 255
     ACK_NACK_DELAY = 25  # Milliseconds of time to wait before sending an ACK, to give sender time to start listening
     ACK_TIMEOUT = 500  # ms receive timeout for LoRa ACK after sending a packet
+    BURST_HEADER_BYTES = 1  # Frames left in the burst, sent after the sequence number in windowed mode
+    PARITY_FLAG = 0x80  # Set in the burst header of parity frames
+    CONTROL = b'\xad\xad'  # Followed by radio settings, tells the receiver to switch to them once it has ACKed
+    SETTINGS_FORMAT = ">BHBbI"  # Spreading factor, bandwidth in kHz, coding rate denominator, power in dBm, freq in Hz
+    MAX_WINDOW = 64  # Most segments in one burst, must stay below half of the sequence number space
+    STREAM_SEGMENTS = 64  # Segments read from a file object at a time by send_stream
 
-    def __init__(self, *args, debug_packets: bool = False, debug_ack_nack: bool = False, **kwargs):
+    def __init__(self, *args, debug_packets: bool = False, debug_ack_nack: bool = False,
+                 auto_timeouts: bool = False, parity_group: int = 0, adr=None, seq_bytes: int = 1,
+                 burst_gap: float = None, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.sender_seq_nr = SequenceNr()
-        self.recv_seq_nr = SequenceNr()
+        self.sender_seq_nr = SequenceNr(0, seq_bytes)
+        self.recv_seq_nr = SequenceNr(0, seq_bytes)
         self.debug_packets = debug_packets
         self.debug_ack_nack = debug_ack_nack
+        self.parity_group = parity_group
+        self.burst_gap = self.ACK_NACK_DELAY if burst_gap is None else burst_gap
+        self.recovered_count = 0
+        self.adr = adr
+        self.auto_timeouts = auto_timeouts
+        self.home_freq = self.freq
+        self._fallback_settings = None  # (RadioSettings, freq) before a switch the peer asked for, until confirmed
+        self._plan()
+
+        self._recv_window = {}  # Out-of-order windowed packets by sequence number
+        self._recv_queue = deque()  # In-order windowed packets not yet returned by recv_message
+        self._unread = None  # Frame to return from the next receive instead of listening
+        self._received = deque()  # (sequence number, message) of frames taken from the queue but not yet handled
+
+    def reset(self):
+        """Start a new session: sequence numbers back to 0, and nothing buffered from the last one"""
+        self.sender_seq_nr.set(0)
+        self.recv_seq_nr.set(0)
+        self._recv_window.clear()
+        self._recv_queue.clear()
+        self._unread = None
+        self._received.clear()
+
+    def unread(self, frame: bytes):
+        """Have the next receive return frame, e.g. a data frame read by the handshake while waiting for its end"""
+        self._unread = frame
+
+    def _plan(self):
+        """Derive the planner and timeouts from the current radio settings"""
+        self.planner = LinkPlanner(self.sf, self.bandwidth, self.coding_rate, self.power, self.ACK_NACK_DELAY,
+                                   self.fec.overhead if self.fec else 0, self.parity_group, self.sender_seq_nr.n_bytes)
+        if self.auto_timeouts:
+            self.ack_timeout = self.planner.ack_timeout()
+            self.burst_timeout = self.planner.burst_timeout()
+        else:
+            self.ack_timeout = self.burst_timeout = self.ACK_TIMEOUT
+
+    def apply_settings(self, sf: str, bandwidth: float, coding_rate: str, power: int):
+        super().apply_settings(sf, bandwidth, coding_rate, power)
+        self._plan()
+
+    def radio_settings(self) -> RadioSettings:
+        return RadioSettings(self.sf, self.bandwidth, self.coding_rate, self.power)
+
+    def switch_settings(self, settings: RadioSettings, max_tries: int = 5, freq: int = None):
+        """Switch both ends of the connection to other radio settings.
+        The control frame is first sent with the current settings. If it is never ACKed, the receiver may have switched
+        and only its ACKs have been lost, so it is sent again with the new settings.
+        Args:
+            freq: Channel to move to as well, in Hz. None to stay on the current one.
+        Raises:
+            LoraTxTimeoutException: If the control frame is ACKed with neither settings. The old settings are kept.
+            SerialConnectionException: If any serial response times out
+        """
+        old_settings, old_freq = self.radio_settings(), self.freq
+        freq = freq or old_freq
+        control = self.CONTROL + struct.pack(self.SETTINGS_FORMAT, spreading_factor(settings.sf), int(settings.bandwidth),
+                                             int(settings.coding_rate[2:]), settings.power, freq)
+        for attempt_settings, attempt_freq in ((old_settings, old_freq), (settings, freq)):
+            self.apply_settings(*attempt_settings)
+            self.set_frequency(attempt_freq)
+            for _ in range(max_tries):
+                self._send_single_packet(self.sender_seq_nr, control)
+                if self._wait_ack_or_nack(self.sender_seq_nr):
+                    self.sender_seq_nr.increase()
+                    self.apply_settings(*settings)
+                    self.set_frequency(freq)
+                    self._fallback_settings = (old_settings, old_freq)
+                    if self.debug_ack_nack:
+                        print(f"Switched radio to {settings} at {freq / 1e6} MHz")
+                    return
+        self.apply_settings(*old_settings)
+        self.set_frequency(old_freq)
+        raise LoraTxTimeoutException(2 * max_tries)
+
+    def go_home(self):
+        """Return to the channel handshakes are made on, see DutyCycleScheduler.handshake_channel"""
+        freq = self.duty_cycle.handshake_channel(self.bandwidth) if self.duty_cycle else None
+        self.set_frequency(freq or self.home_freq)
+        self._fallback_settings = None
+
+    def _hop(self, frame_count: int, max_tries: int):
+        """Move both ends to the channel that can send frame_count full frames soonest, if the current one can not
+        send them and the control frame announcing the move right away"""
+        if not self._blocked(frame_count):
+            return
+        airtime = frame_count * self.planner.time_on_air(self.planner.FRAME_BYTES)
+        freq = self.duty_cycle.best_channel(self.bandwidth, airtime, self.freq)
+        if freq and freq != self.freq:
+            if self.telemetry:
+                self.telemetry.emit("hop", freq=freq, from_freq=self.freq)
+            self.switch_settings(self.radio_settings(), max_tries, freq)
+
+    def _blocked(self, frame_count: int) -> bool:
+        """Whether the duty cycle holds up frame_count full frames on the current channel, after a control frame"""
+        if not self.duty_cycle:
+            return False
+        airtime = frame_count * self.planner.time_on_air(self.planner.FRAME_BYTES)
+        control_airtime = self.planner.time_on_air(self.planner.seq_bytes + self.planner.fec_bytes + len(self.CONTROL)
+                                                   + struct.calcsize(self.SETTINGS_FORMAT))
+        return self.duty_cycle.wait_time(self.freq, self.bandwidth, airtime + control_airtime) > 0
+
+    def _affordable(self, frame_count: int) -> int:
+        """How many of frame_count full frames the duty cycle lets the current channel send right away, at least 1"""
+        if not self.duty_cycle:
+            return frame_count
+        available = self.duty_cycle.bucket(self.freq, self.bandwidth).available()
+        return max(1, min(frame_count, int(available // self.planner.time_on_air(self.planner.FRAME_BYTES))))
+
+    def _is_control(self, message: bytes) -> bool:
+        return ((self.adr is not None or self.duty_cycle is not None) and message.startswith(self.CONTROL)
+                and len(message) == len(self.CONTROL) + struct.calcsize(self.SETTINGS_FORMAT))
+
+    def _accept_control(self, seq_nr: SequenceNr, message: bytes):
+        """ACK a control frame and switch to the radio settings in it, unless it is a resend of one already accepted"""
+        self.clock.sleep(self.ACK_NACK_DELAY / 1000)
+        self._send_single_packet(seq_nr, self.ACK, pace=False)
+        if seq_nr == self.recv_seq_nr.previous():
+            return
+        self.recv_seq_nr = seq_nr + 1
+        sf, bandwidth, coding_rate, power, freq = struct.unpack(self.SETTINGS_FORMAT, message[len(self.CONTROL):])
+        self._fallback_settings = (self.radio_settings(), self.freq)
+        self.apply_settings(f"sf{sf}", bandwidth, f"4/{coding_rate}", power)
+        self.set_frequency(freq)
+        if self.debug_ack_nack:
+            print(f"Peer switched radio to {self.radio_settings()} at {freq / 1e6} MHz")
+
+    def _fall_back(self):
+        """Go back to the settings before the last switch the peer asked for, if nothing has been heard since"""
+        if self._fallback_settings:
+            settings, freq = self._fallback_settings
+            if self.debug_ack_nack:
+                print(f"Nothing received since switching radio settings, falling back to {settings} at {freq / 1e6} MHz")
+            self.apply_settings(*settings)
+            self.set_frequency(freq)
+            self._fallback_settings = None
+
+    def _adapt(self, stats: TxStats, max_tries: int):
+        """Feed the stats of a sent message to the ADR controller and switch settings if it recommends it"""
+        settings = self.radio_settings()
+        self.adr.record(settings, stats.snr, stats.packet_count, stats.tx_count)
+        recommended = self.adr.recommend(settings)
+        if recommended:
+            self.switch_settings(recommended, max_tries)
 
-    def recv_message(self, timeout_ms: int = 5000) -> Packet:
+    def recv_message(self, timeout_ms: int = 5000, window: int = 1) -> Packet:
         """ Listen for a radio message.
+        Args:
+            timeout_ms: Timeout in milliseconds before the reception should time out.
+            window: Largest burst of segments to accept from the sender, 1 for stop-and-wait.
         Returns:
             A Packet instance containing message etc.
         Raises:
             LoraRxTimeoutException: If no packet is received within timeout_ms milliseconds
             SerialConnectionException: If any serial response times out
         """
+        try:
+            return self._recv_message(timeout_ms, window)
+        except LoraRxTimeoutException:
+            # The peer may never have heard the ACK of a switch to other settings
+            self._fall_back()
+            raise
+
+    def recv_stream(self, sink, end: bytes, timeout_ms: int = 5000, window: int = 1) -> int:
+        """ Receive messages until one equals end, e.g. a payload sent with send_stream followed by an end marker.
+        Each segment is written to sink as soon as it has been ACKed, so memory use does not grow with the size of
+        the payload, and a receiver that crashes keeps everything it has ACKed.
+        Args:
+            sink: Binary file object, flushed after every segment, or a callable taking the bytes of every segment
+            end: Message marking the end of the payload, not written to sink
+            timeout_ms: Timeout in milliseconds for each message
+            window: Largest burst of segments to accept from the sender, 1 for stop-and-wait.
+        Returns:
+            Number of bytes written to sink
+        Raises:
+            LoraRxTimeoutException: If no packet is received within timeout_ms milliseconds
+            SerialConnectionException: If any serial response times out
+        """
+        write = sink if callable(sink) else sink.write
+        flush = None if callable(sink) else sink.flush
+        byte_count = 0
+
+        message = self.recv_message(timeout_ms, window).message
+        while message != end:
+            write(message)
+            if flush:
+                flush()
+            byte_count += len(message)
+            message = self.recv_message(timeout_ms, window).message
+        return byte_count
+
+    def _recv_message(self, timeout_ms: int, window: int) -> Packet:
+        if window > 1:
+            self._check_window(window)
+            while not self._recv_queue:
+                self._recv_burst(timeout_ms, window)
+            return self._recv_queue.popleft()
+
         error_count = 0
         resp = None
         while not resp:
             try:
                 resp = self._recv_single_packet(timeout_ms)
             except LoraRxRadioException:
-                sleep(self.ACK_NACK_DELAY / 1000)
-                self._send_single_packet(self.recv_seq_nr, self.NACK)
+                self.clock.sleep(self.ACK_NACK_DELAY / 1000)
+                self._send_single_packet(self.recv_seq_nr, self.NACK, pace=False)
                 error_count += 1
+                if self.telemetry:
+                    self.telemetry.emit("nack_sent", seq=self.recv_seq_nr.nr)
         seq_nr, message = resp
+        if self._is_control(message):
+            self._accept_control(seq_nr, message)
+            return self._recv_message(timeout_ms, window)
 
-        previous_seq_nr = SequenceNr(self.recv_seq_nr.nr - 1)
+        previous_seq_nr = self.recv_seq_nr.previous()
         if seq_nr != previous_seq_nr:
             packet = Packet(seq_nr, message, error_count, self.snr())
 
-            sleep(self.ACK_NACK_DELAY / 1000)
-            self._send_single_packet(seq_nr, self.ACK)
+            self.clock.sleep(self.ACK_NACK_DELAY / 1000)
+            self._send_single_packet(seq_nr, self.ACK, pace=False)
 
             self.recv_seq_nr = seq_nr
             self.recv_seq_nr.increase()
@@ -70,24 +321,82 @@ class LoraConnection(LoraSerial):
         else:
             if self.debug_ack_nack:
                 print("ACK not received by sender. Retransmitting.")
-            sleep(self.ACK_NACK_DELAY / 1000)
-            self._send_single_packet(previous_seq_nr, self.ACK)
+            if self.telemetry:
+                self.telemetry.emit("duplicate", seq=seq_nr.nr)
+            self.clock.sleep(self.ACK_NACK_DELAY / 1000)
+            self._send_single_packet(previous_seq_nr, self.ACK, pace=False)
 
             # Still want to receive a packet, so we need to go again
-            return self.recv_message(timeout_ms)
+            return self._recv_message(timeout_ms, window)
 
-    def send_message(self, message: bytes, max_tries: int = 5, packet_delay: float = 0.0) -> TxStats:
+    def send_message(self, message: bytes, max_tries: int = 5, packet_delay: float = 0.0,
+                     window: int = 1) -> TxStats:
         """ Send a message over radio.
         Args:
             message: A byte sequence of any length.
-            packet_delay: Delay between each packet, in seconds
+            packet_delay: Delay between each packet (each burst if windowed), in seconds
             max_tries: Number of times to at most try to send each packet
+            window: Number of segments to send per acknowledged burst, 1 for stop-and-wait.
         Raises:
             LoraTxTimeoutException: If any packet fails to be ACKed withing max_tries attempts.
             SerialConnectionException: If any serial response times out
         Returns a collection of stats for the transmitted packets
         """
-        data_bytes = self.PAYLOAD_BYTES - self.sender_seq_nr.n_bytes
+        try:
+            stats = self._send_message(message, max_tries, packet_delay, window)
+        except LoraTxTimeoutException:
+            if not self._fallback_settings:
+                raise
+            # Nothing has been heard since switching settings, the peer may have fallen back already
+            self._fall_back()
+            stats = self._send_message(message, max_tries, packet_delay, window)
+
+        if self.telemetry:
+            self.telemetry.emit("message", bytes=len(message), window=window, packets=stats.packet_count,
+                                transmissions=stats.tx_count, snr=stats.snr)
+        if self.adr:
+            self._adapt(stats, max_tries)
+        return stats
+
+    def send_stream(self, stream, max_tries: int = 5, packet_delay: float = 0.0, window: int = 1) -> TxStats:
+        """ Send the contents of a binary file object over radio, read STREAM_SEGMENTS segments at a time into one
+        reused buffer, so memory use does not grow with its size. It is split into the same segments as if it was
+        sent with one send_message, for recv_stream or recv_message to receive.
+        Args:
+            stream: Binary file object to send from its current position to its end, e.g. an open file
+            packet_delay: Delay between each packet (each burst if windowed), in seconds
+            max_tries: Number of times to at most try to send each packet
+            window: Number of segments to send per acknowledged burst, 1 for stop-and-wait.
+        Raises:
+            LoraTxTimeoutException: If any packet fails to be ACKed withing max_tries attempts.
+            SerialConnectionException: If any serial response times out
+        Returns a collection of stats for all the transmitted packets
+        """
+        stats = TxStats(0, 0, 0)
+        buffer = bytearray()
+        while True:
+            # Settings adapted after a chunk may change the size of the segments
+            chunk_bytes = (self.planner.FRAME_BYTES - self.planner.header_bytes(window)) * self.STREAM_SEGMENTS
+            if len(buffer) != chunk_bytes:
+                buffer = bytearray(chunk_bytes)
+            with memoryview(buffer) as view:
+                size = 0
+                while size < chunk_bytes:
+                    read = stream.readinto(view[size:])
+                    if not read:
+                        break
+                    size += read
+                if not size:
+                    return stats
+                stats.add(self.send_message(view[:size], max_tries, packet_delay, window))
+
+    def _send_message(self, message: bytes, max_tries: int, packet_delay: float, window: int) -> TxStats:
+        if window > 1:
+            self._check_window(window)
+            return self._send_windowed(message, max_tries, packet_delay, window)
+
+        data_bytes = self.planner.FRAME_BYTES - self.planner.header_bytes()
+        view = memoryview(message)  # Segments are sent from views, without copying them out of the message
 
         seg_start = 0
         seg_end = min(seg_start + data_bytes, len(message))
@@ -95,32 +404,259 @@ class LoraConnection(LoraSerial):
         tx_total = 0
         snr_total = 0
         packet_count = 0
+        tries = Histogram(TRIES_BUCKETS)
+        snrs = Histogram(SNR_BUCKETS)
         # Can only transmit a set amount of bytes per command
         while (seg_start < seg_end):
-            self._send_single_packet(self.sender_seq_nr, message[seg_start:seg_end])
+            self._hop(1, max_tries)
+            segment = view[seg_start:seg_end]
+            self._send_single_packet(self.sender_seq_nr, segment)
             packet_tx_tries = 1
 
             while not self._wait_ack_or_nack(self.sender_seq_nr):
                 if (self.debug_ack_nack):
                     print("ACK not received from receiver. Retransmitting.")
-                self._send_single_packet(self.sender_seq_nr, message[seg_start:seg_end])
+                # Nothing has been sent since, so the formatted command is sent again as it is
+                self.resend_raw()
+                self._print_packet("-->", self.sender_seq_nr, segment)
 
                 if packet_tx_tries < max_tries:
                     packet_tx_tries += 1
                 else:
                     raise LoraTxTimeoutException(packet_tx_tries)
+                if self.telemetry:
+                    self.telemetry.emit("retry", seq=self.sender_seq_nr.nr, tries=packet_tx_tries)
 
-            snr_total += self.snr()
+            snr = self.snr()
+            snr_total += snr
+            snrs.observe(snr)
+            tries.observe(packet_tx_tries)
             tx_total += packet_tx_tries
             packet_count += 1
 
             self.sender_seq_nr.increase()
-            sleep(packet_delay)
+            self.clock.sleep(packet_delay)
 
             seg_start = seg_end
             seg_end = min(seg_start + data_bytes, len(message))
 
-        return TxStats(packet_count, tx_total, snr_total / packet_count)
+        return TxStats(packet_count, tx_total, snr_total / packet_count, tries, snrs)
+
+    def _send_windowed(self, message: bytes, max_tries: int, packet_delay: float, window: int) -> TxStats:
+        """Send a message as bursts of at most window segments, resending only the segments not ACKed
+        Raises:
+            LoraTxTimeoutException: If any packet fails to be ACKed withing max_tries attempts.
+            SerialConnectionException: If any serial response times out
+        """
+        data_bytes = self.planner.FRAME_BYTES - self.planner.header_bytes(window)
+        segments = [(start, min(start + data_bytes, len(message))) for start in range(0, len(message), data_bytes)]
+        view = memoryview(message)
+        tx_counts = [0] * len(segments)
+        acked = [False] * len(segments)
+
+        base = 0  # First segment not yet ACKed, sent as self.sender_seq_nr
+        burst = None
+        snr_total = 0
+        ack_count = 0
+        snrs = Histogram(SNR_BUCKETS)
+        while base < len(segments):
+            if burst is None:
+                end = min(base + window, len(segments))
+                if not any(acked[base:end]):
+                    self._hop(end - base, max_tries)
+                    end = base + self._affordable(end - base)
+                elif self._blocked(end - base):
+                    # Hopping renumbers the segments, so first fill the gaps before those the receiver has buffered
+                    end = max(i for i in range(base, end) if acked[i])
+                burst = [i for i in range(base, end) if not acked[i]]
+            for i in burst:
+                if tx_counts[i] == max_tries:
+                    raise LoraTxTimeoutException(tx_counts[i])
+
+            # Each group of segments is followed by a parity frame, numbered as the first segment of the group
+            frames = []
+            group_len = self.parity_group if self.parity_group > 1 else len(burst)
+            for group_start in range(0, len(burst), group_len):
+                group = burst[group_start:group_start + group_len]
+                frames += [(i, None) for i in group]
+                if self.parity_group > 1 and len(group) > 1:
+                    frames.append((group[0], group))
+
+            for n, (i, group) in enumerate(frames):
+                if n:
+                    # Give the receiver time to start listening again
+                    self.clock.sleep(self.burst_gap / 1000)
+                seq_nr = self.sender_seq_nr + (i - base)
+                frames_left = len(frames) - n - 1
+                if group is None:
+                    seg_start, seg_end = segments[i]
+                    self._send_single_packet(seq_nr, view[seg_start:seg_end], bytes([frames_left]))
+                    tx_counts[i] += 1
+                else:
+                    bitmap = sum(1 << (j - i) for j in group).to_bytes((window + 7) // 8, 'little')
+                    parity = xor_parity([view[segments[j][0]:segments[j][1]] for j in group])
+                    self._send_single_packet(seq_nr, bytes([frames_left | self.PARITY_FLAG]) + bitmap + parity)
+
+            # The receiver waits up to burst_timeout for a lost last frame before it answers
+            ack = self._wait_bitmap_ack(self.burst_timeout + self.ack_timeout)
+            if ack is None:
+                if self.debug_ack_nack:
+                    print("ACK not received from receiver. Retransmitting end of burst.")
+                if self.telemetry:
+                    self.telemetry.emit("retry", seq=(self.sender_seq_nr + (burst[-1] - base)).nr,
+                                        tries=tx_counts[burst[-1]] + 1)
+                # Any single frame gets the burst ACKed, so probe with the last one instead of resending them all
+                burst = burst[-1:]
+                continue
+            burst = None
+
+            ack_seq_nr, bitmap = ack
+            snr = self.snr()
+            snr_total += snr
+            snrs.observe(snr)
+            ack_count += 1
+
+            cumulative = ack_seq_nr.offset_from(self.sender_seq_nr)
+            if cumulative <= window:
+                for i in range(base, min(base + cumulative, len(segments))):
+                    acked[i] = True
+                for i in range(base + cumulative, min(base + window, len(segments))):
+                    if bitmap >> (i - base - cumulative) & 1:
+                        acked[i] = True
+
+            while base < len(segments) and acked[base]:
+                base += 1
+                self.sender_seq_nr.increase()
+            self.clock.sleep(packet_delay)
+
+        tries = Histogram(TRIES_BUCKETS)
+        for tx_count in tx_counts:
+            tries.observe(tx_count)
+        return TxStats(len(segments), sum(tx_counts), snr_total / max(ack_count, 1), tries, snrs)
+
+    def _recv_burst(self, timeout_ms: int, window: int):
+        """Receive one burst of windowed packets, queue those now in order, and answer with a bitmap ACK
+        Raises:
+            LoraRxTimeoutException: If no packet is received within timeout_ms milliseconds
+            SerialConnectionException: If any serial response times out
+        """
+        burst_packets = []
+        burst_data = {}  # Data of every segment received in this burst by sequence number, to rebuild a lost one from
+        parities = []  # (sequence number, message) of parity frames received in this burst
+        error_count = 0
+        remaining = 1
+        received = False
+        # Without FEC, a corrupted burst header could otherwise keep the receiver listening for long
+        max_remaining = window + (ceil(window / self.parity_group) if self.parity_group > 1 else 0) - 1
+        while remaining:
+            try:
+                seq_nr, message = self._recv_single_packet(self.burst_timeout if received else timeout_ms)
+            except LoraRxRadioException:
+                error_count += 1
+                continue
+            except LoraRxTimeoutException:
+                if not received:
+                    raise
+                # A frame of the burst was lost, keep listening for the ones still to come
+                remaining -= 1
+                continue
+            if not self._received:
+                # Frames sent back-to-back are queued while this one is handled, their headers are parsed in one go
+                self._received.extend(split_frames(self.recv_queued(), self.recv_seq_nr.n_bytes))
+            if self._is_control(message):
+                self._accept_control(seq_nr, message)
+                return
+            received = True
+
+            if not message:
+                continue
+            remaining = min(message[0] & ~self.PARITY_FLAG, max_remaining)
+            if message[0] & self.PARITY_FLAG:
+                parities.append((seq_nr, message[self.BURST_HEADER_BYTES:]))
+                continue
+            burst_data[seq_nr.nr] = message[self.BURST_HEADER_BYTES:]
+            if seq_nr.offset_from(self.recv_seq_nr) < window and seq_nr.nr not in self._recv_window:
+                packet = Packet(seq_nr, message[self.BURST_HEADER_BYTES:], error_count, 0)
+                self._recv_window[seq_nr.nr] = packet
+                burst_packets.append(packet)
+            else:
+                if self.debug_ack_nack:
+                    print("ACK not received by sender. Discarding duplicate.")
+                if self.telemetry:
+                    self.telemetry.emit("duplicate", seq=seq_nr.nr)
+            error_count = 0
+
+        for seq_nr, parity in parities:
+            packet = self._recover_segment(seq_nr, parity, burst_data, window)
+            if packet:
+                self._recv_window[packet.seq_nr.nr] = packet
+                burst_packets.append(packet)
+
+        snr = self.snr()
+        for packet in burst_packets:
+            packet.snr = snr
+
+        while self.recv_seq_nr.nr in self._recv_window:
+            self._recv_queue.append(self._recv_window.pop(self.recv_seq_nr.nr))
+            self.recv_seq_nr.increase()
+
+        bitmap = 0
+        for nr in self._recv_window:
+            bitmap |= 1 << SequenceNr(nr, self.recv_seq_nr.n_bytes).offset_from(self.recv_seq_nr)
+
+        self.clock.sleep(self.ACK_NACK_DELAY / 1000)
+        self._send_single_packet(self.recv_seq_nr, self.ACK + bitmap.to_bytes((window + 7) // 8, 'little'), pace=False)
+
+    def _recover_segment(self, seq_nr: SequenceNr, parity: bytes, burst_data: dict, window: int) -> Packet:
+        """Rebuild the segment lost from the group a parity frame covers
+        Args:
+            seq_nr: Sequence number of the parity frame, which is that of the first segment of its group
+            parity: Message of the parity frame, after its burst header
+            burst_data: Data of the segments received in the burst by sequence number
+        Returns:
+            The rebuilt segment, or None if no segment of the group is missing, more than one is, or it is not needed
+        """
+        bitmap_bytes = (window + 7) // 8
+        bitmap = int.from_bytes(parity[:bitmap_bytes], 'little')
+        group = []
+        for offset in range(window):
+            if bitmap >> offset & 1:
+                group.append(seq_nr + offset)
+
+        lost = [member for member in group if member.nr not in burst_data]
+        if len(lost) != 1:
+            return None
+        lost = lost[0]
+        if lost.offset_from(self.recv_seq_nr) >= window or lost.nr in self._recv_window:
+            return None
+
+        if self.debug_ack_nack:
+            print("Segment lost. Rebuilding it from parity.")
+        self.recovered_count += 1
+        if self.telemetry:
+            self.telemetry.emit("recovered", seq=lost.nr)
+        message = recover_xor(parity[bitmap_bytes:], [burst_data[member.nr] for member in group if member is not lost])
+        return Packet(lost, message, 0, 0)
+
+    def _wait_bitmap_ack(self, timeout_ms: int) -> (SequenceNr, int):
+        """Waits for the ACK of a burst
+        Returns:
+            The receiver's next expected sequence number and its bitmap of buffered packets beyond it,
+            or None if nothing valid was received within timeout_ms.
+        Raises:
+            SerialConnectionException: If serial connection times out
+        """
+        try:
+            (received_seq_nr, message) = self._recv_single_packet(timeout_ms)
+        except (LoraRxTimeoutException, LoraRxRadioException):
+            return None
+        if message[:len(self.ACK)] != self.ACK:
+            return None
+        return received_seq_nr, int.from_bytes(message[len(self.ACK):], 'little')
+
+    def _check_window(self, window: int):
+        if window > self.MAX_WINDOW:
+            raise ValueError(f"Window of {window} segments is larger than {self.MAX_WINDOW}")
 
     def _wait_ack_or_nack(self, expected_seq_nr: SequenceNr):
         """Waits for an ACK or a NACK for the given sequence number
@@ -132,10 +668,14 @@ class LoraConnection(LoraSerial):
             SerialConnectionException: If serial connection times out
         """
         try:
-            (received_seq_nr, message) = self._recv_single_packet(self.ACK_TIMEOUT)
-            return received_seq_nr == expected_seq_nr and message == self.ACK
+            (received_seq_nr, message) = self._recv_single_packet(self.ack_timeout)
         except (LoraRxTimeoutException, LoraRxRadioException):
+            if self.telemetry:
+                self.telemetry.emit("ack_timeout", seq=expected_seq_nr.nr)
             return False
+        if self.telemetry and message == self.NACK:
+            self.telemetry.emit("nack", seq=expected_seq_nr.nr)
+        return received_seq_nr == expected_seq_nr and message == self.ACK
 
     def _recv_single_packet(self, timeout_ms: int) -> (SequenceNr, bytes):
         """
@@ -149,19 +689,34 @@ class LoraConnection(LoraSerial):
             LoraRxRadioException: If radio received, but indicated an error in packet
             SerialConnectionException: If serial connection times out
         """
-        payload = self.recv_raw(timeout_ms)
-        seq_nr, message = SequenceNr.from_bytes(payload[:self.sender_seq_nr.n_bytes]), payload[self.sender_seq_nr.n_bytes:]
+        if self._received:
+            seq_nr, message = self._received.popleft()
+            message = bytes(message)
+        else:
+            if self._unread is not None:
+                payload, self._unread = self._unread, None
+            else:
+                payload = self.recv_raw(timeout_ms)
+            n_bytes = self.sender_seq_nr.n_bytes
+            seq_nr, message = SequenceNr.unpack_from(payload, 0, n_bytes), payload[n_bytes:]
+        # Anything heard from the peer confirms the settings
+        self._fallback_settings = None
 
         self._print_packet("<--", seq_nr, message)
         return (seq_nr, message)
 
-    def _send_single_packet(self, seq_nr: SequenceNr, message: bytes):
+    def _send_single_packet(self, seq_nr: SequenceNr, message: bytes, header: bytes = b"", pace: bool = True):
         """Send a raw message with the given sequence number, without waiting for any ACK/NACK
+        Args:
+            message: The message, e.g. a memoryview of a segment
+            header: Bytes between the sequence number and message, e.g. a burst header
+            pace: Whether to wait for the duty cycle budget, False for ACKs and NACKs, see LoraSerial.send_raw
         Raises:
             SerialConnectionException: If serial connection times out
         """
-        self.send_raw(seq_nr.as_bytes() + message)
-        self._print_packet("-->", seq_nr, message)
+        self.send_raw(message, seq_nr.as_bytes() + header, pace)
+        if self.debug_packets:
+            self._print_packet("-->", seq_nr, header + message)
 
     def _print_packet(self, prefix: str, seq_nr: SequenceNr, message: bytes):
         if self.debug_packets:
@@ -169,4 +724,4 @@ class LoraConnection(LoraSerial):
                 message = "ACK"
             elif message == self.NACK:
                 message = "NACK"
-            print(f"{prefix} (n={seq_nr.as_hex()}) {message}")
+            print(f"{prefix} (n={seq_nr.as_hex()}) {bytes(message) if isinstance(message, memoryview) else message}")
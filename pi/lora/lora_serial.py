@@ -1,9 +1,19 @@
 import serial
-from time import sleep, time
+import time
+from binascii import hexlify, unhexlify
 from sys import argv
 from .exceptions import SerialConnectionException, LoraRxTimeoutException, LoraRxRadioException
+from .fec import FecError
+from .radio_config import RadioConfig
+from .rx_engine import RxEngine
+from .airtime import uart_time, time_on_air
+from .telemetry import telemetry_from_env
 
 DEFAULT_PORT = "/dev/ttyUSB0"
+RADIO_RX = b"radio_rx"
+UNSOLICITED = (RADIO_RX, b"radio_err")  # Lines of a reception that ended after its caller stopped waiting for it
+TX_PREFIX = b"radio tx "
+TX_COMMAND_BYTES = len(TX_PREFIX) + 2 * 255 + len(b"\r\n")  # The longest 'radio tx' command line
 
 
 def get_serial_connection() -> serial.Serial:
@@ -27,6 +37,74 @@ def get_serial_connection() -> serial.Serial:
         print("Failed: ", e)
 
 
+class LineReader:
+    """Reads CRLF terminated lines from a serial connection, taking whatever bytes are waiting with each read
+    instead of reading one byte at a time.
+    Args:
+        ser: The serial connection (from pyserial)
+
+    Attributes:
+        ser: The serial connection (from pyserial)
+        buffer: Bytes read but not yet returned as a line
+    """
+    def __init__(self, ser: serial.Serial):
+        self.ser = ser
+        self.buffer = bytearray()
+
+    def read_line(self, timeout_ms: int) -> bytearray:
+        """Read a line, without its line end
+        Args:
+            timeout_ms: Time in milliseconds to wait at most for each part of the line
+        Raises:
+            SerialConnectionException: If the line times out
+        """
+        search_start = 0
+        end = self.buffer.find(b"\r\n")
+        while end < 0:
+            # The line end may straddle two reads
+            search_start = max(len(self.buffer) - 1, 0)
+            self.ser.timeout = timeout_ms / 1000
+            part = self.ser.read(max(self.ser.in_waiting, 1))
+            if not part:  # Timeout
+                raise SerialConnectionException()
+            self.buffer += part
+            end = self.buffer.find(b"\r\n", search_start)
+
+        line = self.buffer[:end]
+        del self.buffer[:end + 2]
+        return line
+
+
+def init_commands(freq: int, wdt: int, sf: str, power: int, coding_rate: str, bandwidth: float) -> list:
+    """The commands that reset a RN2483 and configure its radio for a point-to-point LoRa link"""
+    return [
+        "sys reset",
+        "mac pause",
+        f"radio set freq {freq}",
+        f"radio set wdt {wdt}",
+        "radio set mod lora",
+        f"radio set sf {sf}",
+        f"radio set pwr {power}",
+        # Crc is not supported by the fipy LoRa, so leave it off always
+        f"radio set crc off",
+        f"radio set cr {coding_rate}",
+        f"radio set bw {bandwidth}"
+    ]
+
+
+def decode_radio_rx(line: bytearray) -> bytes:
+    """Decode the payload of a 'radio_rx  <hex>' line straight from the line buffer"""
+    start = len(RADIO_RX)
+    while start < len(line) and line[start] == ord(" "):
+        start += 1
+    hex_message = memoryview(line)[start:]
+    # If for some reason RN2483 returns uneven-length data
+    if len(hex_message) % 2:
+        print(f"ERROR: Got non-even length hex string '{bytes(hex_message).decode('ascii')}'")
+        hex_message = hex_message[:-1]
+    return unhexlify(hex_message)
+
+
 class LoraSerial:
     """Handles a connection to a RN2483 LoRa chip
     Args:
@@ -36,47 +114,96 @@ class LoraSerial:
         power Power of radio, in dBm. Valid values are -3 to 15.
         coding_rate: Ratio of data to total size (i.e. data + redundancy). Valid values are '4/5', '4/6', '4/7', '4/8'
         debug_serial: Whether to print all messages to and from the RN2483.
+        clock: Provides time() and sleep(). Defaults to the time module, a simulator may pass its own.
+        fec: Forward error correction applied to every frame, e.g. a FrameCodec. Both ends must use the same.
+        continuous_rx: Whether to keep the radio listening between receptions, see RxEngine. The radio is then
+            only idle while transmitting, and frames arriving while nobody receives are queued.
+        telemetry: Telemetry to emit an event to for every frame and command, see telemetry. By default the one
+            configured by the LORA_TELEMETRY environment variable, if any.
+        duty_cycle: DutyCycleScheduler every frame sent is paced by, or None to send without regard to duty cycle
 
     Attributes:
         ser: The serial connection (from pyserial)
+        freq: Frequency of radio, in Hz
+        sf: Spreadfactor of radio
+        bandwidth: The bandwidth of the radio, in kHz
+        coding_rate: Coding rate of radio
+        power: Power of radio, in dBm
         debug_serial: Whether to print all messages to and from the RN2483.
-        wdt: The latest applied watchdog timer
+        radio_config: The settings the RN2483 is known to have, through which all settings are applied
+        clock: Source of time() and sleep() for all waiting done by the connection
+        fec: Forward error correction applied to every frame, or None
+        rx_engine: The RxEngine in continuous receive mode, or None
+        last_arrival: Clock time the last received frame was reported by the RN2483
+        telemetry: Telemetry events are emitted to, or None
+        duty_cycle: DutyCycleScheduler every frame sent is paced by, or None
+        pktrssi_supported: False once the firmware has rejected 'radio get pktrssi', which is then not sent again
 
     Raises:
         SerialConnectionException: If serial connection response from RN2483 module times out
     """
     SERIAL_READ_TIMEOUT = 3000  # ms read timeout for serial connection to RN2483
+    RX_REPORT_TIME = uart_time(len("radio_rx  \r\n") + 2 * 255)  # ms for the RN2483 to report the largest frame
 
     def __init__(self, ser: serial.Serial, bandwidth: float = 250, sf: str = "sf7", freq: int = 863500000,
-                 power: int = 14, coding_rate: str = "4/5", debug_serial: bool = False):
+                 power: int = 14, coding_rate: str = "4/5", debug_serial: bool = False, clock=time, fec=None,
+                 continuous_rx: bool = False, telemetry=None, duty_cycle=None):
         self.ser = ser
+        self.clock = clock
+        self.fec = fec
+        self.freq = freq
+        self.sf = sf
+        self.bandwidth = bandwidth
+        self.coding_rate = coding_rate
+        self.power = min(max(power, -3), 15)
         self.ser.timeout = self.SERIAL_READ_TIMEOUT
         self.debug_serial = debug_serial
-        self.wdt = 0
-
-        self._send_init_commands([
-                "sys reset",
-                "mac pause",
-                f"radio set freq {freq}",
-                f"radio set wdt {self.wdt}",
-                "radio set mod lora",
-                f"radio set sf {sf}",
-                f"radio set pwr {min(max(power, -3), 15)}",
-                # Crc is not supported by the fipy LoRa, so leave it off always
-                f"radio set crc off",
-                f"radio set cr {coding_rate}",
-                f"radio set bw {bandwidth}"
-        ])
-
-    def _send_init_commands(self, commands):
-        """Send a list of commands as initialization of the RN2483
+        self.reader = LineReader(ser)
+        self.radio_config = RadioConfig(self._send_command)
+        self.rx_engine = None
+        self.last_arrival = None
+        self.telemetry = telemetry if telemetry is not None else telemetry_from_env(clock)
+        self.duty_cycle = duty_cycle
+        self.pktrssi_supported = True
+        self._tx_command = bytearray(TX_PREFIX + bytes(TX_COMMAND_BYTES - len(TX_PREFIX)))
+        self._tx_view_full = memoryview(self._tx_command)
+        self._tx_view = None  # The command line of the last frame formatted
+        self._tx_frame_len = 0
+
+        self._configure_radio()
+        if continuous_rx:
+            # Receive timeouts are waited out by the engine
+            self.radio_config.apply({"wdt": 0})
+            self.rx_engine = RxEngine(ser, self.reader, clock)
+            self.rx_engine.start()
+
+    @property
+    def wdt(self) -> int:
+        """The latest applied watchdog timer, or -1 if unknown"""
+        return int(self.radio_config.settings.get("wdt", -1))
+
+    def _configure_radio(self):
+        """Configure the RN2483 for a point-to-point LoRa link.
+        The settings it already has are read back and only those that differ are sent. The module is only reset if
+        they can not be read.
         Raises:
             SerialConnectionException: If any command response times out
         """
-        for comm in commands:
-            print(comm, end=": ")
-            resp = self._send_command(comm)
-            print(resp)
+        # A module left listening without a watchdog would stay busy
+        for comm in ("mac pause", "radio rxstop"):
+            self._send_command(comm)
+        if not self.radio_config.read_back():
+            print("RN2483 state unknown, resetting it")
+            self.reader.buffer.clear()
+            self.ser.reset_input_buffer()
+            for comm in ("sys reset", "mac pause"):
+                print(comm, end=": ")
+                print(self._send_command(comm))
+
+        sent = self.radio_config.apply({"mod": "lora", "freq": self.freq, "sf": self.sf, "pwr": self.power,
+                                        # Crc is not supported by the fipy LoRa, so leave it off always
+                                        "crc": "off", "cr": self.coding_rate, "bw": self.bandwidth})
+        print("RN2483 configured" + (", set " + ", ".join(sent) if sent else ", settings unchanged"))
 
     def recv_raw(self, timeout_ms) -> bytes:
         """Receive a raw message over LoRa
@@ -86,54 +213,205 @@ class LoraSerial:
             The bytes received.
         Raises:
             LoraRxTimeoutException: If no packet is received within timeout_ms milliseconds
-            LoraRxRadioException: If packet is detected, but could not be received
+            LoraRxRadioException: If packet is detected, but could not be received or repaired
             SerialConnectionException: If any serial response from RN2483 times out
         """
+        if self.rx_engine:
+            return self._recv_queued(timeout_ms)
+
         self._set_radio_timeout(timeout_ms)
 
         # Radio might be busy, try until ready
         while (self._send_command("radio rx 0") != "ok"):
             pass
-        t_start = time()
+        t_start = self.clock.time()
 
         # Add a slight offset to serial timeout, to never time out serial while waiting for message.
-        response = self._recv_command(timeout_ms + 200)
+        response = self._recv_line(timeout_ms + 200)
+        self.last_arrival = self.clock.time()
 
-        if response.startswith("radio_rx"):
-            hex_message = response.lstrip("radio_rx ")
-            try:
-                return bytes.fromhex(hex_message)
-            # If for some reason RN2483 returns uneven-length data
-            except ValueError:
-                print(f"ERROR: Got non-even length hex string '{hex_message}'")
-                return bytes.fromhex(hex_message[:-1])
+        if response.startswith(RADIO_RX):
+            return self._decode_frame(response, t_start)
         else:
             # RN2483 returns 'radio_err' on both timeout and error.
-            if time() - t_start > timeout_ms / 1000:
+            if self.last_arrival - t_start > timeout_ms / 1000:
+                self._emit_rx_failure("rx_timeout", t_start)
                 raise LoraRxTimeoutException(timeout_ms)
             else:
+                self._emit_rx_failure("rx_error", t_start)
+                raise LoraRxRadioException
+
+    def _recv_queued(self, timeout_ms: int) -> bytes:
+        """recv_raw in continuous receive mode, taking the oldest frame the engine has queued"""
+        self.rx_engine.listen()
+        t_start = self.clock.time()
+        # As with the watchdog, a frame counts if it has been received within timeout_ms, even if still being reported
+        frame = self.rx_engine.recv_frame(timeout_ms + self.RX_REPORT_TIME)
+        if frame is None:
+            self.last_arrival = self.clock.time()
+            self._emit_rx_failure("rx_timeout", t_start)
+            raise LoraRxTimeoutException(timeout_ms)
+        self.last_arrival = frame.arrival
+        if frame.line is None:
+            self._emit_rx_failure("rx_error", t_start)
+            raise LoraRxRadioException
+        if self.debug_serial:
+            print("<", bytes(frame.line[:50]).decode('ascii'))
+        # Frames queued before anyone received took no waiting
+        return self._decode_frame(frame.line, min(t_start, frame.arrival))
+
+    def recv_queued(self) -> list:
+        """Take every frame already queued in continuous receive mode, without waiting, e.g. the rest of a burst
+        that arrived while its first frame was handled. Frames that could not be received or repaired are left out.
+        Returns:
+            The frames, oldest first. None are queued without continuous receive mode.
+        """
+        frames = []
+        frame = self.rx_engine.recv_frame(0) if self.rx_engine else None
+        while frame is not None:
+            self.last_arrival = frame.arrival
+            if frame.line is None:
+                self._emit_rx_failure("rx_error", frame.arrival)
+            else:
+                try:
+                    frames.append(self._decode_frame(frame.line, frame.arrival))
+                except LoraRxRadioException:
+                    pass
+            frame = self.rx_engine.recv_frame(0)
+        return frames
+
+    def _decode_frame(self, line: bytearray, t_start: float) -> bytes:
+        """The frame in a 'radio_rx' line
+        Args:
+            t_start: Clock time the reception started, for telemetry
+        Raises:
+            LoraRxRadioException: If it can not be repaired
+        """
+        frame = decode_radio_rx(line)
+        if self.fec:
+            try:
+                frame = self.fec.decode(frame)
+            except FecError:
+                self._emit_rx_failure("rx_error", t_start)
                 raise LoraRxRadioException
+        if self.telemetry:
+            self.telemetry.emit("rx", bytes=len(frame), wait_ms=(self.last_arrival - t_start) * 1000,
+                                sf=self.sf, bw=self.bandwidth)
+        return frame
 
-    def send_raw(self, message: bytes):
+    def _emit_rx_failure(self, kind: str, t_start: float):
+        if self.telemetry:
+            self.telemetry.emit(kind, wait_ms=(self.last_arrival - t_start) * 1000, sf=self.sf, bw=self.bandwidth)
+
+    def send_raw(self, message: bytes, header: bytes = b"", pace: bool = True):
         """Send a raw message over LoRa, without waiting for any ACK/NACK
         Args:
-            message: Bytes to send, must be at most 255 bytes
+            message: Bytes to send, must be at most 255 bytes less the overhead of any FEC. May be a memoryview of a
+                larger message, which is hex encoded straight into the command without being copied.
+            header: Bytes sent in front of message, e.g. a sequence number
+            pace: Whether to wait for the duty cycle budget of the channel. An answer the peer is waiting for, e.g.
+                an ACK, is sent right away instead, and its airtime is paid off by the frames sent after it.
+        Raises:
+            SerialConnectionException: If any serial response times out
+        """
+        if self.fec:
+            message, header = self.fec.encode(bytes(header) + message), b""
+        self._format_tx(header, message)
+        self._transmit(pace)
+
+    def resend_raw(self):
+        """Send the last message sent with send_raw again, reusing its formatted command
         Raises:
             SerialConnectionException: If any serial response times out
         """
-        self._set_radio_timeout(0)
-        command = "radio tx " + message.hex()
+        self._transmit()
 
-        command_resp = self._send_command(command)
+    def _format_tx(self, header: bytes, message: bytes):
+        """Hex encode a frame into the 'radio tx' command kept in _tx_command, which is allocated once"""
+        view = self._tx_view_full
+        middle = len(TX_PREFIX) + 2 * len(header)
+        end = middle + 2 * len(message)
+        if end + 2 > TX_COMMAND_BYTES:
+            raise ValueError(f"Frame of {len(header) + len(message)} bytes is longer than 255")
+        view[len(TX_PREFIX):middle] = hexlify(header)
+        view[middle:end] = hexlify(message)
+        view[end:end + 2] = b"\r\n"
+        self._tx_frame_len = len(header) + len(message)
+        self._tx_view = view[:end + 2]
+
+    def _transmit(self, pace: bool = True):
+        """Send the command in _tx_command and wait for the frame to have been sent
+        Args:
+            pace: Whether to wait for the duty cycle budget, see send_raw
+        """
+        airtime = None
+        if self.duty_cycle or self.telemetry:
+            airtime = time_on_air(self._tx_frame_len, self.sf, self.bandwidth, self.coding_rate)
+        if self.duty_cycle:
+            self._wait_duty_cycle(airtime, pace)
+        if self.rx_engine:
+            self.rx_engine.pause()
+        else:
+            self._set_radio_timeout(0)
+
+        t_start = self.clock.time()
+        busy_count = 0
+        command_resp = self._send_terminated(self._tx_view)
         while (command_resp != 'ok'):
             if (command_resp == 'busy'):
-                sleep(0.1)
-                command_resp = self._send_command(command)
+                self.clock.sleep(0.1)
+                busy_count += 1
+                command_resp = self._send_terminated(self._tx_view)
             else:
                 print("Received 'invalid_param'. Non-hex characters in message string?")
                 break
+        t_accepted = self.clock.time()
 
         self._recv_command()  # Wait for a "radio_tx_ok"
+        if self.telemetry:
+            # Serial latency is the time until the RN2483 accepted the command, the rest is spent on air
+            t_end = self.clock.time()
+            self.telemetry.emit("tx", bytes=self._tx_frame_len, start=t_start, end=t_end, airtime_ms=airtime,
+                                latency_ms=(t_accepted - t_start) * 1000, duration_ms=(t_end - t_start) * 1000,
+                                busy=busy_count, freq=self.freq, sf=self.sf, bw=self.bandwidth, pwr=self.power)
+        if self.rx_engine:
+            # Listen for the answer straight away
+            self.rx_engine.listen()
+
+    def _wait_duty_cycle(self, airtime_ms: float, pace: bool = True):
+        """Reserve the airtime of a frame from the duty cycle budget of the channel, waiting until it is available
+        unless pace is False"""
+        wait = self.duty_cycle.reserve(self.freq, self.bandwidth, airtime_ms)
+        if wait > 0 and pace:
+            if self.telemetry:
+                self.telemetry.emit("duty_cycle_wait", duration_ms=wait * 1000, freq=self.freq)
+            self.clock.sleep(wait)
+
+    def set_frequency(self, freq: int):
+        """Move the radio to another channel
+        Raises:
+            SerialConnectionException: If serial connection times out
+        """
+        if freq == self.freq:
+            return
+        if self.rx_engine:
+            self.rx_engine.pause()
+        self.radio_config.apply({"freq": freq})
+        self.freq = freq
+
+    def apply_settings(self, sf: str, bandwidth: float, coding_rate: str, power: int):
+        """Reconfigure the radio, sending only the settings that change
+        Raises:
+            SerialConnectionException: If serial connection times out
+        """
+        power = min(max(power, -3), 15)
+        if self.rx_engine:
+            self.rx_engine.pause()
+        self.radio_config.apply({"sf": sf, "bw": bandwidth, "cr": coding_rate, "pwr": power})
+        self.sf = sf
+        self.bandwidth = bandwidth
+        self.coding_rate = coding_rate
+        self.power = power
 
     def snr(self) -> int:
         """Get SNR of last received transmission (dB)
@@ -142,19 +420,43 @@ class LoraSerial:
         """
         snr = self._send_command("radio get snr")
         try:
-            return int(snr)
+            snr = int(snr)
         except ValueError:
             print(f"Unable to convert SNR '{snr}' to an int")
             return 0
+        if self.telemetry:
+            fields = {"snr": snr}
+            if self.telemetry.rssi:
+                # Both metrics of the link, of the same frame. Losing the RSSI must not lose the SNR read already.
+                try:
+                    fields["rssi"] = self.rssi()
+                except SerialConnectionException:
+                    fields["rssi"] = None
+            self.telemetry.emit("snr", **fields)
+        return snr
+
+    def rssi(self) -> int:
+        """Get RSSI of last received transmission (dBm), or None if the firmware can not report it
+        Raises:
+            SerialConnectionException: If response times out
+        """
+        if not self.pktrssi_supported:
+            return None
+        rssi = self._send_command("radio get pktrssi")
+        try:
+            return int(rssi)
+        except ValueError:
+            print(f"RN2483 can not report RSSI ('{rssi}'), not asking again")
+            self.pktrssi_supported = False
+            return None
 
     def _set_radio_timeout(self, timeout_ms: int):
         """Set the time in milliseconds of radio watchdog, after which 'radio...' commands to RN2483 return radio_err
         Raises:
             SerialConnectionException: If serial connection times out
         """
-        if (self.wdt != timeout_ms):
-            self._send_command("radio set wdt " + str(timeout_ms))
-            self.wdt = timeout_ms
+        if not self.rx_engine:
+            self.radio_config.apply({"wdt": timeout_ms})
 
     def _recv_command(self, timeout_ms: int = SERIAL_READ_TIMEOUT) -> str:
         """Receive a command from the RN2483 (e.g. 'radio_tx_ok')
@@ -165,22 +467,22 @@ class LoraSerial:
         Raises:
             SerialConnectionException: If response times out
         """
-        self.ser.timeout = timeout_ms / 1000
-        message = ""
-        while message[-2:] != "\r\n":
-            message_part = self.ser.read().decode('ascii')
-            if message_part:
-                message += message_part
-            else:  # Timeout
-                raise SerialConnectionException()
+        return self._recv_line(timeout_ms).decode('ascii')
 
-        message = message.rstrip("\r\n")
+    def _recv_line(self, timeout_ms: int = SERIAL_READ_TIMEOUT) -> bytearray:
+        """Receive a raw line from the RN2483, without its line end
+        Args:
+            timeout_ms: Time in milliseconds to wait at most for a response
+        Raises:
+            SerialConnectionException: If response times out
+        """
+        line = self.rx_engine.response(timeout_ms) if self.rx_engine else self.reader.read_line(timeout_ms)
         if (self.debug_serial):
-            if (len(message) < 50):
-                print("<", message)
+            if (len(line) < 50):
+                print("<", line.decode('ascii'))
             else:
-                print("<", message[:50] + "...")
-        return message
+                print("<", line[:50].decode('ascii') + "...")
+        return line
 
     def _send_command(self, line: str, timeout_ms: int = SERIAL_READ_TIMEOUT) -> str:
         """Send line to RN2483 followed by a line end ('\r\n'), and return response.
@@ -189,11 +491,40 @@ class LoraSerial:
         Raises:
             SerialConnectionException: If response times out
         """
+        return self._send_line(line.encode('ascii'), timeout_ms)
+
+    def _send_line(self, line: bytes, timeout_ms: int = SERIAL_READ_TIMEOUT) -> str:
+        """Send an already encoded line to RN2483 followed by a line end, and return response.
+        Args:
+            timeout_ms: Time in milliseconds to wait at most for a response
+        Raises:
+            SerialConnectionException: If response times out
+        """
+        return self._send_terminated(line + b"\r\n", timeout_ms)
+
+    def _send_terminated(self, line: bytes, timeout_ms: int = SERIAL_READ_TIMEOUT) -> str:
+        """Send a line to RN2483 that already ends in a line end, and return response.
+        A 'radio_rx' or 'radio_err' line arriving before the response is the late end of an earlier reception, no
+        command answers with either straight away, so it is skipped.
+        Args:
+            line: The line, e.g. a memoryview of a reused buffer
+            timeout_ms: Time in milliseconds to wait at most for a response
+        Raises:
+            SerialConnectionException: If response times out
+        """
         if (self.debug_serial):
-            if (len(line) < 50):
-                print(">", line)
+            if (len(line) < 52):
+                print(">", bytes(line[:-2]).decode('ascii'))
             else:
-                print(">", line[:50] + "...")
-        self.ser.timeout = None
-        self.ser.write((line + "\r\n").encode('ascii'))
-        return self._recv_command(timeout_ms)
+                print(">", bytes(line[:50]).decode('ascii') + "...")
+        if self.rx_engine:
+            self.rx_engine.write(line)
+        else:
+            self.ser.timeout = None
+            self.ser.write(line)
+        response = self._recv_line(timeout_ms)
+        # The engine keeps receptions apart from responses itself
+        while not self.rx_engine and response.startswith(UNSOLICITED):
+            print(f"Skipped late '{response.split()[0].decode('ascii')}' in place of a response")
+            response = self._recv_line(timeout_ms)
+        return response.decode('ascii')
@@ -0,0 +1,410 @@
+"""Node-addressed frames shared by several nodes on one channel, with the basestation polling one node at a time.
+
+Every frame starts with the address of the node it is from or to and a frame kind:
+    POLL      basestation -> node: node id, kind, next expected sequence number, grant, bitmap
+    DATA(END) node -> basestation: node id, kind, sequence number, frames left in burst, data
+    IDLE/DONE node -> basestation: node id, kind, next sequence number, 0
+A poll acknowledges everything before its sequence number and the frames marked in its bitmap (bit i is the
+frame i + 1 places after it), and grants the node a burst of at most grant frames. DATA_END marks the last
+segment of a message. A node with nothing to send answers IDLE, and DONE when it will not send more.
+"""
+
+from collections import deque
+
+from .lora_serial import LoraSerial
+from .sequence_nr import SequenceNr
+from .tx_stats import TxStats
+from .airtime import LinkPlanner
+from .exceptions import LoraRxTimeoutException, LoraTxTimeoutException, LoraRxRadioException
+
+
+POLL = 0x01
+DATA = 0x02
+DATA_END = 0x03
+IDLE = 0x04
+DONE = 0x05
+
+HEADER_BYTES = 4  # Node id, kind, sequence number and grant/frames left, in front of every frame
+MAX_GRANT = 16  # Most frames in one burst, must stay below half of the sequence number space
+BITMAP_BYTES = (MAX_GRANT + 7) // 8
+POLL_BYTES = HEADER_BYTES + BITMAP_BYTES
+
+
+class NodeSession:
+    """What the basestation knows about one node: its receive state and how eagerly to poll it
+    Args:
+        node_id: Address of the node
+
+    Attributes:
+        node_id: Address of the node
+        next_seq_nr: Sequence number of the next frame expected from the node
+        messages: Messages received in full, not yet returned by MultiNodeReceiver.recv_message
+        done: Whether the node has said it will not send anything more
+        absent: Whether the node stopped answering polls, e.g. asleep or after a lost DONE. It is still polled, but
+            ever less often, until it answers again.
+        backoff: Polls of other nodes to skip this node for, after it answered with nothing to send or not at all
+        skip: Polls left until this node is polled again
+        snr: SNR of the last burst received from the node
+        bytes_received: Data bytes received from the node
+        polls: Number of times the node has been polled
+        missed_polls: Number of polls the node did not answer
+    """
+    MAX_BACKOFF = 7
+    MAX_MISSED_POLLS = 5  # Unanswered polls in a row before a node is considered absent
+    MAX_ABSENT_BACKOFF = 63
+
+    def __init__(self, node_id: int):
+        self.node_id = node_id
+        self.next_seq_nr = SequenceNr()
+        self.messages = deque()
+        self.done = False
+        self.absent = False
+        self.backoff = 0
+        self.skip = 0
+        self.snr = 0
+        self.bytes_received = 0
+        self.polls = 0
+        self.missed_polls = 0
+        self.missed_in_row = 0
+
+        self._window = {}  # Out-of-order frames as sequence number: (data, last segment of message)
+        self._partial = bytearray()  # Segments of the message being reassembled
+
+    def accept(self, seq_nr: SequenceNr, data: bytes, end: bool) -> bool:
+        """Buffer a data frame and reassemble any messages now complete. Returns whether the frame was new."""
+        if seq_nr.offset_from(self.next_seq_nr) >= MAX_GRANT or seq_nr.nr in self._window:
+            return False
+        self._window[seq_nr.nr] = (data, end)
+        self.bytes_received += len(data)
+
+        while self.next_seq_nr.nr in self._window:
+            data, end = self._window.pop(self.next_seq_nr.nr)
+            self._partial += data
+            if end:
+                self.messages.append(bytes(self._partial))
+                self._partial.clear()
+            self.next_seq_nr.increase()
+        return True
+
+    def bitmap(self) -> int:
+        """Frames buffered beyond next_seq_nr, bit i for the frame i + 1 places after it"""
+        bitmap = 0
+        for nr in self._window:
+            bitmap |= 1 << (SequenceNr(nr).offset_from(self.next_seq_nr) - 1)
+        return bitmap
+
+    @property
+    def idle(self) -> bool:
+        """Whether the node is not in the middle of sending a message, or has stopped answering"""
+        return self.absent or not (self._partial or self._window)
+
+    def polled(self, answered: bool, sent_data: bool):
+        """Update the polling rate after a poll. Nodes with nothing to send, or absent, are polled exponentially less
+        often."""
+        self.polls += 1
+        if answered:
+            self.missed_in_row = 0
+            self.absent = False
+            self.backoff = 0 if sent_data else min(2 * self.backoff + 1, self.MAX_BACKOFF)
+        else:
+            self.missed_polls += 1
+            self.missed_in_row += 1
+            if self.missed_in_row >= self.MAX_MISSED_POLLS:
+                self.absent = True
+                self.backoff = min(2 * self.backoff + 1, self.MAX_ABSENT_BACKOFF)
+        self.skip = self.backoff
+
+    def wake(self):
+        """Poll the node again from the next polling round on, even if it was done"""
+        self.done = False
+        self.backoff = 0
+        self.skip = 0
+
+
+class PollScheduler:
+    """Decides which node the basestation polls next: round-robin over the nodes that are not done,
+    passing over nodes that are backing off
+    Args:
+        sessions: The sessions of the nodes to poll
+    """
+    def __init__(self, sessions: list):
+        self.sessions = sessions
+        self._next = 0
+
+    def next_session(self) -> NodeSession:
+        """The session to poll next, or None when all nodes are done"""
+        while any(not session.done for session in self.sessions):
+            session = self.sessions[self._next]
+            self._next = (self._next + 1) % len(self.sessions)
+            if session.done:
+                continue
+            if session.skip:
+                session.skip -= 1
+                continue
+            return session
+        return None
+
+
+class _NodeFrames(LoraSerial):
+    """Sending and receiving of node-addressed frames"""
+    ACK_NACK_DELAY = 25  # Milliseconds to wait before answering, to give the other side time to start listening
+
+    def __init__(self, *args, debug_packets: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.debug_packets = debug_packets
+        self.planner = LinkPlanner(self.sf, self.bandwidth, self.coding_rate, self.power, self.ACK_NACK_DELAY)
+
+    def _recv_frame(self, timeout_ms: int) -> (int, int, SequenceNr, int, bytes):
+        """Receive a node-addressed frame
+        Returns:
+            (node id, kind, sequence number, grant/frames left, rest of frame), or None for a frame too short to be one
+        Raises:
+            LoraRxTimeoutException: If nothing is received within the timeout
+            LoraRxRadioException: If radio received, but indicated an error in packet
+            SerialConnectionException: If serial connection times out
+        """
+        payload = self.recv_raw(timeout_ms)
+        if len(payload) < HEADER_BYTES:
+            return None
+        frame = (payload[0], payload[1], SequenceNr(payload[2]), payload[3], payload[HEADER_BYTES:])
+        self._print_frame("<--", *frame)
+        return frame
+
+    def _send_frame(self, node_id: int, kind: int, seq_nr: SequenceNr, count: int, data: bytes = b''):
+        """Send a node-addressed frame
+        Raises:
+            SerialConnectionException: If serial connection times out
+        """
+        self.send_raw(bytes((node_id, kind, seq_nr.nr, count)) + data)
+        self._print_frame("-->", node_id, kind, seq_nr, count, data)
+
+    def _print_frame(self, prefix: str, node_id: int, kind: int, seq_nr: SequenceNr, count: int, data: bytes):
+        if self.debug_packets:
+            print(f"{prefix} (node={node_id}, kind={kind}, n={seq_nr.as_hex()}, count={count}) {bytes(data[:20])}")
+
+
+class MultiNodeReceiver(_NodeFrames):
+    """The basestation end of node-addressed connections to several nodes sharing one channel.
+    Nodes only transmit when polled, so their bursts never collide, and the scheduler interleaves them so that
+    all nodes upload during the same wake period. Each node has a session with its own sequence numbers and
+    reassembly buffer.
+    Args:
+        node_ids: Addresses of the nodes to serve
+        window: Largest burst of frames to grant a node per poll
+        debug_packets: Whether to print packets being sent/received.
+
+    Attributes:
+        sessions: Session of each node, by node id
+        scheduler: Picks the node to poll next
+        window: Largest burst of frames granted per poll
+        reply_timeout: ms to wait for the first frame of a node's answer to a poll
+        burst_timeout: ms to wait for the next frame of a burst
+    """
+
+    def __init__(self, *args, node_ids: list = (), window: int = 8, **kwargs):
+        super().__init__(*args, **kwargs)
+        if window > MAX_GRANT:
+            raise ValueError(f"Window of {window} frames is larger than {MAX_GRANT}")
+
+        self.sessions = {node_id: NodeSession(node_id) for node_id in node_ids}
+        self.scheduler = PollScheduler(list(self.sessions.values()))
+        self.window = window
+        self.reply_timeout = self.planner.ack_timeout(POLL_BYTES, self.planner.FRAME_BYTES)
+        self.burst_timeout = self.planner.burst_timeout()
+
+    def recv_message(self, timeout_ms: int = 10000) -> (int, bytes):
+        """Poll the nodes until any of them has delivered a complete message
+        Args:
+            timeout_ms: Time in milliseconds all nodes may be idle before giving up. Polling a node in the middle of
+                a message can take longer, as long as it keeps answering.
+        Returns:
+            (node id, message), or None once every node is done
+        Raises:
+            LoraRxTimeoutException: If all nodes are idle and no node sends any data within timeout_ms milliseconds
+            SerialConnectionException: If any serial response times out
+        """
+        deadline = self.clock.time() + timeout_ms / 1000
+        while True:
+            for session in self.sessions.values():
+                if session.messages:
+                    return session.node_id, session.messages.popleft()
+
+            session = self.scheduler.next_session()
+            if session is None:
+                return None
+            if self.clock.time() > deadline:
+                raise LoraRxTimeoutException(timeout_ms)
+            if self.poll(session) or not all(session.idle for session in self.sessions.values()):
+                deadline = self.clock.time() + timeout_ms / 1000
+
+    def next_round(self):
+        """Poll all nodes again, e.g. for their next wake period after every node was done"""
+        for session in self.sessions.values():
+            session.wake()
+
+    def poll(self, session: NodeSession) -> bool:
+        """Poll a node and receive its burst
+        Returns:
+            Whether the node sent any new data
+        Raises:
+            SerialConnectionException: If any serial response times out
+        """
+        # Nodes overhearing the previous burst need time to start listening again
+        self.clock.sleep(self.ACK_NACK_DELAY / 1000)
+        self._send_frame(session.node_id, POLL, session.next_seq_nr, self.window,
+                         session.bitmap().to_bytes(BITMAP_BYTES, 'little'))
+
+        timeout = self.reply_timeout
+        answered = sent_data = False
+        remaining = 2  # Frames that may still come, at first the answer and, if that is lost, the rest of its burst
+        while remaining:
+            try:
+                frame = self._recv_frame(timeout)
+            except LoraRxRadioException:
+                continue
+            except LoraRxTimeoutException:
+                # Count it as a lost frame, but keep listening so the next poll does not collide with the burst
+                remaining -= 1
+                timeout = self.burst_timeout
+                continue
+            if frame is None or frame[0] != session.node_id or frame[1] == POLL:
+                # Overheard another node, or a poll from another basestation
+                continue
+            node_id, kind, seq_nr, remaining, data = frame
+            answered = True
+            timeout = self.burst_timeout
+
+            if kind == DONE:
+                session.done = True
+            elif kind in (DATA, DATA_END):
+                sent_data |= session.accept(seq_nr, data, kind == DATA_END)
+
+        if sent_data:
+            session.snr = self.snr()
+        session.polled(answered, sent_data)
+        return sent_data
+
+
+class PolledNode(_NodeFrames):
+    """The node end of a node-addressed connection, only transmitting when polled by a MultiNodeReceiver.
+    The node takes its first sequence number from the first poll, so a node may open a new PolledNode for every
+    transfer, as long as the previous one delivered everything.
+    Args:
+        node_id: Address of this node, 0-255
+        poll_timeout: ms to wait for a poll before giving up, which should cover a polling round of all nodes
+        debug_packets: Whether to print packets being sent/received.
+
+    Attributes:
+        node_id: Address of this node
+        poll_timeout: ms to wait for a poll before giving up
+    """
+
+    def __init__(self, *args, node_id: int = 1, poll_timeout: int = 60000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.node_id = node_id
+        self.poll_timeout = poll_timeout
+
+        self._seq_nr = None  # Sequence number of the first segment not yet ACKed, None until the first poll
+
+    def send_message(self, message: bytes, max_tries: int = 5, packet_delay: float = 0.0,
+                     window: int = MAX_GRANT) -> TxStats:
+        """Send a message, in the bursts the basestation polls for
+        Args:
+            message: A byte sequence of any length.
+            max_tries: Number of times to at most try to send each frame
+            packet_delay: Delay after each burst, in seconds
+            window: Largest burst to send, even if the basestation grants more
+        Raises:
+            LoraTxTimeoutException: If any frame fails to be ACKed within max_tries attempts.
+            LoraRxTimeoutException: If the basestation does not poll within poll_timeout
+            SerialConnectionException: If any serial response times out
+        Returns a collection of stats for the transmitted packets
+        """
+        data_bytes = self.planner.FRAME_BYTES - HEADER_BYTES
+        segments = [message[start:start + data_bytes] for start in range(0, len(message), data_bytes)] or [b'']
+        tx_counts = [0] * len(segments)
+        acked = [False] * len(segments)
+
+        base = 0
+        snr_total = 0
+        polls = 0
+        while True:
+            next_seq_nr, grant, bitmap = self._wait_poll()
+            if self._seq_nr is None:
+                self._seq_nr = next_seq_nr
+            snr_total += self.snr()
+            polls += 1
+
+            cumulative = next_seq_nr.offset_from(self._seq_nr)
+            if cumulative <= MAX_GRANT:
+                for i in range(base, min(base + cumulative, len(segments))):
+                    acked[i] = True
+                for i in range(base + cumulative + 1, min(base + cumulative + 1 + MAX_GRANT, len(segments))):
+                    if bitmap >> (i - base - cumulative - 1) & 1:
+                        acked[i] = True
+            while base < len(segments) and acked[base]:
+                base += 1
+                self._seq_nr.increase()
+
+            if base == len(segments):
+                self._answer(IDLE)
+                return TxStats(len(segments), sum(tx_counts), snr_total / polls)
+
+            burst = [i for i in range(base, min(base + min(grant, window), len(segments))) if not acked[i]]
+            for i in burst:
+                if tx_counts[i] == max_tries:
+                    raise LoraTxTimeoutException(tx_counts[i])
+            self._send_burst(segments, burst, base)
+            for i in burst:
+                tx_counts[i] += 1
+            self.clock.sleep(packet_delay)
+
+    def finish(self):
+        """Tell the basestation this node will not send anything more, in the answer to its next poll
+        Raises:
+            LoraRxTimeoutException: If the basestation does not poll within poll_timeout
+            SerialConnectionException: If any serial response times out
+        """
+        next_seq_nr, _, _ = self._wait_poll()
+        if self._seq_nr is None:
+            self._seq_nr = next_seq_nr
+        self._answer(DONE)
+
+    def _send_burst(self, segments: list, burst: list, base: int):
+        previous_len = POLL_BYTES
+        for n, i in enumerate(burst):
+            # Give the basestation time to read out the previous frame and start listening again,
+            # which a short frame would otherwise not allow
+            frame_len = HEADER_BYTES + len(segments[i])
+            read_out = self.planner.rx_response_time(previous_len) - self.planner.tx_command_time(frame_len)
+            self.clock.sleep((self.ACK_NACK_DELAY + max(read_out, 0)) / 1000)
+            previous_len = frame_len
+            seq_nr = SequenceNr(self._seq_nr.nr)
+            seq_nr.set(self._seq_nr.nr + i - base)
+            kind = DATA_END if i == len(segments) - 1 else DATA
+            self._send_frame(self.node_id, kind, seq_nr, len(burst) - n - 1, segments[i])
+
+    def _answer(self, kind: int):
+        self.clock.sleep(self.ACK_NACK_DELAY / 1000)
+        self._send_frame(self.node_id, kind, self._seq_nr, 0)
+
+    def _wait_poll(self) -> (SequenceNr, int, int):
+        """Listen until the basestation polls this node
+        Returns:
+            The next sequence number the basestation expects, the grant and the bitmap of the poll
+        Raises:
+            LoraRxTimeoutException: If no poll for this node is received within poll_timeout
+            SerialConnectionException: If any serial response times out
+        """
+        deadline = self.clock.time() + self.poll_timeout / 1000
+        while self.clock.time() < deadline:
+            try:
+                frame = self._recv_frame(self.poll_timeout)
+            except LoraRxRadioException:
+                continue
+            except LoraRxTimeoutException:
+                break
+            if frame is not None and frame[0] == self.node_id and frame[1] == POLL:
+                _, _, seq_nr, grant, bitmap = frame
+                return seq_nr, grant, int.from_bytes(bitmap, 'little')
+        raise LoraRxTimeoutException(self.poll_timeout)
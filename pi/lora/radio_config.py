@@ -0,0 +1,86 @@
+import re
+from .exceptions import SerialConnectionException
+
+RADIO_SETTINGS = ("mod", "freq", "sf", "bw", "cr", "pwr", "crc", "wdt")  # Settings read back from the RN2483
+RADIO_ERRORS = ("invalid_param", "busy", "radio_err")
+# Form of the value 'radio get' reports for each setting, anything else is the response to another command
+SETTING_FORMS = {"mod": re.compile(r"lora|fsk"), "freq": re.compile(r"\d{9}"), "sf": re.compile(r"sf(7|8|9|1[012])"),
+                 "bw": re.compile(r"125|250|500"), "cr": re.compile(r"4/[5-8]"), "pwr": re.compile(r"-?\d{1,2}"),
+                 "crc": re.compile(r"on|off"), "wdt": re.compile(r"\d+")}
+
+
+def valid_value(name: str, value: str) -> bool:
+    """Whether a response to 'radio get <name>' is a value of the setting, rather than an error"""
+    if not value or value in RADIO_ERRORS or value.startswith("radio_"):
+        return False
+    form = SETTING_FORMS.get(name)
+    return form is None or form.fullmatch(value) is not None
+
+
+def setting_value(value) -> str:
+    """A setting as the RN2483 reports it with 'radio get', e.g. 250.0 as '250'"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class RadioConfig:
+    """The radio settings of a RN2483 as last read back or applied, so that only the settings that change are sent.
+    The RN2483 keeps its settings until it is reset or powered off, so a process starting up can read them back
+    instead of resetting the module and configuring it from scratch.
+    Args:
+        send_command: Sends a command line to the RN2483 and returns its response, skipping the late end of any
+            earlier reception, e.g. LoraSerial._send_command
+
+    Attributes:
+        settings: Value of every known setting by name, in the form 'radio get' reports it
+    """
+    def __init__(self, send_command):
+        self.send_command = send_command
+        self.settings = {}
+
+    def read_back(self, names: tuple = RADIO_SETTINGS) -> bool:
+        """Learn the current values of the named settings with 'radio get'
+        Returns:
+            False if any of them could not be read, in which case the state of the module is unknown and every
+            setting is forgotten
+        """
+        try:
+            values = [self.send_command(f"radio get {name}") for name in names]
+        except SerialConnectionException:
+            values = []
+        # A module left receiving, or in the middle of booting, answers with something else, and a response out of
+        # step with its command would be the value of another setting
+        if len(values) != len(names) or not all(valid_value(name, value) for name, value in zip(names, values)):
+            self.forget()
+            return False
+        self.settings.update(zip(names, values))
+        return True
+
+    def apply(self, settings: dict) -> list:
+        """Send 'radio set' for every one of settings that differs from its known value
+        Args:
+            settings: Values by setting name, as for 'radio set'
+        Returns:
+            The names of the settings sent. If any of them is rejected, the state of the module is unknown and every
+            setting is forgotten.
+        Raises:
+            SerialConnectionException: If any command response times out
+        """
+        sent = []
+        for name, value in settings.items():
+            value = setting_value(value)
+            if self.settings.get(name) == value:
+                continue
+            response = self.send_command(f"radio set {name} {value}")
+            sent.append(name)
+            if response == "ok":
+                self.settings[name] = value
+            else:
+                print(f"RN2483 rejected 'radio set {name} {value}': {response}")
+                self.forget()
+        return sent
+
+    def forget(self):
+        """Forget all settings, e.g. after resetting the module"""
+        self.settings.clear()
@@ -0,0 +1,151 @@
+import threading
+from collections import deque, namedtuple
+from .exceptions import SerialConnectionException
+
+RADIO_RX = b"radio_rx"
+RADIO_ERR = b"radio_err"
+REARM = b"radio rx 0"
+
+RxFrame = namedtuple("RxFrame", ["arrival", "line"])
+RxFrame.__doc__ = """A frame reported by the RN2483: the clock time its line was read, and the 'radio_rx' line, or None for 'radio_err'"""
+
+
+def _wall_seconds(clock, seconds: float) -> float:
+    """Wall clock seconds to wait for the given seconds of clock, which may be simulated"""
+    return clock.wall_seconds(seconds) if hasattr(clock, "wall_seconds") else seconds
+
+
+class RxEngine:
+    """Keeps a RN2483 listening continuously, reading all of its output on a thread.
+    The moment a frame is reported, the receiver is re-armed with 'radio rx 0' from the thread, before anyone has even
+    decoded the frame, so that frames sent back-to-back are not lost in the gap. Frames are timestamped as their line
+    arrives and queued for recv_frame(). The radio watchdog must be disabled, receive timeouts are waited out here.
+    All commands must be written through write() while the engine runs, so that each response is matched to its
+    command.
+    Args:
+        ser: The serial connection (from pyserial)
+        reader: LineReader of ser
+        clock: Provides time(), e.g. LoraSerial.clock
+
+    Attributes:
+        frames: Received frames not yet taken with recv_frame()
+        listening: Whether the radio is in 'radio rx'
+        rearm_count: Number of times the receiver was re-armed straight after a frame
+    """
+    READ_TIMEOUT = 200  # ms each read of the thread waits, so that it notices being stopped
+
+    def __init__(self, ser, reader, clock):
+        self.ser = ser
+        self.reader = reader
+        self.clock = clock
+        self.frames = deque()
+        self.listening = False
+        self.rearm_count = 0
+
+        self._paused = True  # Whether to stay idle after the next frame rather than re-arm
+        self._owners = deque()  # For each command awaiting its response, whether the engine sent it
+        self._responses = deque()  # Lines for callers: command responses and 'radio_tx_ok'
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()  # Keeps the order of _owners that of the commands on the wire
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop listening and reading"""
+        self.pause()
+        self._running = False
+        self._thread.join()
+
+    def write(self, line: bytes):
+        """Send a command line ending in '\\r\\n', whose response is then read with response()"""
+        with self._write_lock:
+            with self._cond:
+                self._owners.append(False)
+            self.ser.write(line)
+
+    def response(self, timeout_ms: int) -> bytearray:
+        """The next line from the RN2483 that is not a received frame
+        Raises:
+            SerialConnectionException: If none arrives within timeout_ms
+        """
+        deadline = self.clock.time() + timeout_ms / 1000
+        with self._cond:
+            while not self._responses:
+                remaining = deadline - self.clock.time()
+                if remaining <= 0:
+                    raise SerialConnectionException()
+                self._cond.wait(_wall_seconds(self.clock, remaining))
+            return self._responses.popleft()
+
+    def listen(self):
+        """Start listening, and keep listening after every frame until paused"""
+        with self._write_lock:
+            with self._cond:
+                self._paused = False
+                if self.listening:
+                    return
+                self.listening = True
+                self._owners.append(True)
+            self.ser.write(REARM + b"\r\n")
+
+    def pause(self, timeout_ms: int = 3000):
+        """Stop listening, e.g. to transmit
+        Raises:
+            SerialConnectionException: If the RN2483 does not answer
+        """
+        with self._write_lock:
+            with self._cond:
+                self._paused = True
+                if not self.listening:
+                    return
+                self.listening = False
+                self._owners.append(False)
+            self.ser.write(b"radio rxstop\r\n")
+        self.response(timeout_ms)
+
+    def recv_frame(self, timeout_ms: int) -> RxFrame:
+        """The oldest frame received, waiting up to timeout_ms for one
+        Returns:
+            The frame, or None on timeout
+        """
+        deadline = self.clock.time() + timeout_ms / 1000
+        with self._cond:
+            while not self.frames:
+                remaining = deadline - self.clock.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(_wall_seconds(self.clock, remaining))
+            return self.frames.popleft()
+
+    def _run(self):
+        while self._running:
+            try:
+                line = self.reader.read_line(self.READ_TIMEOUT)
+            except SerialConnectionException:
+                continue
+            except OSError:  # Serial connection closed
+                break
+            arrival = self.clock.time()
+
+            with self._write_lock:
+                with self._cond:
+                    rearm = False
+                    if line.startswith(RADIO_RX) or (line == RADIO_ERR and self.listening):
+                        self.frames.append(RxFrame(arrival, line if line.startswith(RADIO_RX) else None))
+                        rearm = self.listening = not self._paused
+                        if rearm:
+                            self._owners.append(True)
+                            self.rearm_count += 1
+                    elif self._owners and self._owners.popleft():
+                        # Response to a re-arm, 'busy' if the radio was not ready for it
+                        self.listening &= line == b"ok"
+                    else:
+                        self._responses.append(line)
+                    self._cond.notify_all()
+                if rearm:
+                    self.ser.write(REARM + b"\r\n")
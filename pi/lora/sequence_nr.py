@@ -1,28 +1,68 @@
 class SequenceNr:
-    """A sequence number for a network connection
+    """A sequence number for a network connection, compared with serial number arithmetic (RFC 1982).
+    A number is after another if it is less than half of the number space ahead of it, so comparisons stay valid
+    across the wrap from the largest number back to 0. Numbers exactly half of the space apart are neither.
+    Args:
+        initial_value: Sequence number, wrapped into the number space
+        n_bytes: Number of bytes used for the sequence number
+
     Attributes:
         nr: Current sequence number
         n_bytes: Number of bytes used for the sequence number
     """
-    def __init__(self, initial_value: int = 0):
-        self.nr = initial_value
-        self.n_bytes = 1
+    __slots__ = ("nr", "n_bytes")
+
+    def __init__(self, initial_value: int = 0, n_bytes: int = 1):
+        self.n_bytes = n_bytes
+        self.nr = initial_value % (1 << 8 * n_bytes)
 
     def __str__(self):
         return self.as_hex()
 
+    def __repr__(self):
+        return f"SequenceNr({self.nr}, n_bytes={self.n_bytes})"
+
     def __eq__(self, other):
         if (isinstance(other, SequenceNr)):
             return other.nr == self.nr
         else:
             return NotImplemented
 
+    def __lt__(self, other):
+        if not isinstance(other, SequenceNr):
+            return NotImplemented
+        return 0 < (other.nr - self.nr) % (1 << 8 * self.n_bytes) < 1 << (8 * self.n_bytes - 1)
+
+    def __gt__(self, other):
+        if not isinstance(other, SequenceNr):
+            return NotImplemented
+        return other < self
+
+    def __le__(self, other):
+        return self == other or self < other
+
+    def __ge__(self, other):
+        return self == other or self > other
+
+    def __add__(self, n: int):
+        """The sequence number n increases after this one. n must be less than half of the number space."""
+        if not 0 <= n < 1 << (8 * self.n_bytes - 1):
+            raise ValueError(f"Can't add {n} to a {self.n_bytes} byte sequence number")
+        return SequenceNr(self.nr + n, self.n_bytes)
+
     def increase(self):
         self.set(self.nr + 1)
 
     def set(self, nr: int):
-        # Can convert to a bitwise operation if speed is needed:
-        self.nr = nr % (256**self.n_bytes)
+        self.nr = nr % (1 << 8 * self.n_bytes)
+
+    def previous(self):
+        """The sequence number before this one"""
+        return SequenceNr(self.nr - 1, self.n_bytes)
+
+    def offset_from(self, base) -> int:
+        """Number of increases needed to get from the sequence number base to this one"""
+        return (self.nr - base.nr) % (1 << 8 * self.n_bytes)
 
     def as_hex(self) -> str:
         """Get the current sequence number as a zero-padded hexadecimal"""
@@ -30,14 +70,30 @@ class SequenceNr:
 
     def from_hex(hex_code: str):
         try:
-            return SequenceNr(int(hex_code, 16))
+            return SequenceNr(int(hex_code, 16), max(len(hex_code) // 2, 1))
         except ValueError:
             print(f"Error setting sequence number from hex code '{hex_code}'\n")
             return SequenceNr(0)
 
     def from_bytes(b: bytes):
-        return SequenceNr.from_hex(b.hex())
+        return SequenceNr(int.from_bytes(b, 'big'), len(b))
+
+    def unpack_from(buffer, offset: int = 0, n_bytes: int = 1):
+        """The sequence number of n_bytes at offset into buffer, read through a memoryview so nothing is copied"""
+        return SequenceNr(int.from_bytes(memoryview(buffer)[offset:offset + n_bytes], 'big'), n_bytes)
 
     def as_bytes(self) -> bytes:
         """Get the current sequence number as a byte sequence"""
-        return bytes.fromhex(self.as_hex())
+        return self.nr.to_bytes(self.n_bytes, 'big')
+
+
+def split_frames(frames: list, n_bytes: int = 1) -> list:
+    """Parse the sequence number in front of each of a number of frames, e.g. frames read from the radio in one go
+    Returns:
+        (sequence number, rest of frame) for every frame, with the rest as a memoryview into the frame
+    """
+    parsed = []
+    for frame in frames:
+        view = memoryview(frame)
+        parsed.append((SequenceNr.unpack_from(view, 0, n_bytes), view[n_bytes:]))
+    return parsed
@@ -0,0 +1,352 @@
+import os
+import threading
+import time
+from collections import deque
+from math import log10
+from random import Random
+from .airtime import DEMOD_FLOOR, spreading_factor, time_on_air
+
+
+class SimulatedClock:
+    """A clock running speedup times faster than the wall clock, with the interface of the time module used by LoraSerial
+    Args:
+        speedup: Simulated seconds per wall clock second
+    """
+    def __init__(self, speedup: float = 1.0):
+        self.speedup = speedup
+        self._wall_start = time.monotonic()
+        self._start = time.time()
+
+    def time(self) -> float:
+        """Simulated seconds since the epoch"""
+        return self._start + (time.monotonic() - self._wall_start) * self.speedup
+
+    def sleep(self, seconds: float):
+        """Sleep for the given number of simulated seconds"""
+        time.sleep(seconds / self.speedup)
+
+    def wall_seconds(self, seconds):
+        """Wall clock seconds that pass during the given simulated seconds (None stays None)"""
+        return None if seconds is None else seconds / self.speedup
+
+
+class ChannelModel:
+    """The propagation between simulated RN2483 modules. Subclass and override the methods for other channel behaviour.
+    A frame is lost at random with probability loss, or whenever its SNR falls below the demodulation floor of its
+    spreading factor. Surviving frames get independent bit errors, which the receiver only notices if CRC is on.
+    Args:
+        loss: Probability of a frame being lost regardless of SNR
+        bit_error_rate: Probability of each received bit being flipped
+        snr_mean: Mean SNR (dB) of a frame sent at 14 dBm over 125 kHz
+        snr_std: Standard deviation of the SNR (dB)
+        seed: Seed for the random generator, for reproducible runs
+
+    Attributes:
+        random: The random generator driving the model
+    """
+    def __init__(self, loss: float = 0.0, bit_error_rate: float = 0.0, snr_mean: float = 10.0, snr_std: float = 0.0,
+                 seed: int = None):
+        self.loss = loss
+        self.bit_error_rate = bit_error_rate
+        self.snr_mean = snr_mean
+        self.snr_std = snr_std
+        self.random = Random(seed)
+
+    def time_on_air(self, payload_len: int, settings: dict) -> float:
+        """Seconds a frame of payload_len bytes occupies the air with the given 'radio set' settings"""
+        return time_on_air(payload_len, settings["sf"], float(settings["bw"]), settings["cr"],
+                           int(settings["prlen"]), settings["crc"] == "on") / 1000
+
+    def sample_snr(self, settings: dict) -> float:
+        """SNR (dB) of a frame sent with the given settings. Narrower bandwidth lets in less noise."""
+        return (self.random.gauss(self.snr_mean, self.snr_std) + int(settings["pwr"]) - 14
+                + 10 * log10(125 / float(settings["bw"])))
+
+    def corrupt(self, payload: bytes) -> bytes:
+        """The payload with independent bit errors applied"""
+        if not self.bit_error_rate:
+            return payload
+        corrupted = bytearray(payload)
+        for bit in range(8 * len(payload)):
+            if self.random.random() < self.bit_error_rate:
+                corrupted[bit // 8] ^= 1 << (bit % 8)
+        return bytes(corrupted)
+
+    def propagate(self, payload: bytes, settings: dict) -> (bytes, float):
+        """Send a frame through the channel
+        Returns:
+            (received payload, SNR), where the payload is None if the frame was lost
+        """
+        snr = self.sample_snr(settings)
+        if snr < DEMOD_FLOOR[spreading_factor(settings["sf"])] or self.random.random() < self.loss:
+            return None, snr
+        return self.corrupt(payload), snr
+
+
+class _Frame:
+    """A transmission in progress on the air"""
+    def __init__(self, sender, payload: bytes):
+        self.sender = sender
+        self.payload = payload
+        self.collided = False
+
+
+class SimulatedAir:
+    """The shared radio medium that simulated RN2483 modules transmit over.
+    A module only receives a frame if it was listening on the same frequency when the frame's transmission started,
+    and frames overlapping in time on the same frequency destroy each other.
+    Args:
+        channel: Model of loss, bit errors, SNR and time on air. Defaults to an ideal channel.
+        clock: Clock all attached modules run on. Defaults to real time.
+
+    Attributes:
+        devices: The simulated modules attached to the medium
+        channel: Model of loss, bit errors, SNR and time on air
+        clock: Clock all attached modules run on
+    """
+    def __init__(self, channel: ChannelModel = None, clock: SimulatedClock = None):
+        self.channel = channel or ChannelModel()
+        self.clock = clock or SimulatedClock()
+        self.devices = []
+        self._on_air = []
+        self._lock = threading.Lock()
+
+    def attach(self, device):
+        self.devices.append(device)
+
+    def transmit(self, sender, payload: bytes):
+        """Put a frame on the air, blocking for its time on air, and hand it to every module that caught its start"""
+        frame = _Frame(sender, payload)
+        freq = sender.settings["freq"]
+        with self._lock:
+            for other in self._on_air:
+                if other.sender.settings["freq"] == freq:
+                    other.collided = frame.collided = True
+            self._on_air.append(frame)
+            # A module only demodulates frames sent with its own spreading factor and bandwidth
+            listeners = [device for device in self.devices
+                         if device is not sender and device.listening and device.settings["freq"] == freq
+                         and device.settings["sf"] == sender.settings["sf"]
+                         and float(device.settings["bw"]) == float(sender.settings["bw"])]
+
+        self.clock.sleep(self.channel.time_on_air(len(payload), sender.settings))
+
+        with self._lock:
+            self._on_air.remove(frame)
+        if frame.collided:
+            return
+        for device in listeners:
+            received, snr = self.channel.propagate(payload, sender.settings)
+            if received is not None:
+                device.deliver(received, snr, corrupted=received != payload)
+
+
+class SimulatedRN2483:
+    """A file-like stand-in for a serial connection to a RN2483, speaking the subset of its command set used by LoraSerial.
+    Pass it to LoraSerial/LoraConnection in place of a serial.Serial (together with air.clock), or expose it on a
+    pseudo terminal with serve_pty(). Commands and responses take as long to cross the UART as they would at baudrate.
+    Args:
+        air: The medium to transmit and receive over
+        baudrate: Speed of the simulated UART, None for instant transfers
+
+    Attributes:
+        timeout: Read timeout in simulated seconds, None to block (as with pyserial)
+        settings: Values applied through 'radio set'
+        listening: Whether the module is currently in 'radio rx'
+        transmitting: Whether the module is currently in 'radio tx'
+        is_open: False once closed, as with pyserial
+        last_snr: SNR of the last received frame, as reported by 'radio get snr'
+        last_rssi: RSSI of the last received frame, as reported by 'radio get pktrssi'
+    """
+    VERSION = "RN2483 1.0.5 Oct 31 2019 15:06:52"
+    DEFAULT_SETTINGS = {"mod": "lora", "freq": "868100000", "pwr": "1", "sf": "sf12", "bw": "125", "cr": "4/5",
+                        "crc": "on", "prlen": "8", "wdt": "15000"}
+    NOISE_FLOOR = -120  # dBm of noise in the channel, which the received power of a frame is its SNR above
+
+    def __init__(self, air: SimulatedAir, baudrate: int = 57600):
+        self.timeout = None
+        self.baudrate = baudrate
+        self.settings = dict(self.DEFAULT_SETTINGS)
+        self.listening = False
+        self.transmitting = False
+        self.last_snr = -128
+        self.last_rssi = -160
+        self.is_open = True
+        self.air = air
+        self.air.attach(self)
+
+        self._in_buffer = bytearray()
+        self._out_buffer = bytearray()  # Output that has crossed the UART
+        self._out_pending = deque()  # (simulated time the line has crossed the UART, line) of output still in transfer
+        self._out_ready = threading.Condition()
+        self._rx_timer = None
+
+    @property
+    def in_waiting(self) -> int:
+        with self._out_ready:
+            self._collect_output()
+            return len(self._out_buffer)
+
+    def read(self, size: int = 1) -> bytes:
+        """Read up to size bytes of module output, waiting at most timeout seconds for any to arrive"""
+        clock = self.air.clock
+        deadline = None if self.timeout is None else clock.time() + self.timeout
+        with self._out_ready:
+            while not self._collect_output():
+                now = clock.time()
+                if deadline is not None and now >= deadline:
+                    break
+                wake_times = [t for t in (deadline, self._out_pending[0][0] if self._out_pending else None)
+                              if t is not None]
+                self._out_ready.wait(clock.wall_seconds(min(wake_times) - now) if wake_times else None)
+            data = bytes(self._out_buffer[:size])
+            del self._out_buffer[:size]
+            return data
+
+    def write(self, data: bytes) -> int:
+        """Feed bytes to the module, executing every complete command line"""
+        self.air.clock.sleep(self._transfer_time(len(data)))
+        self._in_buffer += data
+        while b"\r\n" in self._in_buffer:
+            line, _, rest = self._in_buffer.partition(b"\r\n")
+            self._in_buffer = bytearray(rest)
+            # Hold the output lock so the immediate response always precedes any asynchronous one
+            with self._out_ready:
+                self._respond(self._execute(line.decode("ascii")))
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self._out_ready:
+            self._out_buffer.clear()
+            self._out_pending.clear()
+
+    def close(self):
+        self._cancel_rx_timer()
+        self.is_open = False
+
+    def serve_pty(self) -> str:
+        """Expose the module on a new pseudo terminal, e.g. for running node.py or basestation.py against it.
+        The other end sees real time, so use it with an unaccelerated clock.
+        Returns:
+            The path of the terminal to open with serial.Serial
+        """
+        master, slave = os.openpty()
+        self._pty_slave = slave  # Keep the terminal alive for as long as the module is
+
+        def pump_commands():
+            while True:
+                self.write(os.read(master, 1024))
+
+        def pump_responses():
+            while True:
+                os.write(master, self.read(1024))
+
+        threading.Thread(target=pump_commands, daemon=True).start()
+        threading.Thread(target=pump_responses, daemon=True).start()
+        return os.ttyname(slave)
+
+    def deliver(self, payload: bytes, snr: float, corrupted: bool = False):
+        """Called by the air when a frame this module listened for has been received"""
+        with self._out_ready:
+            if self.listening:
+                self._cancel_rx_timer()
+                self.listening = False
+                self.last_snr = max(-128, min(127, round(snr)))
+                # Signal and noise together, so a frame below the noise still raises the power received a little
+                self.last_rssi = round(self.NOISE_FLOOR + 10 * log10(1 + 10 ** (snr / 10)))
+                if corrupted and self.settings["crc"] == "on":
+                    self._respond("radio_err")
+                else:
+                    self._respond("radio_rx  " + payload.hex().upper())
+
+    def _execute(self, command: str) -> str:
+        """Run a single command, returning its immediate response"""
+        words = command.split()
+        if command == "sys reset":
+            self._cancel_rx_timer()
+            self.listening = False
+            self.settings = dict(self.DEFAULT_SETTINGS)
+            return self.VERSION
+        if command == "mac pause":
+            return "4294967245"
+        if words[:2] == ["radio", "set"] and len(words) == 4:
+            self.settings[words[2]] = words[3]
+            return "ok"
+        if command == "radio get snr":
+            return str(self.last_snr)
+        if command == "radio get pktrssi":
+            return str(self.last_rssi)
+        if words[:2] == ["radio", "get"] and len(words) == 3 and words[2] in self.settings:
+            return self.settings[words[2]]
+        if command == "radio rxstop":
+            return self._stop_rx()
+        if words[:2] == ["radio", "rx"]:
+            return self._start_rx()
+        if words[:2] == ["radio", "tx"] and len(words) == 3:
+            return self._start_tx(words[2])
+        return "invalid_param"
+
+    def _start_rx(self) -> str:
+        if self.listening or self.transmitting:
+            return "busy"
+        self.listening = True
+        wdt = int(self.settings["wdt"])
+        if wdt:
+            self._rx_timer = threading.Timer(self.air.clock.wall_seconds(wdt / 1000), self._rx_timeout)
+            self._rx_timer.start()
+        return "ok"
+
+    def _stop_rx(self) -> str:
+        if self.transmitting:
+            return "invalid_param"
+        self._cancel_rx_timer()
+        self.listening = False
+        return "ok"
+
+    def _rx_timeout(self):
+        with self._out_ready:
+            if self.listening:
+                self.listening = False
+                self._respond("radio_err")
+
+    def _start_tx(self, hex_payload: str) -> str:
+        if self.listening or self.transmitting:
+            return "busy"
+        try:
+            payload = bytes.fromhex(hex_payload)
+        except ValueError:
+            return "invalid_param"
+        if len(payload) > 255:
+            return "invalid_param"
+        self.transmitting = True
+        threading.Thread(target=self._transmit, args=(payload,), daemon=True).start()
+        return "ok"
+
+    def _transmit(self, payload: bytes):
+        self.air.transmit(self, payload)
+        with self._out_ready:
+            self.transmitting = False
+            self._respond("radio_tx_ok")
+
+    def _cancel_rx_timer(self):
+        if self._rx_timer:
+            self._rx_timer.cancel()
+            self._rx_timer = None
+
+    def _transfer_time(self, n_bytes: int) -> float:
+        """Seconds n_bytes take over the UART, at 10 bits per byte (8N1)"""
+        return 10 * n_bytes / self.baudrate if self.baudrate else 0.0
+
+    def _collect_output(self) -> bool:
+        """Move output lines that have crossed the UART into the read buffer. Returns whether any output is readable."""
+        now = self.air.clock.time()
+        while self._out_pending and self._out_pending[0][0] <= now:
+            self._out_buffer += self._out_pending.popleft()[1]
+        return bool(self._out_buffer)
+
+    def _respond(self, line: str):
+        data = (line + "\r\n").encode("ascii")
+        with self._out_ready:
+            start = max(self.air.clock.time(), self._out_pending[-1][0] if self._out_pending else 0)
+            self._out_pending.append((start + self._transfer_time(len(data)), data))
+            self._out_ready.notify_all()
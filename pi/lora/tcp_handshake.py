@@ -1,192 +1,187 @@
 #!/usr/bin/env python3
 
-from struct import pack, unpack
-from time import time, sleep
+import random
+import zlib
+from struct import calcsize, pack, unpack_from
 from lora.exceptions import LoraRxTimeoutException, LoraRxRadioException
-
-CHAR_ENCODING = "UTF-8"
+from lora.sequence_nr import SequenceNr
 
 
 class HandShakePacket:
     """
-    Packet class for TCP 3-way handshake transmissions
-    Date: 06/03/2020
+    Packet of the connection handshake, a fixed binary layout:
+    version and type, node ID, session ID, spreading factor and coding rate, bandwidth, power, queued bytes, check byte
     """
 
-    __MAGIC_NO = 0x645F  # For identifying packet validity
-    __DATA_TYPE_SYN = 0  # Distinguishes SYN packet type
-    __DATA_TYPE_ACK = 1  # Distinguishes ACK packet type
-    __HDR_SUM = 16  # The sum of the bytes of 4 packed integer values
-    __FMT = "iiii"  # The format for the byte pack and unpack
+    VERSION = 2  # Version of the handshake frame layout, in the upper nibble of the first byte
+    TYPE_SYN = 0  # Sent by the node to open a session
+    TYPE_SYN_ACK = 1  # Sent by the basestation to accept it
+    FORMAT = ">BBHBBbI"  # The layout without the check byte
+    CHECK_FORMAT = ">B"  # Lowest byte of the CRC32 of the rest of the frame, as the RN2483 runs with its CRC off
+    BYTES = calcsize(FORMAT) + calcsize(CHECK_FORMAT)
+    BANDWIDTH_UNIT = 125  # kHz per step of the bandwidth field
 
-    def __init__(self, check_sum=None, magic_no=None, data_type=None, data_len=None, data=None):
+    def __init__(self, packet_type: int, node_id: int, session_id: int, sf: str, bandwidth: float,
+                 coding_rate: str, power: int, queued_bytes: int = 0):
         """
         Class constructor
-        :param check_sum: Length of byte packet header
-        :param magic_no: For identifying a packets validity
-        :param data_type: Distinguishes the packet type
-        :param data_len: The byte message being sent in the packet
-        :param data: Data being transmitted with packet
-        """
-        self.chk_sum = check_sum  # Length of byte packet header
-        self.magic_no = magic_no  # For identifying a packets validity
-        self.data_type = data_type  # Distinguishes the packet type
-        self.data_len = data_len  # Declares the length of data in the packet
-        self.data = data  # Data being transmitted with packet
-
-    def __valid_packet(self):
-        """
-        Checks if data received is a valid SYN/ACK packet with matching ID
-        :return: True if packet has matching magic num and no data, false otherwise
-        """
-        return self.magic_no == self.__MAGIC_NO
-
-    def valid_ack(self):
-        """
-        Checks if data received is a valid ACK packet
-        :return: True if data type is ACK, false otherwise
-        """
-        return self.data_type == self.__DATA_TYPE_ACK
+        :param packet_type: TYPE_SYN or TYPE_SYN_ACK
+        :param node_id: ID of the node opening the session
+        :param session_id: ID the node picked for the session, echoed by the basestation
+        :param sf: Spreading factor of the sender, 'sf7' to 'sf12'
+        :param bandwidth: Bandwidth of the sender in kHz, 125, 250 or 500
+        :param coding_rate: Coding rate of the sender, '4/5' to '4/8'
+        :param power: Transmit power of the sender in dBm
+        :param queued_bytes: Bytes the sender has queued to send in the session
+        """
+        self.packet_type = packet_type
+        self.node_id = node_id
+        self.session_id = session_id
+        self.sf = sf
+        self.bandwidth = bandwidth
+        self.coding_rate = coding_rate
+        self.power = power
+        self.queued_bytes = queued_bytes
+
+    def buffer(self) -> bytes:
+        """
+        Converts the packet into the bytes to transmit
+        :return: The packet as bytes
+        """
+        frame = pack(self.FORMAT, self.VERSION << 4 | self.packet_type, self.node_id, self.session_id,
+                     int(self.sf[2:]) << 4 | int(self.coding_rate[2:]), int(self.bandwidth) // self.BANDWIDTH_UNIT,
+                     self.power, min(self.queued_bytes, 0xFFFFFFFF))
+        return frame + pack(self.CHECK_FORMAT, zlib.crc32(frame) & 0xFF)
+
+    @classmethod
+    def un_buffer(cls, packet: bytes):
+        """
+        Unpacks a received frame
+        :param packet: The received frame
+        :return: A HandShakePacket, or None if the frame is not a valid handshake packet of this version
+        """
+        if len(packet) != cls.BYTES or zlib.crc32(packet[:-1]) & 0xFF != packet[-1]:
+            return None
+        version_type, node_id, session_id, sf_cr, bandwidth, power, queued_bytes = unpack_from(cls.FORMAT, packet)
+        if version_type >> 4 != cls.VERSION or version_type & 0x0F not in (cls.TYPE_SYN, cls.TYPE_SYN_ACK):
+            return None
+        return HandShakePacket(version_type & 0x0F, node_id, session_id, f"sf{sf_cr >> 4}",
+                               bandwidth * cls.BANDWIDTH_UNIT, f"4/{sf_cr & 0x0F}", power, queued_bytes)
 
     def valid_syn(self):
-        """
-        Checks if data received is a valid SYN packet
-        :return: True if data type is SYN, false otherwise
-        """
-        return self.data_type == self.__DATA_TYPE_SYN
-
-    def __valid_data(self):
-        """
-        Checks if data received is equal to the provided data len
-        :return: True if data is same size as provided data len, false otherwise
-        """
-        return self.data_len == len(str(self.data))
+        return self.packet_type == self.TYPE_SYN
 
-    def __valid_check_sum(self):
-        """
-        Validates the check sum equals the sum of magic num, data type and data len
-        :return: True if check sum equals magic num, data type and data len sum, false otherwise
-        """
-        return self.chk_sum == (self.magic_no + self.data_type + self.data_len)
-
-    def buffer(self, msg_type, msg=b''):
-        """
-        Converts a SYN/ACK data package into a byte pack for transmitting
-        :param msg_type: whether the transmitting message is a SYN or ACK message
-        :param msg: The byte message being sent in the packet
-        :return: The data converted to a byte pack
-        """
-        if msg_type:
-            self.data_type = self.__DATA_TYPE_ACK
-        else:
-            self.data_type = self.__DATA_TYPE_SYN
-        self.data_len = len(msg)
-        self.chk_sum = self.__MAGIC_NO + self.data_type + self.data_len
-        return pack(self.__FMT + str(self.data_len) + "s", self.chk_sum,
-                    self.__MAGIC_NO, self.data_type, self.data_len, msg)
+    def valid_ack(self):
+        return self.packet_type == self.TYPE_SYN_ACK
 
-    def un_buffer(self, msg_type, packet):
+    @classmethod
+    def resembles(cls, packet: bytes) -> bool:
         """
-        Unpacks received byte pack and converts it to a SYN/ACK data packet
-        :param msg_type: whether the expected message is a SYN or ACK message
-        :param packet: The received data packet
-        :return: an instance for received packet or None if packet invalid
+        Whether a frame has the length and first byte of a handshake packet, e.g. one corrupted on the way
+        :param packet: The received frame
         """
-        self.chk_sum, self.magic_no, self.data_type, \
-            self.data_len = unpack(self.__FMT, packet[:self.__HDR_SUM])
-
-        if self.__valid_packet() and self.__valid_data() and \
-                ((msg_type and self.valid_ack()) or
-                 (not msg_type and self.valid_syn())):
-            if not self.__valid_check_sum():
-                self.data_len = self.chk_sum - \
-                                (self.magic_no + self.data_type)
-            data = unpack(str(self.data_len) + "s",
-                          packet[self.__HDR_SUM:self.data_len +
-                                 self.__HDR_SUM])[0].decode(CHAR_ENCODING)
-            return HandShakePacket(self.chk_sum, self.magic_no, self.data_type,
-                                   self.data_len, eval(data))
-        return None
+        return len(packet) == cls.BYTES and packet[0] in (cls.VERSION << 4 | cls.TYPE_SYN,
+                                                          cls.VERSION << 4 | cls.TYPE_SYN_ACK)
 
 
 class ThreeWayHandshake:
     """
-    Class for managing TCP 3-way handshake transmissions
-    Date: 06/03/2020
+    Class for managing the connection handshake. The node sends a SYN and the basestation answers with a SYN-ACK,
+    after which the node starts sending data right away. Its first data frame stands in for the final ACK of a TCP
+    handshake: the basestation keeps answering SYNs until it hears it, and hands it on to the LoraConnection. Only a
+    frame numbered within the first window of a session counts as it, anything else heard meanwhile is ignored.
+    Both ends start the session with their sequence numbers at 0, on the channel handshakes are made on, see LoraConnection.go_home.
     """
 
-    __SYN = 4500
-    __SYN_ACK = 4501
-    __ACK = 4502
     __MAX_TIME = 20  # maximum time attempting to establish connection (s)
     __SLEEP_TIME = 0.2  # the time between each transmission
-    __PACK_TIMEOUT = 500  # ms to listen for a packet before timing out
 
-    def __init__(self, lora_conn):  # battery_status=None):
+    def __init__(self, lora_conn, node_id: int = 0):
         """
         Class constructor
+        :param lora_conn: The LoraConnection to open a session on
+        :param node_id: ID of this node, when requesting the connection
         """
         self.lora_conn = lora_conn
-        self.packet = HandShakePacket()
-        # self.battery_status = battery_status
+        self.node_id = node_id
+        self.session_id = None
+        self.peer = None  # The last HandShakePacket received from the other end
         self.trans_cnt = 0
 
-    def request_conn(self):
-        """
-        Request establishing a LoRa connection for transmitting data using 3-way handshake
-        :return: True if connection established with the server using 3-way handshake, False otherwise
-        """
-        end_time = time() + self.__MAX_TIME
+    def _packet(self, packet_type: int, queued_bytes: int = 0) -> HandShakePacket:
+        conn = self.lora_conn
+        return HandShakePacket(packet_type, self.node_id, self.session_id, conn.sf, conn.bandwidth, conn.coding_rate,
+                               conn.power, queued_bytes)
+
+    def request_conn(self, queued_bytes: int = 0):
+        """
+        Request establishing a LoRa connection for transmitting data
+        :param queued_bytes: Bytes queued to send in the session, for the basestation to plan by
+        :return: True if connection established with the server, False otherwise
+        """
+        self.session_id = random.getrandbits(16)
+        self.lora_conn.go_home()
+        end_time = self.lora_conn.clock.time() + self.__MAX_TIME
+
+        while self.lora_conn.clock.time() < end_time:
+            self.lora_conn.send_raw(self._packet(HandShakePacket.TYPE_SYN, queued_bytes).buffer())
+            self.trans_cnt += 1
+            try:
+                # Listen straight away, the SYN-ACK follows immediately
+                new_pckt = HandShakePacket.un_buffer(self.lora_conn.recv_raw(self.lora_conn.ack_timeout))
+            except (LoraRxRadioException, LoraRxTimeoutException):
+                new_pckt = None
+
+            if new_pckt and new_pckt.valid_ack() and new_pckt.session_id == self.session_id:
+                self.peer = new_pckt
+                self.lora_conn.reset()
+                return True
+            self.lora_conn.clock.sleep(self.__SLEEP_TIME)
+        return False
 
-        while time() < end_time:
-            if not self.trans_cnt:
-                self.lora_conn.send_raw(self.packet.buffer(0, bytes(str(self.__SYN),
-                                                                    encoding=CHAR_ENCODING)))
+    def accept_conn(self, window: int = 1):
+        """
+        Accept establishing a LoRa connection for transmitting data. The node's coding rate and power are adopted,
+        since the radio hears frames sent with any of them.
+        :param window: Window the session is received with, within which the first data frame is numbered
+        :return: True if connection established with the client, False otherwise
+        """
+        self.lora_conn.go_home()
+        end_time = self.lora_conn.clock.time() + self.__MAX_TIME
+
+        while self.lora_conn.clock.time() < end_time:
+            try:
+                raw_pckt = self.lora_conn.recv_raw(self.lora_conn.ack_timeout)
+            except (LoraRxRadioException, LoraRxTimeoutException):
+                continue
+
+            new_pckt = HandShakePacket.un_buffer(raw_pckt)
+            if new_pckt and new_pckt.valid_syn():
+                # A SYN, either new or retransmitted because our SYN-ACK was lost. The client is listening now.
+                self.peer = new_pckt
+                self.node_id = new_pckt.node_id
+                self.session_id = new_pckt.session_id
+                self.lora_conn.clock.sleep(self.lora_conn.ACK_NACK_DELAY / 1000)
+                # The client only listens for ack_timeout, so the answer is not held up by the duty cycle
+                self.lora_conn.send_raw(self._packet(HandShakePacket.TYPE_SYN_ACK).buffer(), pace=False)
                 self.trans_cnt += 1
-            elif self.trans_cnt == 1:
-                try:
-                    new_pckt = self.packet.un_buffer(1, self.lora_conn.recv_raw(self.__PACK_TIMEOUT))
-                except (LoraRxRadioException, LoraRxTimeoutException):
-                    new_pckt = None
-
-                if new_pckt and new_pckt.valid_ack():
-                    # this is where battery status can be included in the message
-                    self.lora_conn.send_raw(self.packet.buffer(1, bytes(str(self.__ACK),
-                                                                        encoding=CHAR_ENCODING)))
-                    return True
-                else:
-                    self.trans_cnt -= 1
-            sleep(self.__SLEEP_TIME)
+            elif self.trans_cnt and not new_pckt and self._first_data_frame(raw_pckt, window):
+                # The client got our SYN-ACK and is sending data, receive it as the first frame of the session
+                conn = self.lora_conn
+                conn.apply_settings(conn.sf, conn.bandwidth, self.peer.coding_rate, self.peer.power)
+                conn.reset()
+                conn.unread(raw_pckt)
+                return True
         return False
 
-    def accept_conn(self):
-        """
-        Accept establishing a LoRa connection for transmitting data using 3-way handshake
-        :return: True if connection established with the client using 3-way handshake, False otherwise
-        """
-        end_time = time() + self.__MAX_TIME
-
-        while time() < end_time:
-            if not self.trans_cnt:
-                try:
-                    new_pckt = self.packet.un_buffer(0, self.lora_conn.recv_raw(self.__PACK_TIMEOUT))
-                except (LoraRxRadioException, LoraRxTimeoutException):
-                    new_pckt = None
-
-                if new_pckt and new_pckt.valid_syn():
-                    self.lora_conn.send_raw(self.packet.buffer(1, bytes(str(self.__SYN_ACK),
-                                                                        encoding=CHAR_ENCODING)))
-                    self.trans_cnt += 1
-            elif self.trans_cnt == 1:
-                try:
-                    new_pckt = self.packet.un_buffer(1, self.lora_conn.recv_raw(self.__PACK_TIMEOUT))
-                except (LoraRxRadioException, LoraRxTimeoutException):
-                    new_pckt = None
-
-                if new_pckt and new_pckt.valid_ack():
-                    return True
-                else:
-                    self.lora_conn.send_raw(self.packet.buffer(1, bytes(str(self.__SYN_ACK),
-                                                                        encoding=CHAR_ENCODING)))
-            sleep(self.__SLEEP_TIME)
-        return False
+    def _first_data_frame(self, raw_pckt: bytes, window: int) -> bool:
+        """
+        Whether a frame received after our SYN-ACK can be the first data frame of the session: numbered within the
+        first window of a session, rather than a handshake frame corrupted on the way or other traffic
+        :param raw_pckt: The received frame
+        :param window: Window the session is received with
+        """
+        n_bytes = self.lora_conn.recv_seq_nr.n_bytes
+        if len(raw_pckt) <= n_bytes or HandShakePacket.resembles(raw_pckt):
+            return False
+        return SequenceNr.unpack_from(raw_pckt, 0, n_bytes).offset_from(SequenceNr(0, n_bytes)) < window
@@ -0,0 +1,232 @@
+"""Structured events of the LoRa stack, for seeing where the time of a transfer goes.
+LoraSerial and LoraConnection emit an event for every frame, command and ACK to a Telemetry, which passes it on to
+its sinks: a ring buffer in memory, a JSON-lines file or a Prometheus text file. Without a Telemetry nothing is
+built, so it costs a single check per frame.
+
+Telemetry can be switched on without changing any code by setting LORA_TELEMETRY to a comma separated list of sinks,
+e.g. LORA_TELEMETRY=jsonl:/tmp/lora.jsonl,prom:/var/lib/node_exporter/lora.prom
+Adding rssi to the list also records the RSSI of received frames, which takes a serial round trip per frame.
+"""
+
+import bisect
+import json
+import os
+import time
+from collections import deque
+
+ENV_VARIABLE = "LORA_TELEMETRY"
+
+TRIES_BUCKETS = (1, 2, 3, 5, 10, 20)  # Transmissions per frame
+SNR_BUCKETS = tuple(range(-20, 21, 2))  # dB
+RSSI_BUCKETS = tuple(range(-140, -39, 10))  # dBm
+MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BYTES_BUCKETS = (4, 16, 64, 128, 192, 255)
+# Fields of events summarised as histograms by PrometheusSink, with their buckets
+HISTOGRAM_FIELDS = {"airtime_ms": MS_BUCKETS, "latency_ms": MS_BUCKETS, "duration_ms": MS_BUCKETS,
+                    "wait_ms": MS_BUCKETS, "snr": SNR_BUCKETS, "rssi": RSSI_BUCKETS, "tries": TRIES_BUCKETS,
+                    "bytes": BYTES_BUCKETS}
+
+
+class Histogram:
+    """Counts of observed values in fixed buckets, along with their count, sum, min and max
+    Args:
+        bounds: Ascending upper bounds of the buckets. Larger values are counted in an extra, unbounded, bucket.
+
+    Attributes:
+        counts: Number of values in each bucket
+        count: Number of values observed
+        sum: Sum of the values observed
+        min: Smallest value observed, or None
+        max: Largest value observed, or None
+    """
+    def __init__(self, bounds: tuple):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "Histogram"):
+        """Add the values observed by another histogram with the same bounds"""
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(value for value in (self.min, other.min) if value is not None) if other.count else self.min
+        self.max = max(value for value in (self.max, other.max) if value is not None) if other.count else self.max
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile, within the observed range"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def __str__(self):
+        if not self.count:
+            return "n=0"
+        return (f"n={self.count} mean={self.mean():.1f} p50={self.quantile(0.5):g} p90={self.quantile(0.9):g} "
+                f"max={self.max:g}")
+
+
+class Telemetry:
+    """Passes events to sinks
+    Args:
+        sinks: Objects with write(event) and close(), e.g. RingBufferSink, JsonLinesSink, PrometheusSink
+        clock: Provides time() for the event timestamps, e.g. LoraSerial.clock
+        rssi: Whether LoraSerial reads the RSSI of every received frame along with its SNR. It takes another
+            command to the RN2483, which delays the answer to the frame.
+    """
+    def __init__(self, sinks: list, clock=time, rssi: bool = False):
+        self.sinks = list(sinks)
+        self.clock = clock
+        self.rssi = rssi
+
+    def __bool__(self):
+        return bool(self.sinks)
+
+    def emit(self, kind: str, **fields):
+        """Send an event of the given kind, timestamped with the clock, to every sink"""
+        event = {"event": kind, "t": self.clock.time()}
+        event.update(fields)
+        for sink in self.sinks:
+            sink.write(event)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class RingBufferSink:
+    """Keeps the latest events in memory
+    Args:
+        capacity: Number of events to keep
+
+    Attributes:
+        events: The latest events, oldest first
+    """
+    def __init__(self, capacity: int = 1000):
+        self.events = deque(maxlen=capacity)
+
+    def write(self, event: dict):
+        self.events.append(event)
+
+    def close(self):
+        pass
+
+    def time_breakdown(self) -> dict:
+        """Seconds spent by kind of event, for the events that have a duration"""
+        seconds = {}
+        for event in self.events:
+            for field in ("duration_ms", "wait_ms"):
+                if field in event:
+                    key = event["event"] if field == "duration_ms" else f"{event['event']} wait"
+                    seconds[key] = seconds.get(key, 0.0) + event[field] / 1000
+        return seconds
+
+
+class JsonLinesSink:
+    """Appends every event to a file as a line of JSON
+    Args:
+        path: File to append to
+    """
+    def __init__(self, path: str):
+        self.file = open(path, "a", buffering=1)
+
+    def write(self, event: dict):
+        self.file.write(json.dumps(event) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class PrometheusSink:
+    """Counts events by kind and keeps histograms of their HISTOGRAM_FIELDS, rewriting them to a file in the
+    Prometheus text format, e.g. for the textfile collector of node_exporter. The file is replaced atomically.
+    Args:
+        path: File to write
+        write_every: Number of events between rewrites of the file, besides on close()
+        prefix: Prefix of the metric names
+    """
+    def __init__(self, path: str, write_every: int = 50, prefix: str = "lora"):
+        self.path = path
+        self.write_every = write_every
+        self.prefix = prefix
+        self.counts = {}
+        self.histograms = {}
+        self._unwritten = 0
+
+    def write(self, event: dict):
+        kind = event["event"]
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        for field, bounds in HISTOGRAM_FIELDS.items():
+            value = event.get(field)
+            if value is not None:
+                key = (kind, field)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(bounds)
+                self.histograms[key].observe(value)
+        self._unwritten += 1
+        if self._unwritten >= self.write_every:
+            self.flush()
+
+    def flush(self):
+        lines = [f"# TYPE {self.prefix}_events_total counter"]
+        lines += [f'{self.prefix}_events_total{{event="{kind}"}} {count}' for kind, count in sorted(self.counts.items())]
+        for (kind, field), histogram in sorted(self.histograms.items()):
+            name = f"{self.prefix}_{kind}_{field}"
+            lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum {histogram.sum:g}")
+            lines.append(f"{name}_count {histogram.count}")
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+        self._unwritten = 0
+
+    def close(self):
+        self.flush()
+
+
+SINKS = {"ring": lambda arg: RingBufferSink(int(arg) if arg else 1000), "jsonl": JsonLinesSink,
+         "prom": PrometheusSink}
+
+
+def telemetry_from_env(clock=time) -> Telemetry:
+    """The Telemetry configured by LORA_TELEMETRY, or None if it is not set"""
+    spec = os.environ.get(ENV_VARIABLE)
+    if not spec:
+        return None
+    sinks = []
+    rssi = False
+    for sink_spec in spec.split(","):
+        name, _, arg = sink_spec.partition(":")
+        if name == "rssi":
+            rssi = True
+            continue
+        if name not in SINKS:
+            print(f"Unknown telemetry sink '{name}' in {ENV_VARIABLE}, expected one of {', '.join(SINKS)}")
+            continue
+        sinks.append(SINKS[name](arg))
+    return Telemetry(sinks, clock, rssi) if sinks else None
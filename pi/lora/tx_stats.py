@@ -1,15 +1,36 @@
+from .telemetry import Histogram, TRIES_BUCKETS, SNR_BUCKETS
+
+
 class TxStats:
     """Stats of a message sent over the radio
     Attributes:
         packet_count: Number of packets sent
         tx_count: Number of performed transmissions
         snr: Average signal to noise ratio of the received ACKs
+        tries: Histogram of the transmissions needed per packet
+        snrs: Histogram of the signal to noise ratio of the received ACKs
     """
-    def __init__(self, packet_count: int, tx_count: int, snr: int):
+    def __init__(self, packet_count: int, tx_count: int, snr: int, tries: Histogram = None, snrs: Histogram = None):
         self.packet_count = packet_count
         self.tx_count = tx_count
         self.snr = snr
+        self.tries = tries if tries is not None else Histogram(TRIES_BUCKETS)
+        self.snrs = snrs if snrs is not None else Histogram(SNR_BUCKETS)
+
+    def add(self, stats: "TxStats"):
+        """Add the stats of another message, e.g. the next chunk of a stream"""
+        packet_count = self.packet_count + stats.packet_count
+        if packet_count:
+            self.snr = (self.snr * self.packet_count + stats.snr * stats.packet_count) / packet_count
+        self.packet_count = packet_count
+        self.tx_count += stats.tx_count
+        self.tries.merge(stats.tries)
+        self.snrs.merge(stats.snrs)
 
     def loss_count(self):
         """Number of packets lost during message transmissions"""
         return self.tx_count - self.packet_count
+
+    def summary(self) -> str:
+        """The histograms on one line, e.g. for logging"""
+        return f"tries: {self.tries}, snr: {self.snrs}"
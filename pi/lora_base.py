@@ -3,7 +3,7 @@
 import traceback
 from sys import path, platform
 path.append('..')
-from lora import get_serial_connection, LoraConnection
+from lora import get_serial_connection, LoraConnection, PolledNode, shared_scheduler
 
 
 class LoraBase:
@@ -15,10 +15,25 @@ class LoraBase:
     _FINISH_BAT_TRANS = b'\xF0'  # Tells receiver the battery voltage transfer is complete
     _START_IMG_TRANS = b'\x00'  # Tells receiver it's about to receive an image
     _FINISH_IMG_TRANS = b'\xFF'  # Tells receiver image transfer is complete
+    _RESUME_IMG_TRANS = b'\x3C'  # Followed by file ID and size, asks receiver which byte ranges of an image it has
+    _STAGE_DONE = b'\x5A'  # Followed by a stage number, tells receiver that stage of an image has been sent
+    _LAST_STAGE = b'\xA5'  # Followed by a stage number, answers _STAGE_DONE with the last stage receiver wants
+    _ALL_STAGES = 255  # Last stage receiver wants when it wants the full image
+    _END_SESSION = b'\xC3'  # Tells receiver the node has nothing more to send after the handshake it made
     _SYS_PLTFRM = platform
 
     _MAX_TX_TRIES = 20  # Max transmit attempts. Used with LoraConnection.send_message
     _RX_TIMEOUT = 10000  # Receive timeout in ms. Used with LoraConnection.recv_message
+    _WINDOW = 1  # Segments per ACKed burst, 1 for stop-and-wait. Used with LoraConnection.send_message/recv_message
+    _NODE_IDS = ()  # Nodes the basestation serves concurrently. Empty for a single node connecting with a handshake
+    _NODE_ID = 1  # Address of this node, when _NODE_IDS is set
+    _JOURNAL_DIR = 'journals'  # Directory of the journals of interrupted image transfers, to resume them from
+    _JOURNAL_MAX_AGE = 7 * 24 * 3600  # Seconds without progress after which the journal of a transfer is dropped
+    _RESUME_BATCH = 16  # Segments sent per send_message in a resumable transfer, i.e. how often progress is saved
+    _DUTY_CYCLE_STATE = 'duty_cycle.json'  # File remembering the airtime spent per sub-band between runs
+    _AWAKE_TIME = 120  # Seconds a node may spend sending each wake cycle, which the duty cycle budget is planned for
+    _WAKE_ENERGY = 60  # J a node may spend sending each wake cycle
+    _LOW_BATTERY_ENERGY = 15  # J a node may spend sending each wake cycle while its battery is low
 
     __DEBUG_PCKTS = True
 
@@ -27,6 +42,8 @@ class LoraBase:
         Class initializer
         """
         self.ser = self.lora = None
+        # One per process, so that every connection spends and saves the same budget
+        self.duty_cycle = shared_scheduler(self._DUTY_CYCLE_STATE)
 
     def init_lora(self):
         """
@@ -37,16 +54,27 @@ class LoraBase:
 
         if self.ser:
             try:
-                self.lora = LoraConnection(self.ser,
-                                           debug_packets=self.__DEBUG_PCKTS)
+                if self._NODE_IDS:
+                    self.lora = self._node_connection(self.ser, debug_packets=self.__DEBUG_PCKTS,
+                                                      duty_cycle=self.duty_cycle)
+                else:
+                    self.lora = LoraConnection(self.ser,
+                                               debug_packets=self.__DEBUG_PCKTS, duty_cycle=self.duty_cycle)
                 return self.lora
             except Exception as e:
                 traceback.print_tb(e.__traceback__)
                 print(e)
                 return False
 
+    def _node_connection(self, ser, **kwargs):
+        """
+        Connection used when the basestation serves several nodes
+        """
+        return PolledNode(ser, node_id=self._NODE_ID, **kwargs)
+
     def close_serial_conn(self):
         """
-        Closes serial connection
+        Closes serial connection, and saves the duty cycle budget spent
         """
+        self.duty_cycle.save()
         self.ser.close()
@@ -0,0 +1,116 @@
+"""Relevance of a camera frame: how much of it differs from a rolling model of the empty scene.
+PIR sensors also trigger on wind moving plants and on the sun warming the ground, so frames scoring close to 0 are
+most likely empty. Frames are compared as means of blocks of their luma plane, which is cheap enough for a Pi Zero.
+Of a burst of frames, the sharpest one still showing what triggered it is kept.
+"""
+
+import os
+import numpy as np
+
+BLOCK = 8  # Pixels per side of the blocks of the luma plane that are compared
+THRESHOLD = 12  # Difference of the mean luma of a block from the background at which it counts as changed
+LEARNING_RATE = 0.2  # Weight of a new frame in the background, a tenth of it for the blocks that changed
+IN_VIEW = 0.5  # Fraction of the highest relevance in a burst at which a frame counts as showing the same event
+
+
+def block_means(luma: np.ndarray, block: int = BLOCK) -> np.ndarray:
+    """Mean of each block x block pixels of a 2D luma plane, leaving out the pixels of incomplete blocks"""
+    rows, cols = luma.shape[0] // block, luma.shape[1] // block
+    blocks = luma[:rows * block, :cols * block].reshape(rows, block, cols, block)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def sharpness(luma: np.ndarray) -> float:
+    """Variance of the Laplacian of a 2D luma plane, which drops as motion blur or defocus smooth out its edges"""
+    luma = luma.astype(np.float32)
+    laplacian = (4 * luma[1:-1, 1:-1] - luma[:-2, 1:-1] - luma[2:, 1:-1] - luma[1:-1, :-2] - luma[1:-1, 2:])
+    return float(laplacian.var())
+
+
+def yuv420_luma(frame: bytes, resolution: tuple) -> np.ndarray:
+    """The luma plane of a raw YUV420 frame, like the camera writes for format 'yuv', as a view of its bytes.
+    The camera pads the width to a multiple of 32 and the height to a multiple of 16.
+    """
+    width, height = resolution
+    padded_width = (width + 31) // 32 * 32
+    padded_height = (height + 15) // 16 * 16
+    return np.frombuffer(frame, dtype=np.uint8, count=padded_width * padded_height).reshape(
+        padded_height, padded_width)[:height, :width]
+
+
+class BackgroundModel:
+    """Rolling model of the empty scene in front of the camera, kept in a file between wake cycles
+    Args:
+        path: .npy file to keep the background in, None to start empty every time
+        threshold: Difference of the mean luma of a block from the background at which it counts as changed
+        learning_rate: Weight of a new frame in the background
+        block: Pixels per side of the blocks compared
+
+    Attributes:
+        background: Mean luma of each block of the scene, or None before the first frame
+    """
+    def __init__(self, path: str = None, threshold: float = THRESHOLD, learning_rate: float = LEARNING_RATE,
+                 block: int = BLOCK):
+        self.path = path
+        self.threshold = threshold
+        self.learning_rate = learning_rate
+        self.block = block
+        self.background = None
+        if path:
+            try:
+                self.background = np.load(path)
+            except (OSError, ValueError):
+                pass
+
+    def score(self, luma: np.ndarray) -> float:
+        """Fraction of the blocks of a frame that differ from the background, 1 if there is no background of the
+        same size to compare to. The frame is then added to the background.
+        Args:
+            luma: 2D luma plane of the frame, e.g. PiYUVArray.array[:, :, 0]
+        """
+        blocks = block_means(luma, self.block)
+        changed = self._changed(blocks)
+        if changed is None:
+            self.background = blocks
+            return 1.0
+
+        # Something standing still in view is slow to become part of the background
+        rate = np.where(changed, self.learning_rate / 10, self.learning_rate).astype(np.float32)
+        self.background += rate * (blocks - self.background)
+        return float(changed.mean())
+
+    def compare(self, luma: np.ndarray) -> float:
+        """Like score(), without adding the frame to the background"""
+        changed = self._changed(block_means(luma, self.block))
+        return 1.0 if changed is None else float(changed.mean())
+
+    def _changed(self, blocks: np.ndarray) -> np.ndarray:
+        """Which blocks differ from the background, or None if there is no background of the same size"""
+        if self.background is None or self.background.shape != blocks.shape:
+            return None
+        # A change of the brightness of the whole scene, e.g. the sun coming out, is not motion
+        gain = np.median(blocks) / max(np.median(self.background), 1)
+        diff = blocks - gain * self.background
+        diff -= np.median(diff)
+        return np.abs(diff) > self.threshold
+
+    def save(self):
+        """Save the background to path, replacing it atomically. Nothing is saved without a path."""
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, self.background)
+        os.replace(tmp_path, self.path)
+
+
+def best_frame(lumas: list, background: BackgroundModel) -> int:
+    """Index of the frame of a burst to keep: the sharpest of the frames that differ from the background nearly as
+    much as the one differing the most, i.e. those still showing what triggered the burst
+    Args:
+        lumas: 2D luma planes of the frames
+        background: Background the frames are compared to, which is left as it is
+    """
+    relevance = [background.compare(luma) for luma in lumas]
+    in_view = [i for i, r in enumerate(relevance) if r >= IN_VIEW * max(relevance)]
+    return max(in_view, key=lambda i: sharpness(lumas[i]))
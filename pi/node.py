@@ -1,12 +1,55 @@
-from take_picture import take_pic, get_unsent_pics, mark_pics_sent
-from send_image import SendImage
-from send_battery import SendBattery
+from functools import partial
+from take_picture import take_burst, queue_stills, get_backlog, mark_pics_sent, record_progress, IMAGE_RES, VERT_FLIP
+from transfer_session import TransferSession
 from lora.exceptions import LoraTxTimeoutException, SerialConnectionException
 from arduino_com import ArduinoCom
+from pre_roll import PreRollBuffer
+from picamera import PiCamera
+from gpiozero import MotionSensor
 import subprocess
+import threading
+import time
 
 
 BATTERY_THRESHOLD = 3.3
+# Keep the camera recording a pre-roll instead of capturing after each wake-up, for nodes on mains or solar power.
+# An armed node keeps running armed(), which sends the backlog every SEND_INTERVAL seconds instead of on wake-ups.
+ARMED = False
+SEND_INTERVAL = 30 * 60  # Seconds between the transfers of an armed node
+PIR_PIN = 17  # GPIO pin the PIR output is wired to on an armed node
+ARMED_FRAMERATE = 5  # Frames per second of the pre-roll
+POST_FRAMES = 2  # Stills queued from after each trigger, besides the one from before it
+
+
+def send_backlog(arduino: ArduinoCom):
+    """
+    Send the pictures not yet sent and, when low, the battery voltage, in one session
+    """
+    print("Sending pictures")
+    backlog = get_backlog()
+    print("Unsent pictures:", [photo.file_name for photo in backlog])
+    low_battery = arduino.get_battery() < BATTERY_THRESHOLD
+
+    # One session for all pictures and the battery voltage, so the radio is set up and connected only once
+    session = TransferSession()
+    # The battery alarm goes first, what does not fit the duty cycle and energy budget waits for the next wake cycle
+    plan = session.plan(backlog, low_battery)
+    print("Sending this wake cycle:", [item.file_name or "battery voltage" for item in plan])
+    if plan and session.open(sum(item.payload_bytes for item in plan)):
+        try:
+            for item in plan:
+                if item.file_name is None:
+                    print("Sending battery voltage")
+                    session.send_battery(arduino)
+                else:
+                    session.send_image(item.file_name, partial(record_progress, item.file_name), item.stages)
+                    if item.last:
+                        mark_pics_sent(item.file_name)
+            session.close()
+        except (LoraTxTimeoutException, SerialConnectionException) as e:
+            print("Sending failed:", e)
+            print("Aborting session, the rest is sent next wake cycle")
+            session.close_serial_conn()
 
 
 def main():
@@ -15,30 +58,11 @@ def main():
     print("Checking GPIO pin")
     if not arduino.is_motion_wakeup():
         print("Timer wakeup")
-        print("Sending pictures")
-        unsent = get_unsent_pics()
-        print("Unsent pictures:", unsent)
-
-        if unsent:
-            for pic in unsent:
-                try:
-                    if SendImage(pic).start_sending():
-                        mark_pics_sent(pic)
-                    else:
-                        print(f"Image '{pic}' could not be sent.")
-                except (LoraTxTimeoutException, SerialConnectionException) as e:
-                    print("Sending image failed:", e)
-                    print("Aborting image sending")
-                    break
-        else:
-            send_battery = SendBattery(arduino)
-            if arduino.get_battery() < BATTERY_THRESHOLD:
-                print("Sending battery voltage")
-                send_battery.send()
+        send_backlog(arduino)
     else:
-        print("PIR active, taking picture")
+        print("PIR active, taking a burst of pictures")
         arduino.ir_led_on()
-        take_pic()
+        take_burst()
         arduino.ir_led_off()
 
     print("Sending shutdown signal to Arduino")
@@ -51,5 +75,38 @@ def main():
     # subprocess.Popen(['sudo', 'halt'])
 
 
+def send_periodically(arduino: ArduinoCom):
+    """
+    Send the backlog every SEND_INTERVAL seconds, like a sleeping node does on its timer wake-ups
+    """
+    while True:
+        send_backlog(arduino)
+        time.sleep(SEND_INTERVAL)
+
+
+def armed():
+    """
+    Keep a pre-roll of the camera in memory, and queue stills from before and after every PIR trigger.
+    The backlog is sent from another thread meanwhile, so triggers are not missed during a transfer.
+    """
+    arduino = ArduinoCom()
+    pir = MotionSensor(PIR_PIN)
+    threading.Thread(target=send_periodically, args=(arduino,), daemon=True).start()
+    with PiCamera(resolution=IMAGE_RES, framerate=ARMED_FRAMERATE) as camera:
+        camera.vflip = VERT_FLIP
+        with PreRollBuffer(camera) as pre_roll:
+            while True:
+                pir.wait_for_motion()
+                print("PIR active, extracting stills from the pre-roll")
+                arduino.ir_led_on()
+                stills = pre_roll.extract(POST_FRAMES)
+                arduino.ir_led_off()
+                queue_stills(stills)
+                pir.wait_for_no_motion()
+
+
 if __name__ == '__main__':
-    main()
+    if ARMED:
+        armed()
+    else:
+        main()
@@ -0,0 +1,295 @@
+"""Image payloads sent over LoRa, as a one byte format header followed by the encoded image.
+The basestation only needs the header to store what it receives, so decoding never needs Pillow.
+"""
+
+import io
+import struct
+import zlib
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+HEADER_FORMAT = ">B"  # Format of the payload
+HEADER_BYTES = struct.calcsize(HEADER_FORMAT)
+LENGTH_FORMAT = ">I"  # Length of the first stage of a multi-stage payload
+LENGTH_BYTES = struct.calcsize(LENGTH_FORMAT)
+STAGE_COUNT_FORMAT = ">B"  # Number of stages of a progressive payload
+STAGE_END_FORMAT = ">I"  # Offset into the payload body where a stage of a progressive payload ends
+
+JPEG_SOS = b'\xff\xda'  # Start of a scan of a JPEG
+JPEG_EOI = b'\xff\xd9'  # End of a JPEG
+
+IMAGE_EXTENSIONS = {b'\xff\xd8\xff': '.jpeg', b'\x89PNG': '.png', b'RIFF': '.webp'}
+
+
+CODECS = {}  # Codec classes by format
+
+
+def register_codec(codec_class):
+    """Make payloads of codec_class decodable by its FORMAT"""
+    CODECS[codec_class.FORMAT] = codec_class
+    return codec_class
+
+
+class PayloadCodec:
+    """Turns an image file into the bytes sent over the air, and back into image files.
+    Subclass and register_codec() to add a format.
+    Attributes:
+        FORMAT: Header byte identifying the format
+    """
+    FORMAT = None
+
+    def encode(self, image: bytes) -> bytes:
+        """The payload body for an image file
+        Raises:
+            ValueError: If the image can not be encoded with this codec
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def decode(cls, body: bytes) -> list:
+        """Image files in a payload body, each stage of the image in the order they were sent"""
+        return [body]
+
+
+@register_codec
+class RawCodec(PayloadCodec):
+    """Sends the image file as it is, e.g. the JPEG from the camera"""
+    FORMAT = 0x00
+
+    def encode(self, image: bytes) -> bytes:
+        return image
+
+
+@register_codec
+class DeflateCodec(PayloadCodec):
+    """Compresses the file losslessly, which only pays off for files that are not already compressed images"""
+    FORMAT = 0x04
+
+    def encode(self, image: bytes) -> bytes:
+        return zlib.compress(image, 9)
+
+    @classmethod
+    def decode(cls, body: bytes) -> list:
+        try:
+            return [zlib.decompress(body)]
+        except zlib.error as e:
+            raise ValueError(f"Corrupt deflate payload: {e}")
+
+
+class _PillowCodec(PayloadCodec):
+    """Re-encodes the image with Pillow"""
+    PIL_FORMAT = None
+
+    def __init__(self, quality: int, **save_options):
+        self.quality = quality
+        self.save_options = save_options
+
+    def encode(self, image: bytes) -> bytes:
+        return self.encode_image(open_image(image))
+
+    def encode_image(self, image) -> bytes:
+        """Encode a Pillow image"""
+        encoded = io.BytesIO()
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(encoded, self.PIL_FORMAT, quality=self.quality, **self.save_options)
+        return encoded.getvalue()
+
+
+@register_codec
+class JpegCodec(_PillowCodec):
+    """Re-encodes the image as an optimized progressive JPEG
+    Args:
+        quality: JPEG quality, 1-95
+    """
+    FORMAT = 0x01
+    PIL_FORMAT = "JPEG"
+
+    def __init__(self, quality: int = 10):
+        super().__init__(quality, optimize=True, progressive=True)
+
+
+@register_codec
+class WebpCodec(_PillowCodec):
+    """Re-encodes the image as a lossy WebP
+    Args:
+        quality: WebP quality, 0-100
+    """
+    FORMAT = 0x02
+    PIL_FORMAT = "WEBP"
+
+    def __init__(self, quality: int = 20):
+        super().__init__(quality, method=6)
+
+
+@register_codec
+class ThumbnailCodec(PayloadCodec):
+    """Sends a downscaled thumbnail of the image first and the full image after it, both as complete payloads
+    Args:
+        codec: Codec of the full image
+        thumbnail_codec: Codec of the thumbnail
+        size: Largest thumbnail width and height, in pixels
+    """
+    FORMAT = 0x03
+
+    def __init__(self, codec: PayloadCodec = None, thumbnail_codec: _PillowCodec = None, size: tuple = (64, 48)):
+        self.codec = codec or RawCodec()
+        self.thumbnail_codec = thumbnail_codec or WebpCodec()
+        self.size = size
+
+    def encode(self, image: bytes) -> bytes:
+        thumbnail = open_image(image)
+        thumbnail.thumbnail(self.size)
+        first = struct.pack(HEADER_FORMAT, self.thumbnail_codec.FORMAT) + self.thumbnail_codec.encode_image(thumbnail)
+        return struct.pack(LENGTH_FORMAT, len(first)) + first + encode_payload(image, self.codec, fallback=False)
+
+    @classmethod
+    def decode(cls, body: bytes) -> list:
+        first_len, = struct.unpack_from(LENGTH_FORMAT, body)
+        first_end = LENGTH_BYTES + first_len
+        return decode_payload(body[LENGTH_BYTES:first_end]) + decode_payload(body[first_end:])
+
+
+@register_codec
+class ProgressiveCodec(PayloadCodec):
+    """Sends a tiny grayscale thumbnail, then the image as a progressive JPEG with its scans grouped into refinement
+    stages. Every stage can be shown as soon as it has arrived, since a progressive JPEG cut after any scan is a
+    complete, coarser, image. The body starts with a table of where each stage ends.
+    Args:
+        quality: JPEG quality of the image, 1-95
+        thumbnail_size: Largest thumbnail width and height, in pixels
+        refinements: Number of stages to send the JPEG in, the first of which is its DC scan
+    """
+    FORMAT = 0x05
+
+    def __init__(self, quality: int = 10, thumbnail_size: tuple = (80, 60), refinements: int = 3):
+        self.codec = JpegCodec(quality)
+        self.thumbnail_codec = WebpCodec()
+        self.thumbnail_size = thumbnail_size
+        self.refinements = refinements
+
+    def encode(self, image: bytes) -> bytes:
+        image = open_image(image)
+        thumbnail = image.convert("L")
+        thumbnail.thumbnail(self.thumbnail_size)
+        first = struct.pack(HEADER_FORMAT, self.thumbnail_codec.FORMAT) + self.thumbnail_codec.encode_image(thumbnail)
+        jpeg = self.codec.encode_image(image)
+
+        jpeg_ends = self.refinement_ends(jpeg)
+        table_len = struct.calcsize(STAGE_COUNT_FORMAT) + (1 + len(jpeg_ends)) * struct.calcsize(STAGE_END_FORMAT)
+        ends = [table_len + len(first)] + [table_len + len(first) + end for end in jpeg_ends]
+        return (struct.pack(STAGE_COUNT_FORMAT, len(ends)) + b''.join(struct.pack(STAGE_END_FORMAT, e) for e in ends)
+                + first + jpeg)
+
+    def refinement_ends(self, jpeg: bytes) -> list:
+        """Where the refinement stages of a progressive JPEG end: after its DC scan, then at the scan boundaries
+        closest to splitting the rest evenly, and at the end of the file
+        """
+        scans = []
+        start = jpeg.find(JPEG_SOS)
+        while start != -1:
+            scans.append(start)
+            start = jpeg.find(JPEG_SOS, start + 1)
+        boundaries = scans[1:]  # A prefix ending before the next scan starts holds whole scans
+        if not boundaries:
+            return [len(jpeg)]
+
+        ends = [boundaries[0]]
+        for k in range(1, self.refinements - 1):
+            target = ends[0] + (len(jpeg) - ends[0]) * k / (self.refinements - 1)
+            end = min(boundaries, key=lambda b: abs(b - target))
+            if end > ends[-1]:
+                ends.append(end)
+        return ends + [len(jpeg)]
+
+    @classmethod
+    def decode(cls, body: bytes) -> list:
+        """The stages in body, which may be cut short, e.g. while it is still being received"""
+        ends = _stage_ends(body)
+        if not ends or len(body) < ends[0]:
+            return []
+        stages = decode_payload(body[_table_len(len(ends)):ends[0]])
+        for end in ends[1:]:
+            if len(body) < end:
+                break
+            jpeg = body[ends[0]:end]
+            stages.append(jpeg if jpeg.endswith(JPEG_EOI) else jpeg + JPEG_EOI)
+        return stages
+
+
+def _table_len(n_stages: int) -> int:
+    return struct.calcsize(STAGE_COUNT_FORMAT) + n_stages * struct.calcsize(STAGE_END_FORMAT)
+
+
+def _stage_ends(body: bytes) -> list:
+    """Where each stage of a progressive payload body ends, or an empty list if body is too short to tell"""
+    if len(body) < struct.calcsize(STAGE_COUNT_FORMAT):
+        return []
+    n_stages, = struct.unpack_from(STAGE_COUNT_FORMAT, body)
+    if len(body) < _table_len(n_stages):
+        return []
+    return [struct.unpack_from(STAGE_END_FORMAT, body, _table_len(i))[0] for i in range(n_stages)]
+
+
+def stage_ends(payload: bytes) -> list:
+    """Offsets into a payload where each of its stages ends, ending with the payload length.
+    Only the start of a progressive payload is needed, other payloads must be complete.
+    """
+    if payload[:HEADER_BYTES] == struct.pack(HEADER_FORMAT, ProgressiveCodec.FORMAT):
+        return [HEADER_BYTES + end for end in _stage_ends(payload[HEADER_BYTES:])]
+    return [len(payload)]
+
+
+def open_image(image: bytes):
+    """Open an image file with Pillow
+    Raises:
+        ValueError: If Pillow is not installed or can not read the image
+    """
+    if Image is None:
+        raise ValueError("Pillow is not installed")
+    try:
+        return Image.open(io.BytesIO(image))
+    except OSError as e:
+        raise ValueError(f"Not a readable image: {e}")
+
+
+def encode_payload(image: bytes, codec: PayloadCodec, fallback: bool = True) -> bytes:
+    """Header and body of the payload for an image file
+    Args:
+        fallback: Whether to send the file raw or deflated, whichever is smaller, if codec can not encode it,
+            rather than raising ValueError
+    """
+    try:
+        return struct.pack(HEADER_FORMAT, codec.FORMAT) + codec.encode(image)
+    except ValueError as e:
+        if not fallback:
+            raise
+        print(f"Can't encode image with {type(codec).__name__} ({e}), sending it as a plain file")
+        return min((encode_payload(image, fallback_codec) for fallback_codec in (RawCodec(), DeflateCodec())), key=len)
+
+
+def decode_payload(payload: bytes) -> list:
+    """Image files in a payload, each stage of the image in the order they were sent
+    Raises:
+        ValueError: If the payload is of an unknown format or truncated
+    """
+    if len(payload) < HEADER_BYTES:
+        raise ValueError("Payload is too short for a header")
+    payload_format, = struct.unpack_from(HEADER_FORMAT, payload)
+    if payload_format not in CODECS:
+        raise ValueError(f"Unknown payload format {payload_format}")
+    try:
+        return CODECS[payload_format].decode(payload[HEADER_BYTES:])
+    except struct.error as e:
+        raise ValueError(f"Truncated payload: {e}")
+
+
+def image_extension(image: bytes) -> str:
+    """File extension for an image file, from its first bytes"""
+    for magic, extension in IMAGE_EXTENSIONS.items():
+        if image.startswith(magic):
+            return extension
+    return '.bin'
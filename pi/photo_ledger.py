@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    number INTEGER PRIMARY KEY,  -- Number the file is named after, allocated in order of capture
+    file_name TEXT NOT NULL UNIQUE,
+    taken REAL,  -- Capture time in seconds since the epoch
+    size INTEGER,  -- Bytes of the file
+    priority INTEGER NOT NULL DEFAULT 0,  -- Higher is sent first
+    confirmed_bytes INTEGER NOT NULL DEFAULT 0,  -- Bytes of the payload the receiver has confirmed
+    payload_bytes INTEGER,  -- Bytes of the payload the picture is sent as, once sending has started
+    sent INTEGER NOT NULL DEFAULT 0,
+    relevance REAL  -- Fraction of the picture that differs from the empty scene, see motion_score, NULL if unknown
+);
+-- Only the unsent pictures are indexed, so the backlog is read without visiting what has been sent
+CREATE INDEX IF NOT EXISTS backlog ON photos (priority DESC, number) WHERE sent = 0;
+"""
+
+# Columns added since the first version of SCHEMA, added to older ledgers when they are opened
+ADDED_COLUMNS = {"relevance": "REAL"}
+
+Photo = namedtuple("Photo", ["file_name", "taken", "size", "priority", "confirmed_bytes", "payload_bytes",
+                             "relevance"])
+Photo.__doc__ = """A picture in the ledger, see SCHEMA"""
+
+
+class PhotoLedger:
+    """Pictures taken by a node and how far each has been sent, kept in a SQLite database.
+    Every change is committed on its own, so the ledger survives the node losing power at any time.
+    Args:
+        path: Database file, created if it does not exist
+
+    Attributes:
+        path: Database file
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA synchronous = FULL")
+        with self.db:
+            self.db.executescript(SCHEMA)
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(photos)")}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE photos ADD COLUMN {column} {column_type}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def next_name(self, image_format: str) -> str:
+        """File name to save the next picture as, numbered one after the last picture taken"""
+        last, = self.db.execute("SELECT MAX(number) FROM photos").fetchone()
+        return f"{(last or 0) + 1}.{image_format}"
+
+    def add(self, file_name: str, taken: float = None, priority: int = 0, relevance: float = None):
+        """Record a picture as taken and not yet sent
+        Args:
+            file_name: Picture file, numbered like next_name() names it
+            taken: Capture time in seconds since the epoch, now by default
+            priority: Pictures of higher priority are sent first
+            relevance: Fraction of the picture that differs from the empty scene, see motion_score
+        """
+        size = os.path.getsize(file_name) if os.path.isfile(file_name) else None
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO photos (number, file_name, taken, size, priority, relevance) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            (_number(file_name), file_name, time.time() if taken is None else taken, size, priority,
+                             relevance))
+
+    def backlog(self) -> list:
+        """Photos not yet sent, highest priority first, then in order of capture"""
+        return [Photo(*row) for row in self.db.execute(
+            f"SELECT {', '.join(Photo._fields)} FROM photos INDEXED BY backlog WHERE sent = 0 "
+            "ORDER BY priority DESC, number")]
+
+    def record_progress(self, file_name: str, confirmed_bytes: int, payload_bytes: int):
+        """Record how many bytes of the payload of a picture the receiver has confirmed"""
+        with self.db:
+            self.db.execute("UPDATE photos SET confirmed_bytes = ?, payload_bytes = ? WHERE file_name = ?",
+                            (confirmed_bytes, payload_bytes, file_name))
+
+    def mark_sent(self, file_names: list):
+        """Record pictures as sent"""
+        with self.db:
+            self.db.executemany("UPDATE photos SET sent = 1, confirmed_bytes = COALESCE(payload_bytes, 0) "
+                                "WHERE file_name = ?", ((file_name,) for file_name in file_names))
+
+    def migrate(self, taken_file: str, sent_file: str) -> int:
+        """Import the pictures listed in the text files of taken and sent pictures the ledger replaces, keeping their
+        order, and rename the files with .migrated appended so that they are imported only once
+        Returns:
+            Number of pictures imported
+        """
+        if not os.path.isfile(taken_file):
+            return 0
+        with open(taken_file) as f:
+            taken = [line.strip() for line in f if line.strip()]
+        sent = set()
+        if os.path.isfile(sent_file):
+            with open(sent_file) as f:
+                sent = {line.strip() for line in f}
+
+        with self.db:
+            for file_name in taken:
+                exists = os.path.isfile(file_name)
+                self.db.execute("INSERT OR IGNORE INTO photos (number, file_name, taken, size, sent) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                (_number(file_name), file_name, os.path.getmtime(file_name) if exists else None,
+                                 os.path.getsize(file_name) if exists else None, file_name in sent))
+        for text_file in (taken_file, sent_file):
+            if os.path.isfile(text_file):
+                os.replace(text_file, text_file + ".migrated")
+        return len(taken)
+
+
+def _number(file_name: str) -> int:
+    """Number a picture file is named after, or None to allocate the next one if it is not named after a number"""
+    stem = os.path.basename(file_name).split(".")[0]
+    return int(stem) if stem.isdigit() else None
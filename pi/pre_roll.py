@@ -0,0 +1,99 @@
+"""Pre-roll capture for nodes with power to spare, on mains or solar: the camera keeps recording low resolution video
+into a ring buffer in memory, so that when the PIR triggers, the frames from before it are still there.
+The video is MJPEG, in which every frame is a keyframe and a complete JPEG, so stills are cut out of the buffer without
+the video decoder H.264 would need.
+"""
+
+import time
+from picamera import PiCameraCircularIO
+from picamera.frames import PiVideoFrameType
+
+PRE_ROLL = 2  # Seconds of video kept from before a trigger
+RESOLUTION = (320, 240)  # Resolution of the video, resized from the camera's
+QUALITY = 10  # JPEG quality of the frames, 1-100
+MAX_BYTES = 1024 * 1024  # Most memory the ring buffer takes, which may hold less than PRE_ROLL of larger frames
+SPLITTER_PORT = 1  # Port of the camera's video splitter the buffer records from
+_PICTURE_FRAMES = (PiVideoFrameType.frame, PiVideoFrameType.key_frame)
+
+
+class PreRollBuffer:
+    """Ring buffer of the last seconds of MJPEG from a camera's video port, to extract stills from around a trigger
+    Args:
+        camera: PiCamera to record from, at the framerate it is set to
+        seconds: Seconds of video to keep from before a trigger
+        resolution: Resolution of the video
+        quality: JPEG quality of the frames, 1-100
+        max_bytes: Most memory the ring buffer takes
+        splitter_port: Port of the camera's video splitter to record from
+
+    Attributes:
+        stream: PiCameraCircularIO holding the video
+    """
+    def __init__(self, camera, seconds: float = PRE_ROLL, resolution: tuple = RESOLUTION, quality: int = QUALITY,
+                 max_bytes: int = MAX_BYTES, splitter_port: int = SPLITTER_PORT):
+        self.camera = camera
+        self.seconds = seconds
+        self.resolution = resolution
+        self.quality = quality
+        self.splitter_port = splitter_port
+        self.stream = PiCameraCircularIO(camera, size=max_bytes, splitter_port=splitter_port)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Start recording into the buffer"""
+        # Without bitrate control, the size of the frames is set by their quality
+        self.camera.start_recording(self.stream, format="mjpeg", resize=self.resolution, quality=self.quality,
+                                    bitrate=0, splitter_port=self.splitter_port)
+
+    def close(self):
+        """Stop recording and free the buffer"""
+        if self.camera.recording:
+            self.camera.stop_recording(splitter_port=self.splitter_port)
+        self.stream.close()
+
+    def frames(self) -> list:
+        """PiVideoFrame of every complete picture in the buffer, oldest first"""
+        return [frame for frame in self.stream.frames if frame.complete and frame.frame_type in _PICTURE_FRAMES]
+
+    def read(self, frame) -> bytes:
+        """The JPEG of a frame in the buffer"""
+        with self.stream.lock:
+            position = self.stream.tell()  # Where the camera goes on writing
+            try:
+                self.stream.seek(frame.position)  # Offset in the buffer, not in the whole recording
+                return self.stream.read(frame.frame_size)
+            finally:
+                self.stream.seek(position)
+
+    def extract(self, after: int = 2, timeout: float = 2) -> list:
+        """JPEG stills around a trigger happening now: the frame from up to seconds before it, or the oldest frame in
+        the buffer if it holds less, and the next frames recorded after it
+        Args:
+            after: Number of frames after the trigger to extract
+            timeout: Most seconds to wait for the frames after the trigger
+        Returns:
+            The JPEGs, the one from before the trigger first. Fewer than after + 1 if the frames did not arrive in time.
+        """
+        frames = self.frames()
+        stills = []
+        trigger_index = -1
+        if frames:
+            trigger = frames[-1]
+            trigger_index = trigger.index
+            pre_roll = [frame for frame in frames if frame.timestamp is not None and trigger.timestamp is not None
+                        and trigger.timestamp - frame.timestamp <= self.seconds * 1000000]
+            stills.append(self.read(pre_roll[0] if pre_roll else frames[0]))
+
+        deadline = time.monotonic() + timeout
+        while True:
+            later = [frame for frame in self.frames() if frame.index > trigger_index][:after]
+            if len(later) == after or time.monotonic() >= deadline:
+                break
+            self.camera.wait_recording(1 / float(self.camera.framerate), splitter_port=self.splitter_port)
+        return stills + [self.read(frame) for frame in later]
@@ -10,12 +10,15 @@ class SendBattery(LoraBase):
     """
     Sends battery voltage
     """
-    def __init__(self, arduino: ArduinoCom):
+    def __init__(self, arduino: ArduinoCom, lora=None):
         """
         Class initializer
+        Args:
+            lora: Connection of an open session to send over, rather than connecting in send
         """
         super().__init__()
         self.arduino = arduino
+        self.lora = lora
 
     def send(self):
         """
@@ -26,14 +29,22 @@ class SendBattery(LoraBase):
         """
         lora = self.init_lora()
 
-        if lora and ThreeWayHandshake(lora).request_conn():
-            self.lora.send_message(self._START_BAT_TRANS, self._MAX_TX_TRIES)
-            battery_msg = encode_float(self.arduino.get_battery())
-            self.lora.send_message(battery_msg, self._MAX_TX_TRIES)
-            self.lora.send_message(self._FINISH_BAT_TRANS, self._MAX_TX_TRIES)
-
+        if lora and (self._NODE_IDS or ThreeWayHandshake(lora).request_conn()):
+            self.send_reading()
             self.close_serial_conn()
 
+    def send_reading(self):
+        """
+        Send the battery voltage over the open connection, framed by its start and finish markers
+        Raises:
+            LoraTxTimeoutException: If sending times out. Timeout length is defined in base class
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        self.lora.send_message(self._START_BAT_TRANS, self._MAX_TX_TRIES, window=self._WINDOW)
+        battery_msg = encode_float(self.arduino.get_battery())
+        self.lora.send_message(battery_msg, self._MAX_TX_TRIES, window=self._WINDOW)
+        self.lora.send_message(self._FINISH_BAT_TRANS, self._MAX_TX_TRIES, window=self._WINDOW)
+
 
 def main():
     SendBattery().send()
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 
-import tarfile
+import os
+import struct
+import zlib
 from lora_base import LoraBase
 from lora import ThreeWayHandshake
+from transfer_journal import TransferJournal, decode_ranges, FILE_FORMAT, OFFSET_FORMAT, OFFSET_BYTES
+from payload_codec import encode_payload, stage_ends, ProgressiveCodec
 
 
 class SendImage(LoraBase):
@@ -10,14 +14,20 @@ class SendImage(LoraBase):
     Send image class
     """
 
-    TAR_FILE = "photo.tar.gz"
+    CODEC = ProgressiveCodec()  # Encoding of the image on air. Without Pillow, the camera's JPEG is sent as it is
 
-    def __init__(self, file_name):
+    def __init__(self, file_name, lora=None, progress=None):
         """
         Class initializer
+        Args:
+            lora: Connection of an open session to send over, rather than connecting in start_sending
+            progress: Called with the bytes of the payload confirmed so far and its size, whenever progress of a
+                resumable transfer is saved
         """
         super().__init__()
         self.file_name = file_name
+        self.lora = lora
+        self.progress = progress
 
     def start_sending(self):
         """
@@ -31,16 +41,8 @@ class SendImage(LoraBase):
         lora = self.init_lora()
 
         if lora:
-            if ThreeWayHandshake(lora).request_conn():
-                with tarfile.open(self.TAR_FILE, "w:gz") as tar:
-                    tar.add(self.file_name)
-                with open(self.TAR_FILE, "rb") as f:
-                    tar_bytes = f.read()
-
-                self.lora.send_message(self._START_IMG_TRANS, self._MAX_TX_TRIES)
-                self.lora.send_message(tar_bytes, self._MAX_TX_TRIES)
-                self.lora.send_message(self._FINISH_IMG_TRANS, self._MAX_TX_TRIES)
-
+            if self._NODE_IDS or ThreeWayHandshake(lora).request_conn():
+                self.send()
                 self.close_serial_conn()
                 return True
 
@@ -50,6 +52,104 @@ class SendImage(LoraBase):
 
         return False
 
+    def send(self, stages: int = None):
+        """
+        Send the image over the open connection, framed by its start and finish markers
+        Args:
+            stages: Number of stages of an image sent in stages to send, None for all. A resumable transfer cut short
+                continues with the next stage when the image is sent again.
+        Raises:
+            LoraTxTimeoutException: If sending times out. Timeout length is defined in base class
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        payload = self.encode_image()
+
+        if self._NODE_IDS:
+            self.lora.send_message(self._START_IMG_TRANS, self._MAX_TX_TRIES, window=self._WINDOW)
+            self.lora.send_message(payload, self._MAX_TX_TRIES, window=self._WINDOW)
+        else:
+            self.send_resumable(payload, stages)
+        self.lora.send_message(self._FINISH_IMG_TRANS, self._MAX_TX_TRIES, window=self._WINDOW)
+
+    def encode_image(self) -> bytes:
+        """
+        Encode the image as a payload with CODEC, byte for byte the same every time so that an interrupted transfer
+        can resume
+        """
+        with open(self.file_name, "rb") as f:
+            return encode_payload(f.read(), self.CODEC)
+
+    def send_resumable(self, payload: bytes, stages: int = None):
+        """
+        Send payload, skipping the byte ranges the receiver already has from earlier attempts.
+        Stops after the given number of stages, or after the last one if stages is None.
+        Every segment starts with its offset into payload, and progress is journaled after every batch of segments.
+        A payload in stages, like a thumbnail followed by refinements, is sent one stage at a time. After each stage
+        the receiver answers which stage it wants to stop after, so it can settle for a coarser image.
+        Raises:
+            LoraTxTimeoutException: If sending times out. Timeout length is defined in base class
+            LoraRxTimeoutException: If the receiver does not answer which ranges it has
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        file_id = zlib.crc32(payload)
+        os.makedirs(self._JOURNAL_DIR, exist_ok=True)
+        journal = TransferJournal(os.path.join(self._JOURNAL_DIR, f"{file_id:08x}.json"), len(payload))
+        if journal.ranges:
+            print(f"Resuming, {journal.confirmed_offset()} of {len(payload)} bytes confirmed before")
+
+        self.lora.send_message(self._RESUME_IMG_TRANS + struct.pack(FILE_FORMAT, file_id, len(payload)),
+                               self._MAX_TX_TRIES, window=self._WINDOW)
+        # The receiver's journal is the authority on what has arrived
+        journal.replace(decode_ranges(self.lora.recv_message(self._RX_TIMEOUT, self._WINDOW).message))
+        print(f"Receiver has {len(payload) - sum(end - start for start, end in journal.missing())} bytes")
+
+        ends = stage_ends(payload)
+        stage_start = 0
+        for stage, stage_end in enumerate(ends):
+            missing = [(max(start, stage_start), min(end, stage_end)) for start, end in journal.missing()
+                       if start < stage_end and end > stage_start]
+            self.send_segments(payload, missing, journal)
+            stage_start = stage_end
+
+            # The receiver was already asked about stages it had from an earlier attempt
+            if missing and stage < len(ends) - 1:
+                self.lora.send_message(self._STAGE_DONE + bytes([stage]), self._MAX_TX_TRIES, window=self._WINDOW)
+                answer = self.lora.recv_message(self._RX_TIMEOUT, self._WINDOW).message
+                if answer.startswith(self._LAST_STAGE) and answer[len(self._LAST_STAGE):] <= bytes([stage]):
+                    print(f"Receiver stops after stage {stage} of {len(ends) - 1}")
+                    break
+            if stages is not None and stage >= stages - 1:
+                print(f"Stopping after stage {stage} of {len(ends) - 1}, the rest is sent later")
+                break
+        journal.remove()
+
+    def send_segments(self, payload: bytes, ranges: list, journal: TransferJournal):
+        """
+        Send the [start, end) ranges of payload in batches of offset segments, adding each batch to journal once sent
+        Raises:
+            LoraTxTimeoutException: If sending times out. Timeout length is defined in base class
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        # Segments must match the ones LoraConnection splits messages into, so each carries its own offset
+        data_bytes = self.lora.planner.FRAME_BYTES - self.lora.planner.header_bytes(self._WINDOW) - OFFSET_BYTES
+        segments = [(seg_start, min(seg_start + data_bytes, end))
+                    for start, end in ranges for seg_start in range(start, end, data_bytes)]
+        batch_start = 0
+        while batch_start < len(segments):
+            # Only the last segment of a message may be short
+            batch_end = batch_start + 1
+            while (batch_end < len(segments) and batch_end - batch_start < self._RESUME_BATCH
+                   and segments[batch_end - 1][1] - segments[batch_end - 1][0] == data_bytes):
+                batch_end += 1
+            batch = segments[batch_start:batch_end]
+
+            message = b''.join(struct.pack(OFFSET_FORMAT, start) + payload[start:end] for start, end in batch)
+            self.lora.send_message(message, self._MAX_TX_TRIES, window=self._WINDOW)
+            journal.add_all(batch)
+            if self.progress:
+                self.progress(journal.confirmed_offset(), journal.size)
+            batch_start = batch_end
+
 
 def main():
     snd_img = SendImage("image.jpg")
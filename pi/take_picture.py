@@ -1,5 +1,11 @@
 from picamera import PiCamera
+from picamera.array import PiYUVArray
+import io
+import numpy as np
 from os.path import isfile
+from PIL import Image
+from photo_ledger import PhotoLedger
+from motion_score import BackgroundModel, best_frame, BLOCK
 
 # Output image resolution.
 IMAGE_RES = (640, 480)
@@ -7,74 +13,123 @@ JPG_QUALITY = 10
 IMAGE_FORMAT = "jpeg"
 BW_IMAGE = False
 VERT_FLIP = True
+MOTION_RES = (160, 120)  # Resolution of the frame scored for motion, see motion_score
+BACKGROUND_FILE = "background.npy"  # Rolling background model of the scene, the frames are scored against
+BURST_FRAMES = 8  # Frames captured by take_burst, of which only the best one is kept
+BURST_RATE = 8  # Frames per second of a burst
 
+LEDGER_FILE = "photos.db"
+# Text files of the pictures taken and sent, kept before the ledger. Migrated into it the first time it is opened.
 TAKEN_FILE = "taken_pics.txt"
 SENT_FILE = "sent_pics.txt"
 
 
-def take_pic():
-    """Captures an image from the camera and remembers it as taken but not yet sent"""
+def open_ledger() -> PhotoLedger:
+    """Open the ledger of the pictures taken, migrating the text files it replaces"""
+    ledger = PhotoLedger(LEDGER_FILE)
+    ledger.migrate(TAKEN_FILE, SENT_FILE)
+    return ledger
+
+
+def take_pic(priority: int = 0):
+    """Captures an image from the camera and remembers it as taken but not yet sent, scored by how much of it differs
+    from the background the earlier images were scored against
+    Args:
+        priority: Pictures of higher priority are sent first
+    """
     file_path = get_next_image_name()
+    background = BackgroundModel(BACKGROUND_FILE)
     try:
         camera = PiCamera(resolution=IMAGE_RES)
         if (BW_IMAGE):
             camera.color_effects = (128, 128)
         camera.vflip = VERT_FLIP
         camera.capture(file_path, format=IMAGE_FORMAT, quality=JPG_QUALITY)
+        with PiYUVArray(camera, size=MOTION_RES) as frame:
+            camera.capture(frame, format="yuv", resize=MOTION_RES, use_video_port=True)
+            relevance = background.score(frame.array[:, :, 0])
     finally:
         camera.close()
+    background.save()
 
-    print("Picture captured")
-    with open(TAKEN_FILE, "a+") as f:
-        f.write(file_path + '\n')
+    print(f"Picture captured, {relevance:.0%} of it differs from the background")
+    with open_ledger() as ledger:
+        ledger.add(file_path, priority=priority, relevance=relevance)
 
 
-def get_unsent_pics():
-    """Gets all taken camera image which have not yet been sent"""
-    # Need to create files if they do not already exist
-    open(SENT_FILE, "a").close()
-    open(TAKEN_FILE, "a").close()
+def take_burst(frames: int = BURST_FRAMES, priority: int = 0):
+    """Captures a burst of frames from the camera's video port into memory, and keeps only the sharpest of those still
+    showing what triggered it, scored and remembered like take_pic does. Catches an animal the camera's startup
+    latency would otherwise miss or blur, without sending more than one image.
+    Args:
+        frames: Number of frames to capture, at BURST_RATE
+        priority: Pictures of higher priority are sent first
+    """
+    file_path = get_next_image_name()
+    # Blocks covering the same part of the scene as at MOTION_RES, so that the background fits either
+    background = BackgroundModel(BACKGROUND_FILE, block=BLOCK * IMAGE_RES[0] // MOTION_RES[0])
+    try:
+        camera = PiCamera(resolution=IMAGE_RES, framerate=BURST_RATE)
+        if (BW_IMAGE):
+            camera.color_effects = (128, 128)
+        camera.vflip = VERT_FLIP
+        outputs = [PiYUVArray(camera) for _ in range(frames)]
+        camera.capture_sequence(outputs, format="yuv", use_video_port=True)
+    finally:
+        camera.close()
 
-    unsent = []
-    with open(TAKEN_FILE, "r") as taken:
-        with open(SENT_FILE, "r") as sent:
-            for line in taken:
-                image = line.strip()
-                if image not in sent and isfile(image):
-                    unsent.append(image)
-    return unsent
+    lumas = [output.array[:, :, 0] for output in outputs]
+    best = best_frame(lumas, background)
+    relevance = background.score(lumas[best])
+    background.save()
+    Image.fromarray(outputs[best].rgb_array).save(file_path, IMAGE_FORMAT, quality=JPG_QUALITY)
+
+    print(f"Picture {best + 1} of a burst of {frames} kept, {relevance:.0%} of it differs from the background")
+    with open_ledger() as ledger:
+        ledger.add(file_path, priority=priority, relevance=relevance)
+
+
+def queue_stills(stills: list, priority: int = 0):
+    """Saves JPEG stills, e.g. extracted from a PreRollBuffer, and remembers them as taken but not yet sent, scored
+    against the background without adding them to it
+    Args:
+        stills: JPEGs to queue, oldest first
+        priority: Pictures of higher priority are sent first
+    """
+    background = BackgroundModel(BACKGROUND_FILE)
+    with open_ledger() as ledger:
+        for still in stills:
+            file_path = ledger.next_name(IMAGE_FORMAT)
+            with open(file_path, "wb") as f:
+                f.write(still)
+            luma = np.asarray(Image.open(io.BytesIO(still)).convert("L").resize(MOTION_RES))
+            relevance = background.compare(luma)
+            ledger.add(file_path, priority=priority, relevance=relevance)
+            print(f"Still {file_path} queued, {relevance:.0%} of it differs from the background")
+
+
+def get_backlog():
+    """Gets the ledger entries of all taken camera images which have not yet been sent"""
+    with open_ledger() as ledger:
+        return [photo for photo in ledger.backlog() if isfile(photo.file_name)]
 
 
 def mark_pics_sent(file_paths) -> None:
     """Mark one or more camera images as sent"""
-    with open(SENT_FILE, "a+") as sent_file:
-        if (isinstance(file_paths, str)):
-            if not file_paths[-1] == '\n':
-                file_paths += '\n'
-            sent_file.write(file_paths)
-        else:
-            paths_with_line_ends = []
-            for fp in file_paths:
-                paths_with_line_ends.append(fp if fp[-1] == '\n' else fp + '\n')
-            sent_file.writelines(paths_with_line_ends)
+    with open_ledger() as ledger:
+        ledger.mark_sent([file_paths] if isinstance(file_paths, str) else file_paths)
+
+
+def record_progress(file_path: str, confirmed_bytes: int, payload_bytes: int) -> None:
+    """Remember how much of a camera image the basestation has confirmed"""
+    with open_ledger() as ledger:
+        ledger.record_progress(file_path, confirmed_bytes, payload_bytes)
 
 
 def get_next_image_name():
     """Get file name to save next image as"""
-    try:
-        with open(TAKEN_FILE, 'r') as f:
-            lines = f.readlines()
-            if lines:
-                last_image = lines[-1]
-                ending_index = last_image.find(f".{IMAGE_FORMAT}")
-                return "{}.{}".format(
-                    int(last_image[:ending_index]) + 1,
-                    IMAGE_FORMAT
-                )
-            else:
-                return f"1.{IMAGE_FORMAT}"
-    except FileNotFoundError:
-        return f"1.{IMAGE_FORMAT}"
+    with open_ledger() as ledger:
+        return ledger.next_name(IMAGE_FORMAT)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+import json
+import os
+import struct
+
+RANGE_FORMAT = ">II"  # Start and end (exclusive) of a byte range
+RANGE_BYTES = struct.calcsize(RANGE_FORMAT)
+FILE_FORMAT = ">II"  # ID and size of a file, announced when starting a resumable transfer
+OFFSET_FORMAT = ">I"  # Offset into the file in front of each segment of a resumable transfer
+OFFSET_BYTES = struct.calcsize(OFFSET_FORMAT)
+
+
+class TransferJournal:
+    """Byte ranges of a file that have been acknowledged, kept on disk so that an interrupted transfer can resume
+    where it stopped. The journal is rewritten atomically on every change.
+    Args:
+        path: File to keep the journal in
+        size: Size in bytes of the file being transferred. A journal on disk for a different size is discarded.
+
+    Attributes:
+        path: File the journal is kept in
+        size: Size in bytes of the file being transferred
+        ranges: Sorted, non-overlapping [start, end) ranges acknowledged so far
+    """
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.ranges = []
+
+        try:
+            with open(path, "r") as f:
+                journal = json.load(f)
+            if journal["size"] == size:
+                self.ranges = [tuple(r) for r in journal["ranges"]]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def add(self, start: int, end: int):
+        """Record the range [start, end) as acknowledged"""
+        self.add_all([(start, end)])
+
+    def add_all(self, ranges: list):
+        """Record all [start, end) ranges as acknowledged, with a single write of the journal"""
+        merged = []
+        for start, end in sorted(self.ranges + [(max(s, 0), min(e, self.size)) for s, e in ranges if s < e]):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.ranges = merged
+        self.save()
+
+    def replace(self, ranges: list):
+        """Make ranges the acknowledged ones, e.g. as reported by the other end of the transfer"""
+        self.ranges = []
+        self.add_all(ranges)
+
+    def missing(self) -> list:
+        """The [start, end) ranges not yet acknowledged"""
+        missing = []
+        offset = 0
+        for start, end in self.ranges:
+            if start > offset:
+                missing.append((offset, start))
+            offset = end
+        if offset < self.size:
+            missing.append((offset, self.size))
+        return missing
+
+    def confirmed_offset(self) -> int:
+        """Number of bytes from the start of the file acknowledged without gaps"""
+        return self.ranges[0][1] if self.ranges and self.ranges[0][0] == 0 else 0
+
+    def complete(self) -> bool:
+        return not self.missing()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"size": self.size, "ranges": self.ranges}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def encode_ranges(ranges: list, max_bytes: int) -> bytes:
+    """Encode a count followed by as many ranges as fit in max_bytes. The receiver treats any range left out as missing."""
+    ranges = ranges[:min((max_bytes - 1) // RANGE_BYTES, 255)]
+    return bytes([len(ranges)]) + b''.join(struct.pack(RANGE_FORMAT, start, end) for start, end in ranges)
+
+
+def decode_ranges(b: bytes) -> list:
+    """Decode ranges encoded with encode_ranges"""
+    try:
+        return [struct.unpack_from(RANGE_FORMAT, b, 1 + i * RANGE_BYTES) for i in range(b[0])]
+    except (IndexError, struct.error) as e:
+        print("Error decoding ranges '{}': {}".format(b, e))
+        return []
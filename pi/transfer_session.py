@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+from lora_base import LoraBase
+from lora import ThreeWayHandshake, LinkPlanner
+from send_image import SendImage
+from send_battery import SendBattery
+from tx_scheduler import TxScheduler
+
+
+class TransferSession(LoraBase):
+    """
+    One connection to the basestation for everything a node has to send when it wakes up.
+    The RN2483 is initialised and the handshake made once, after which each image or battery reading is sent framed
+    by its own start and finish markers, and the session is ended with _END_SESSION.
+    """
+
+    def open(self, queued_bytes: int = 0) -> bool:
+        """
+        Initialise the radio and connect to the basestation
+        Args:
+            queued_bytes: Bytes the node is about to send, announced in the handshake
+        Returns:
+            True if the session is open, else false
+        """
+        if not self.init_lora():
+            return False
+        if self._NODE_IDS or ThreeWayHandshake(self.lora).request_conn(queued_bytes):
+            return True
+        print("3-way handshake failed.")
+        self.close_serial_conn()
+        return False
+
+    def plan(self, backlog: list, low_battery: bool = False) -> list:
+        """
+        What to send this wake cycle without breaching the duty cycle limits or the energy budget, see TxScheduler
+        Args:
+            backlog: Photos not yet sent, see PhotoLedger.backlog()
+            low_battery: Whether to send the battery voltage, first, and spend only _LOW_BATTERY_ENERGY
+        Returns:
+            Transmissions in the order to send them. What does not fit is left for the next wake cycle.
+        """
+        planner = self.lora.planner if self.lora else LinkPlanner()
+        airtime = self.duty_cycle.remaining_airtime(planner.bandwidth, self._AWAKE_TIME)
+        energy = self._LOW_BATTERY_ENERGY if low_battery else self._WAKE_ENERGY
+        return TxScheduler(planner, airtime, energy, self._WINDOW).plan(backlog, low_battery)
+
+    def send_image(self, file_name: str, progress=None, stages: int = None):
+        """
+        Send an image within the session
+        Args:
+            progress: Called with the bytes of the payload confirmed so far and its size, see SendImage
+            stages: Number of stages of the image to send, None for all, see SendImage.send()
+        Raises:
+            LoraTxTimeoutException: If sending times out. Timeout length is defined in base class
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        SendImage(file_name, self.lora, progress).send(stages)
+
+    def send_battery(self, arduino):
+        """
+        Send the battery voltage within the session
+        Raises:
+            LoraTxTimeoutException: If sending times out. Timeout length is defined in base class
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        SendBattery(arduino, self.lora).send_reading()
+
+    def close(self):
+        """
+        Tell the basestation the session is over and close the serial connection
+        Raises:
+            LoraTxTimeoutException: If sending times out. Timeout length is defined in base class
+            SerialConnectionException: If serial connection to the RN2483 LoRa module times out
+        """
+        try:
+            if self._NODE_IDS:
+                self.lora.finish()
+            else:
+                self.lora.send_message(self._END_SESSION, self._MAX_TX_TRIES, window=self._WINDOW)
+        finally:
+            self.close_serial_conn()
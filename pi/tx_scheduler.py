@@ -0,0 +1,102 @@
+import time
+from collections import namedtuple
+from lora import LinkPlanner
+
+# Tiers of queued items, sent in this order
+BATTERY_ALARM, RECENT_IMAGE, THUMBNAIL, OLDER_IMAGE, EMPTY_THUMBNAIL = range(5)
+
+Transmission = namedtuple("Transmission", ["file_name", "stages", "payload_bytes", "last"])
+Transmission.__doc__ = """Something to send in a wake cycle: an image file, or None for the battery voltage, the
+number of stages of the image to send, None for all of them, the bytes expected to go on air, and whether nothing more
+of the image is to be sent after it"""
+
+THUMBNAIL_BYTES = 512  # Estimated bytes of the first stage of a ProgressiveCodec payload, its thumbnail
+BATTERY_BYTES = 4  # Bytes of an encoded battery voltage
+TX_POWER = 0.13  # W drawn by the RN2483 while transmitting at 14 dBm
+AWAKE_POWER = 0.6  # W drawn by the node while it is awake, sending or not
+MIN_RELEVANCE = 0.03  # Relevance below which an image is most likely empty, see motion_score
+
+
+class TxScheduler:
+    """Picks what a node sends in a wake cycle, within a budget of airtime and energy.
+    Queued items are scored in tiers: a battery alarm first, then the recent images in full, then thumbnails of the
+    images that are not sent in full, then the older images in full, each tier by priority and newest first.
+    Images scored as most likely empty are only ever sent as thumbnails, after everything else, to check on them.
+    Every item that fits what is left of the budget is taken, so smaller items still fill the budget after a larger
+    one is left out. Items left out roll over to the next wake cycle.
+    Sizes are estimated before the images are encoded, so the budget is not exact.
+    Args:
+        planner: Time on air of the radio configuration
+        airtime_ms: Airtime the duty cycle allows this wake cycle, e.g. DutyCycleScheduler.remaining_airtime()
+        energy: J the node may spend sending this wake cycle
+        window: Window the items are sent with
+        recent_s: Age in seconds up to which an image is sent in full before the thumbnails of older ones
+        min_relevance: Relevance below which an image is most likely empty, see PhotoLedger.add()
+        clock: Provides time(), to tell the age of images
+    """
+    def __init__(self, planner: LinkPlanner, airtime_ms: float, energy: float, window: int = 1,
+                 recent_s: float = 6 * 3600, min_relevance: float = MIN_RELEVANCE, clock=time):
+        self.planner = planner
+        self.airtime_ms = airtime_ms
+        self.energy = energy
+        self.window = window
+        self.recent_s = recent_s
+        self.min_relevance = min_relevance
+        self.clock = clock
+
+    def cost(self, payload_bytes: int) -> (float, float):
+        """ms of airtime and J of energy to send a payload"""
+        airtime = self.planner.airtime(payload_bytes, self.window)
+        transfer_time = self.planner.transfer_time(payload_bytes, self.window)
+        return airtime, (airtime * TX_POWER + transfer_time * AWAKE_POWER) / 1000
+
+    def plan(self, backlog: list, battery_alarm: bool = False) -> list:
+        """The Transmissions to make this wake cycle, in the order to send them
+        Args:
+            backlog: Photos not yet sent, see PhotoLedger.backlog()
+            battery_alarm: Whether the battery voltage is to be sent
+        """
+        now = self.clock.time()
+        by_score = sorted(backlog, key=lambda photo: (-photo.priority, -(photo.taken or 0)))
+        empty = [photo for photo in by_score if photo.relevance is not None and photo.relevance < self.min_relevance]
+        relevant = [photo for photo in by_score if photo not in empty]
+        recent = [photo for photo in relevant if photo.taken is not None and now - photo.taken <= self.recent_s]
+        older = [photo for photo in relevant if photo not in recent]
+        candidates = (([(BATTERY_ALARM, None)] if battery_alarm else [])
+                      + [(RECENT_IMAGE, photo) for photo in recent]
+                      + [(THUMBNAIL, photo) for photo in relevant if not photo.confirmed_bytes]
+                      + [(OLDER_IMAGE, photo) for photo in older]
+                      + [(EMPTY_THUMBNAIL, photo) for photo in empty])
+
+        airtime_left, energy_left = self.airtime_ms, self.energy
+        chosen = {}  # Transmission by file name, in the order first chosen
+        for tier, photo in candidates:
+            if tier == BATTERY_ALARM:
+                file_name, stages, payload_bytes = None, None, BATTERY_BYTES
+            else:
+                file_name, stages, payload_bytes = photo.file_name, None, remaining_bytes(photo)
+                if tier in (THUMBNAIL, EMPTY_THUMBNAIL):
+                    if file_name in chosen:
+                        continue
+                    stages, payload_bytes = 1, min(THUMBNAIL_BYTES, payload_bytes)
+                elif file_name in chosen:
+                    # The rest of an image whose thumbnail is already chosen
+                    payload_bytes -= chosen[file_name].payload_bytes
+
+            airtime, energy = self.cost(payload_bytes)
+            if airtime > airtime_left or energy > energy_left:
+                continue
+            airtime_left -= airtime
+            energy_left -= energy
+            if file_name in chosen:
+                payload_bytes += chosen[file_name].payload_bytes
+            last = stages is None or tier == EMPTY_THUMBNAIL
+            chosen[file_name] = Transmission(file_name, stages, payload_bytes, last)
+        return list(chosen.values())
+
+
+def remaining_bytes(photo) -> int:
+    """Bytes of a photo still to send, estimated from its file size until it has been encoded"""
+    if photo.payload_bytes is None:
+        return photo.size or 0
+    return photo.payload_bytes - photo.confirmed_bytes
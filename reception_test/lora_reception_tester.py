@@ -3,7 +3,7 @@
 from random import getrandbits, seed
 import sys
 sys.path.append('../pi')
-from lora import get_serial_connection, LoraConnection
+from lora import get_serial_connection, LoraConnection, FrameCodec
 
 
 class LoraReceptionTester:
@@ -20,7 +20,8 @@ class LoraReceptionTester:
     __LORA_DEBUG_PCKTS = False
     __LORA_DEBUG_ACK_NACK = False
 
-    _BYTES_PER_PCKT = 254  # 1-254 for LoRa, 1-63 for FSK (if 1 byte seq num)
+    _BYTES_PER_PCKT = 254  # 1-254 for LoRa (less 4 + _FEC_PARITY_BYTES with FEC), 1-63 for FSK (if 1 byte seq num)
+    _FEC_PARITY_BYTES = 0  # Reed-Solomon parity bytes per frame, 0 for no FEC. Unrepairable frames count as radio errors
     _RNDM_DAT = False
     _PCKT_DELAY = 0  # Delay between each of our packets
 
@@ -47,7 +48,8 @@ class LoraReceptionTester:
                                    freq=self.__LORA_SRL_FREQ,
                                    sf=self.__LORA_SRL_SF,
                                    debug_packets=self.__LORA_DEBUG_PCKTS,
-                                   debug_ack_nack=self.__LORA_DEBUG_ACK_NACK)
+                                   debug_ack_nack=self.__LORA_DEBUG_ACK_NACK,
+                                   fec=FrameCodec(self._FEC_PARITY_BYTES) if self._FEC_PARITY_BYTES else None)
         print("LoRa module connected.\n")
 
     def expctd_msg(self):
@@ -0,0 +1,40 @@
+"""BackgroundModel kept in memory and in a file"""
+
+import os
+import sys
+import tempfile
+import unittest
+from os import path
+import numpy as np
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+from motion_score import BackgroundModel
+
+RESOLUTION = (160, 120)
+
+
+def frame(luma: int) -> np.ndarray:
+    """A flat 2D luma plane"""
+    return np.full(RESOLUTION[::-1], luma, dtype=np.uint8)
+
+
+class BackgroundModelTest(unittest.TestCase):
+    def test_save_without_path(self):
+        """A model started empty every time has nothing to save to, and is left as it is"""
+        background = BackgroundModel(None)
+        background.score(frame(100))
+        background.save()
+        self.assertEqual(background.compare(frame(100)), 0.0)
+
+    def test_save_and_load(self):
+        """A saved background is compared to after loading it again"""
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "background.npy")
+            background = BackgroundModel(file_name)
+            background.score(frame(100))
+            background.save()
+            self.assertEqual(os.listdir(directory), ["background.npy"])
+            self.assertEqual(BackgroundModel(file_name).compare(frame(100)), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
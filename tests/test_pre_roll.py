@@ -0,0 +1,92 @@
+"""PreRollBuffer on a fake camera writing MJPEG into it like the camera's encoder does, in chunks, with the frame's
+metadata set when its last chunk is written. Needs picamera, so it only runs on a Pi.
+"""
+
+import io
+import sys
+import unittest
+from os import path
+from PIL import Image
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'pi'))
+try:
+    from picamera.frames import PiVideoFrame, PiVideoFrameType
+    from pre_roll import PreRollBuffer
+except (ImportError, OSError) as e:  # picamera loads libbcm_host.so, which only a Pi has
+    raise unittest.SkipTest(f"picamera unavailable: {e}")
+
+FRAMERATE = 10
+RESOLUTION = (64, 48)
+CHUNKS = 3  # Chunks the encoder writes each frame in
+MAX_BYTES = 8 * 1024  # Holds a little more than 2 s of the frames
+
+
+def gray(index: int) -> int:
+    """Luma of the frame with an index, telling the frames apart after decoding"""
+    return index * 7 % 256
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.frame = PiVideoFrame(-1, PiVideoFrameType.frame, 0, 0, 0, None, True)
+
+
+class FakeCamera:
+    """Writes a frame into the recording stream every time it is waited on"""
+    def __init__(self, splitter_port: int):
+        self.framerate = FRAMERATE
+        self.recording = False
+        self.stream = None
+        self._encoders = {splitter_port: FakeEncoder()}
+        self.written = 0
+
+    def start_recording(self, stream, format, splitter_port, **options):
+        assert format == "mjpeg"
+        self.stream = stream
+        self.recording = True
+
+    def stop_recording(self, splitter_port):
+        self.recording = False
+
+    def wait_recording(self, timeout, splitter_port):
+        for _ in range(max(1, round(timeout * self.framerate))):
+            self.write_frame(splitter_port)
+
+    def write_frame(self, splitter_port: int):
+        encoder = self._encoders[splitter_port]
+        index = encoder.frame.index + 1
+        jpeg = io.BytesIO()
+        Image.new("L", RESOLUTION, gray(index)).save(jpeg, "jpeg")
+        data = jpeg.getvalue()
+        timestamp = index * 1000000 // self.framerate
+        bounds = [len(data) * n // CHUNKS for n in range(CHUNKS + 1)]
+        for start, end in zip(bounds, bounds[1:]):
+            encoder.frame = PiVideoFrame(index, PiVideoFrameType.frame, end, self.written + end, self.written + end,
+                                         timestamp, end == len(data))
+            self.stream.write(data[start:end])
+        self.written += len(data)
+
+
+class PreRollBufferTest(unittest.TestCase):
+    def test_extract_after_wrapping(self):
+        """The stills extracted once the ring buffer has wrapped are the JPEGs of the frames around the trigger"""
+        camera = FakeCamera(splitter_port=1)
+        seconds = 1
+        with PreRollBuffer(camera, seconds=seconds, resolution=RESOLUTION, max_bytes=MAX_BYTES) as buffer:
+            camera.wait_recording(10, splitter_port=1)
+            self.assertGreater(camera.written, 2 * MAX_BYTES)
+            trigger = buffer.frames()[-1].index
+            self.assertGreater(trigger - buffer.frames()[0].index, seconds * FRAMERATE)
+
+            stills = buffer.extract(after=2)
+
+        self.assertEqual(len(stills), 3)
+        expected = [trigger - seconds * FRAMERATE, trigger + 1, trigger + 2]
+        for still, index in zip(stills, expected):
+            image = Image.open(io.BytesIO(still))
+            image.load()
+            self.assertEqual(image.size, RESOLUTION)
+            self.assertAlmostEqual(image.getpixel((0, 0)), gray(index), delta=2)
+
+
+if __name__ == '__main__':
+    unittest.main()